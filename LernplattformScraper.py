@@ -1,21 +1,37 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
 import json
 import sys
+import time
 import yaml
 import logging
+from urllib.parse import urlparse
 
 from mebis_scraper.scrapers import LernplattformScraper
+from mebis_scraper.http_scrapers import LernplattformHTTPScraper
+from mebis_scraper.parallel_scrapers import LernplattformParallelScraper
+from mebis_scraper.cache import StructureCache
 from mebis_scraper.visitors import LernplattformFilterVisitor
 from mebis_scraper.acceptors import (LernplattformCompositeAcceptor,
                                      LernplattformListerAcceptor,
                                      LernplattformFlatListerAcceptor,
+                                     LernplattformStreamingListerAcceptor,
+                                     LernplattformBinaryListerAcceptor,
                                      LernplattformDownloadAcceptor,
                                      LernplattformCompletionFilterAcceptor,
                                      LernplattformCompletionSyncAcceptor)
 from selenium_scraping.auth import (AuthenticationManager,
                                     MebisSAMLAuthenticator)
 from selenium_scraping.profiles import make_firefox_profile
+from selenium_scraping.pool import WebDriverPool
+from selenium_scraping.download import DownloadWatcher
+from selenium_scraping.blobstore import BlobStore
+from selenium_scraping.manifest import DownloadManifest
+from selenium_scraping.cookies import EncryptedCookieJar
+from selenium_scraping.stats import count_commands
+from tools.coursedump_binary import (COMPRESSIONS, DEFAULT_COMPRESSION,
+                                     BinaryCoursedumpWriter)
 
 
 if __name__ == '__main__':
@@ -49,12 +65,132 @@ if __name__ == '__main__':
                         default=True,
                         dest='selenium_headless',
                         help='Show the browser window')
+    parser.add_argument('-x', '--extract-mode',
+                        choices=LernplattformScraper.Course.EXTRACT_MODES,
+                        dest='extract_mode',
+                        help=('How to read activities from course pages: '
+                              'query each element through WebDriver '
+                              '(live, the default), parse the page source at '
+                              'once (snapshot) or extract everything with '
+                              'one script call (script); selenium backend '
+                              'only'))
+    parser.add_argument('--cookie-jar',
+                        metavar='FILE',
+                        dest='cookie_jar',
+                        help=('Keep the session cookies in FILE (encrypted '
+                              'with the password), so that the next run '
+                              'needn\'t log in again; implies --no-logout'))
+    parser.add_argument('--no-logout',
+                        action='store_false',
+                        default=None,
+                        dest='logout',
+                        help='Don\'t log out at the end, keeping the session '
+                             'valid')
+    parser.add_argument('--structure-cache',
+                        metavar='FILE',
+                        dest='structure_cache',
+                        help=('SQLite file remembering the structure of '
+                              'course pages between runs; unchanged sections '
+                              'are not extracted again (all extract modes '
+                              'but live)'))
+    parser.add_argument('-b', '--backend',
+                        choices=['selenium', 'http'],
+                        default='selenium',
+                        dest='backend',
+                        help=('Crawl pages with the browser (selenium) or '
+                              'concurrently over HTTP, using the browser\'s '
+                              'session (http)'))
+    parser.add_argument('--http-concurrency',
+                        type=int,
+                        default=8,
+                        dest='http_concurrency',
+                        help=('Maximum number of concurrent HTTP requests '
+                              '(of the http backend, and of -S)'))
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        dest='jobs',
+                        help=('Number of browser sessions that load course '
+                              'pages in parallel (selenium backend)'))
+    parser.add_argument('--browser-downloads',
+                        action='store_false',
+                        default=True,
+                        dest='stream_downloads',
+                        help=('Let the browser download files instead of '
+                              'streaming them over HTTP'))
+    parser.add_argument('--download-timeout',
+                        type=float,
+                        default=600,
+                        dest='download_timeout',
+                        help=('Give up on a browser download after this '
+                              'many seconds'))
+    parser.add_argument('--download-stall-timeout',
+                        type=float,
+                        default=60,
+                        dest='download_stall_timeout',
+                        help=('Give up on a browser download that hasn\'t '
+                              'made progress for this many seconds'))
+    parser.add_argument('--blob-store',
+                        metavar='DIR',
+                        dest='blob_store',
+                        help=('Keep each downloaded file once in DIR, named '
+                              'by its hash, and link it into the download '
+                              'tree; known files are not downloaded again'))
+    parser.add_argument('--manifest',
+                        metavar='FILE',
+                        dest='manifest',
+                        help=('Record each downloaded file with its source, '
+                              'size and hash in FILE (SQLite); files that '
+                              'aren\'t recorded completely are downloaded '
+                              'again. Check the tree with '
+                              'verify_downloads.py'))
+    parser.add_argument('--resume-downloads',
+                        action='store_true',
+                        dest='resume_downloads',
+                        help=('Continue interrupted streamed downloads with '
+                              'range requests (needs --manifest)'))
+    parser.add_argument('--lernplattform-url',
+                        metavar='URL',
+                        dest='lernplattform_url',
+                        help=('Scrape the Lernplattform at URL instead of '
+                              'mebis (e.g. a local stand-in for testing)'))
+    parser.add_argument('--idp-url',
+                        metavar='URL',
+                        dest='idp_url',
+                        help=('Use the login service (IdP) at URL instead '
+                              'of mebis\' one'))
+    parser.add_argument('--stats-file',
+                        type=argparse.FileType('w'),
+                        dest='stats_file',
+                        help=('Write run statistics (WebDriver commands, '
+                              'login checks, wall time) as JSON to this '
+                              'file'))
 
     parser.add_argument('-L', '--action-list',
                         dest='action_list',
                         action='store_true',
                         required=False,
                         help='List activities and their courses to stdout')
+    parser.add_argument('--list-format',
+                        choices=['json', 'jsonl', 'binary'],
+                        default='json',
+                        dest='list_format',
+                        help=('Format of the activity list: json writes one '
+                              'JSON document at the end; jsonl writes one '
+                              'line of JSON (flat) per activity as soon as '
+                              'it is visited; binary writes a binary '
+                              'coursedump (tools/coursedump_binary.py) as '
+                              'activities are visited'))
+    parser.add_argument('--list-compression',
+                        choices=COMPRESSIONS,
+                        default=DEFAULT_COMPRESSION,
+                        dest='list_compression',
+                        help='Compression of binary activity lists')
+    parser.add_argument('-o', '--list-output',
+                        type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        dest='list_output',
+                        help='Write the activity list to this file')
     parser.add_argument('-D', '--action-download',
                         dest='action_download',
                         metavar='OUT',
@@ -70,6 +206,17 @@ if __name__ == '__main__':
 
     if not (args.action_download or args.action_list or args.action_sync):
         sys.exit('Specify at least either -D, -L or -S')
+    if args.logout is None:
+        # logging out would invalidate the session kept in the cookie jar
+        args.logout = args.cookie_jar is None
+    if args.resume_downloads and args.manifest is None:
+        sys.exit('--resume-downloads needs --manifest')
+    if args.backend == 'http' and args.extract_mode is not None:
+        sys.exit('-x only applies to the selenium backend')
+    if args.backend == 'http' and args.jobs != 1:
+        sys.exit('-j only applies to the selenium backend')
+    if args.extract_mode is None:
+        args.extract_mode = 'live'
 
     creds = json.load(args.credfile)
     config = yaml.safe_load(args.config)
@@ -78,23 +225,76 @@ if __name__ == '__main__':
 
     username = creds['username']
     password = creds['password']
-    sauth = MebisSAMLAuthenticator(username, password)
+    logout_url = None
+    login_host = None
+    login_path = None
+    if args.idp_url is not None:
+        logout_url = args.idp_url + '/idp/logout.jsp'
+        idp_url = urlparse(args.idp_url)
+        login_host = idp_url.hostname
+        login_path = idp_url.path.rstrip('/') + '/idp/profile/'
+
+    sauth = MebisSAMLAuthenticator(username, password, login_host,
+                                   login_path)
     authm.add_authenticator(sauth)
 
+    jar = None
+    if args.cookie_jar is not None:
+        jar = EncryptedCookieJar(args.cookie_jar,
+                                 creds.get('cookie_jar_key', password))
+        authm.add_login_listener(jar.save)
+
+    cache = (StructureCache(args.structure_cache)
+             if args.structure_cache is not None else None)
+
+    start_time = time.monotonic()
+
     (dl_dir, _driver) = make_firefox_profile(args.selenium_headless)
-    with _driver as driver, \
-         LernplattformScraper.create(driver, authm) as scraper:
+    commands = count_commands(_driver)
+    if jar is not None:
+        jar.load(_driver)
+
+    # the cache and the resources registered with RESOURCES are closed after
+    # the driver has quit, however the run ends
+    with (cache if cache is not None else contextlib.nullcontext()), \
+         contextlib.ExitStack() as resources, \
+         _driver as driver, \
+         LernplattformScraper.create(driver, authm, args.extract_mode,
+                                     cache, args.logout,
+                                     args.lernplattform_url,
+                                     logout_url) as scraper:
         acceptors = LernplattformCompositeAcceptor()
 
         lister = None
         if args.action_list:
-            lister = (LernplattformFlatListerAcceptor() if args.list_flat
-                      else LernplattformListerAcceptor())
+            if args.list_format == 'jsonl':
+                lister = LernplattformStreamingListerAcceptor(
+                    args.list_output)
+            elif args.list_format == 'binary':
+                lister = LernplattformBinaryListerAcceptor(
+                    BinaryCoursedumpWriter(args.list_output.buffer,
+                                           args.list_compression))
+            elif args.list_flat:
+                lister = LernplattformFlatListerAcceptor()
+            else:
+                lister = LernplattformListerAcceptor()
             acceptors.add_acceptor(lister)
 
         if args.action_download is not None:
+            watcher = DownloadWatcher(dl_dir, args.download_timeout,
+                                      args.download_stall_timeout)
+            resources.callback(watcher.close)
+            store = None
+            if args.blob_store is not None:
+                store = BlobStore(args.blob_store)
+                resources.callback(store.close)
+            manifest = None
+            if args.manifest is not None:
+                manifest = resources.enter_context(
+                    DownloadManifest(args.manifest, args.action_download))
             downloader = LernplattformDownloadAcceptor(
-                args.action_download, dl_dir)
+                args.action_download, dl_dir, args.stream_downloads, watcher,
+                store, manifest, args.resume_downloads)
             if args.dl_incomplete:
                 fdownloader = LernplattformCompletionFilterAcceptor(
                     downloader)
@@ -104,12 +304,40 @@ if __name__ == '__main__':
 
         if args.action_sync is not None:
             cdict = json.load(args.action_sync)
-            completer = LernplattformCompletionSyncAcceptor(cdict)
+            completer = LernplattformCompletionSyncAcceptor(
+                cdict, args.http_concurrency)
             acceptors.add_acceptor(completer)
 
         mebis_filter = LernplattformFilterVisitor(acceptors, config)
 
-        scraper.visit(mebis_filter)
+        if args.backend == 'http':
+            LernplattformHTTPScraper(driver, authm, args.http_concurrency,
+                                     cache, args.lernplattform_url) \
+                .visit(mebis_filter)
+        elif args.jobs > 1:
+            with WebDriverPool(driver, args.jobs,
+                               args.selenium_headless) as pool:
+                for pool_driver in pool.sessions[1:]:
+                    count_commands(pool_driver, commands)
+                LernplattformParallelScraper(driver, authm, pool, cache,
+                                             args.lernplattform_url) \
+                    .visit(mebis_filter)
+        else:
+            scraper.visit(mebis_filter)
 
-        if args.action_list:
-            json.dump(lister.result, sys.stdout, indent=4)
+        acceptors.finish()
+        authm.log_stats()
+
+        if jar is not None and not args.logout:
+            jar.save(driver)
+
+        if args.action_list and args.list_format == 'json':
+            json.dump(lister.result, args.list_output, indent=4)
+
+    if args.stats_file is not None:
+        json.dump({
+            'wall_time': time.monotonic() - start_time,
+            'webdriver_commands': sum(commands.values()),
+            'webdriver_commands_by_type': commands,
+            'auth': authm.stats
+        }, args.stats_file, indent=4)
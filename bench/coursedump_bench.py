@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# Times the coursedump tools in tools/ on synthetic coursedumps and records
+# their wall time and peak RSS. Results are compared against a baseline file;
+# a tool that got slower (or bigger) than the baseline allows is flagged and
+# the exit status is 1.
+#
+#   bench/coursedump_bench.py --sizes 10000 100000 1000000 --update-baseline
+#   bench/coursedump_bench.py              # after a change
+#
+# The baseline (bench/coursedump_baseline.json by default) only makes sense
+# on the machine it was recorded on, so it isn't checked in.
+import argparse
+import json
+import math
+import os
+import os.path
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                         'tools')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'coursedump_baseline.json')
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+VARIANTS = ['plain', 'subcourses']
+
+ACTIVITY_TYPES = [
+    ('modtype_resource', 'Datei', 0.45),
+    ('modtype_folder', 'Verzeichnis', 0.1),
+    ('modtype_page', 'Textseite', 0.1),
+    ('modtype_url', 'Link', 0.1),
+    ('modtype_assign', 'Aufgabe', 0.1),
+    ('modtype_label', 'Textfeld', 0.15),
+]
+
+ACTIVITIES_PER_SUBJECT = 12
+SUBJECTS_PER_PAGE = 15
+SUBCOURSES_PER_COURSE = 3
+
+# share of activities without a description, and the (log-normal) length
+# distribution of the others' subtext HTML, chosen to resemble real dumps
+NO_SUBTEXT = 0.4
+SUBTEXT_MEDIAN = 200
+SUBTEXT_SIGMA = 1.2
+SUBTEXT_MAX = 20000
+
+WORDS = ('Aufgabe Bitte bis zum Abgabe lesen Seite Buch Heft bearbeiten '
+         'Arbeitsblatt Lösung Hausaufgabe Video ansehen Test Übung Kapitel '
+         'Zusammenfassung Vokabeln Referat Beispiel').split()
+
+
+def make_subtext(rng):
+    if rng.random() < NO_SUBTEXT:
+        return None
+
+    length = min(SUBTEXT_MAX, int(rng.lognormvariate(
+        math.log(SUBTEXT_MEDIAN), SUBTEXT_SIGMA)))
+
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+
+    return ('<div class="contentafterlink"><div class="no-overflow"><p>'
+            + ' '.join(words) + '</p></div></div>')
+
+
+def pick_type(rng):
+    x = rng.random()
+    for (modtype, name, share) in ACTIVITY_TYPES:
+        if x < share:
+            return (modtype, name)
+        x -= share
+
+    return ACTIVITY_TYPES[-1][:2]
+
+
+# yields ((course, subcourse, subject), [activity]) for a dump of N
+# activities; SUBCOURSES chooses whether courses have subcourse tabs.
+# Activities carry no locator keys.
+def generate_subjects(n, subcourses=False, seed=0):
+    rng = random.Random(seed)
+
+    per_course = ACTIVITIES_PER_SUBJECT * SUBJECTS_PER_PAGE
+    if subcourses:
+        per_course *= SUBCOURSES_PER_COURSE
+    tabs = [f'Kurs {tab}' for tab in range(1, SUBCOURSES_PER_COURSE + 1)] \
+        if subcourses else [None]
+
+    count = 0
+    for course_no in range(1, n // per_course + 2):
+        for tab in tabs:
+            for subject_no in range(1, SUBJECTS_PER_PAGE + 1):
+                activities = []
+                for activity_no in range(1, ACTIVITIES_PER_SUBJECT + 1):
+                    if count == n:
+                        break
+
+                    (modtype, kind) = pick_type(rng)
+                    complete = (None if modtype == 'modtype_label'
+                                else rng.random() < 0.6)
+                    activities.append({
+                        'name': f'{kind} {activity_no}',
+                        'type': modtype,
+                        'complete': complete,
+                        'subtext': make_subtext(rng)
+                    })
+                    count += 1
+
+                if activities:
+                    yield ((f'Klasse {course_no}', tab,
+                            f'Woche {subject_no}'), activities)
+                if count == n:
+                    return
+
+
+def locate(activity, locator):
+    (course, subcourse, subject) = locator
+    return {**activity, 'course': course, 'subcourse': subcourse,
+            'subject': subject}
+
+
+# writes a flat coursedump (as produced by -L -f) to PATH; activities are
+# dropped with probability DROP
+def write_flat(path, subjects, drop=0.0, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('[')
+        first = True
+        for (locator, activities) in subjects:
+            for activity in activities:
+                if drop and rng.random() < drop:
+                    continue
+
+                f.write('\n' if first else ',\n')
+                json.dump(locate(activity, locator), f)
+                first = False
+        f.write('\n]\n')
+
+
+# writes a hierarchical coursedump (as produced by -L) to PATH, one course at
+# a time; SUBJECTS must be grouped by course, which generate_subjects ensures
+def write_hierarchical(path, subjects):
+    def write_course(f, name, course, first):
+        f.write('\n' if first else ',\n')
+        f.write(f'{json.dumps(name)}: ')
+        json.dump(course, f)
+
+    with open(path, 'w') as f:
+        f.write('{')
+        (name, course) = (None, None)
+        first = True
+        for ((course_name, subcourse, subject), activities) in subjects:
+            if course_name != name:
+                if course is not None:
+                    write_course(f, name, course, first)
+                    first = False
+                (name, course) = (course_name, {})
+
+            target = course
+            if subcourse is not None:
+                target = course.setdefault(subcourse, {})
+            target[subject] = activities
+
+        if course is not None:
+            write_course(f, name, course, first)
+        f.write('\n}\n')
+
+
+# writes a completion overlay as coursedump2overlay.py makes it, with a
+# share of SHARE of the activities flipped
+def write_overlay(path, subjects, share=0.5, seed=0):
+    rng = random.Random(seed)
+    overlay = {}
+    for ((course, subcourse, subject), activities) in subjects:
+        for activity in activities:
+            if activity['complete'] is None or rng.random() >= share:
+                continue
+
+            target = overlay.setdefault(course, {})
+            if subcourse is not None:
+                target = target.setdefault(subcourse, {})
+            target.setdefault(subject, {})[activity['name']] = {
+                'complete': not activity['complete']
+            }
+
+    with open(path, 'w') as f:
+        json.dump(overlay, f)
+
+
+# converts the coursedump at PATH to a binary one at BINARY_PATH
+def write_binary(path, binary_path):
+    subprocess.run([sys.executable,
+                    os.path.join(TOOLS_DIR, 'convert_coursedump.py'),
+                    '-f', 'binary', '-o', binary_path, path], check=True)
+
+
+# the input files of all tools for one size and variant
+def generate_inputs(directory, n, variant, seed=0):
+    subcourses = variant == 'subcourses'
+
+    def subjects():
+        return generate_subjects(n, subcourses, seed)
+
+    paths = {name: os.path.join(directory, f'{name}.json')
+             for name in ['flat', 'flat_old', 'hierarchical', 'overlay']}
+
+    write_flat(paths['flat'], subjects())
+    write_flat(paths['flat_old'], subjects(), drop=0.1, seed=seed + 1)
+    write_hierarchical(paths['hierarchical'], subjects())
+    write_overlay(paths['overlay'], subjects(), seed=seed + 2)
+
+    paths['binary'] = os.path.join(directory, 'flat.mcd')
+    write_binary(paths['flat'], paths['binary'])
+    paths['binary_old'] = os.path.join(directory, 'flat_old.mcd')
+    write_binary(paths['flat_old'], paths['binary_old'])
+
+    return paths
+
+
+# tool -> (script, arguments from the input paths)
+TOOLS = {
+    'flatten': ('flatten_coursedump.py',
+                lambda paths: [paths['hierarchical']]),
+    'deflatten': ('deflatten_coursedump.py',
+                  lambda paths: [paths['flat']]),
+    'diff': ('coursedump_diff.py',
+             lambda paths: [paths['flat'], paths['flat_old']]),
+    'diff_external': ('coursedump_diff.py',
+                      lambda paths: ['--changes', '--external',
+                                     paths['flat'], paths['flat_old']]),
+    'coursedump2overlay': ('coursedump2overlay.py',
+                           lambda paths: [paths['flat']]),
+    'patch_overlay': ('patch_overlay.py',
+                      lambda paths: [paths['overlay'], paths['flat']]),
+    'flatten_binary': ('flatten_coursedump.py',
+                       lambda paths: [paths['binary']]),
+    'diff_binary': ('coursedump_diff.py',
+                    lambda paths: [paths['binary'], paths['binary_old']]),
+    'patch_overlay_binary': ('patch_overlay.py',
+                             lambda paths: [paths['overlay'],
+                                            paths['binary']]),
+}
+
+
+# runs COMMAND with its output going to OUT and returns (wall time, peak RSS
+# in KiB)
+def measure(command, out):
+    start = time.monotonic()
+    process = subprocess.Popen(command, stdout=out)
+    (_, status, rusage) = os.wait4(process.pid, 0)
+    wall_time = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    return (wall_time, rusage.ru_maxrss)
+
+
+def run_tool(tool, paths, directory, repeat):
+    (script, arguments) = TOOLS[tool]
+    command = ([sys.executable, os.path.join(TOOLS_DIR, script)]
+               + arguments(paths))
+
+    results = []
+    for _ in range(repeat):
+        with open(os.path.join(directory, 'out'), 'w') as out:
+            results.append(measure(command, out))
+
+    return {
+        'time': min(wall_time for (wall_time, _) in results),
+        'rss': min(rss for (_, rss) in results)
+    }
+
+
+def result_key(tool, variant, size):
+    return f'{tool}/{variant}/{size}'
+
+
+# [(key, measure, baseline value, value)] of results that are worse than
+# their baseline by more than TOLERANCE (relative). Times within MIN_SLACK
+# seconds of the baseline are never flagged: at small sizes, they are
+# mostly interpreter start-up and noise.
+def regressions(results, baseline, tolerance, min_slack=0.25):
+    found = []
+    for (key, result) in results.items():
+        if key not in baseline:
+            continue
+
+        for measure_name in ['time', 'rss']:
+            base = baseline[key][measure_name]
+            allowed = base * (1 + tolerance)
+            if measure_name == 'time':
+                allowed = max(allowed, base + min_slack)
+
+            if result[measure_name] > allowed:
+                found.append((key, measure_name, base,
+                              result[measure_name]))
+
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the coursedump tools')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES,
+                        help='Numbers of activities to benchmark with')
+    parser.add_argument('-t', '--tools', nargs='+', choices=list(TOOLS),
+                        default=list(TOOLS),
+                        help='Tools to benchmark')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS,
+                        default=VARIANTS,
+                        help='Coursedump variants to benchmark with')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='Runs per measurement; the best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-b', '--baseline', default=DEFAULT_BASELINE,
+                        help='Baseline file to compare with')
+    parser.add_argument('-u', '--update-baseline', action='store_true',
+                        dest='update_baseline',
+                        help='Store the results in the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help=('Allowed relative slowdown (or growth of peak '
+                              'RSS) against the baseline'))
+    parser.add_argument('--min-slack', type=float, default=0.25,
+                        dest='min_slack',
+                        help=('Slowdown in seconds that is always allowed, '
+                              'whatever the tolerance'))
+    parser.add_argument('--json', type=argparse.FileType('w'),
+                        help='Also write the results as JSON to this file')
+
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    for size in args.sizes:
+        for variant in args.variants:
+            with tempfile.TemporaryDirectory() as directory:
+                paths = generate_inputs(directory, size, variant, args.seed)
+                input_size = os.path.getsize(paths['flat'])
+                print(f'{size} activities ({variant}, flat dump '
+                      f'{input_size / (1 << 20):.1f} MiB)')
+
+                for tool in args.tools:
+                    result = run_tool(tool, paths, directory, args.repeat)
+                    key = result_key(tool, variant, size)
+                    results[key] = result
+
+                    compared = ''
+                    if key in baseline:
+                        compared = (
+                            f' (baseline {baseline[key]["time"]:.2f}s, '
+                            f'{baseline[key]["rss"] // 1024} MiB)')
+                    print(f'  {tool:20} {result["time"]:8.2f}s '
+                          f'{result["rss"] // 1024:6} MiB{compared}')
+
+    if args.json is not None:
+        json.dump(results, args.json, indent=4)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        sys.exit(0)
+
+    found = regressions(results, baseline, args.tolerance,
+                        args.min_slack)
+    for (key, measure_name, base, value) in found:
+        print(f'REGRESSION {key}: {measure_name} {value:.2f} against '
+              f'{base:.2f} in the baseline', file=sys.stderr)
+
+    sys.exit(1 if found else 0)
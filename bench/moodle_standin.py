@@ -0,0 +1,754 @@
+#!/usr/bin/env python3
+# A local stand-in for the mebis Lernplattform and its login service, built
+# from the markup in reveng/. It serves a dashboard, course pages with
+# subcourse tabs and collapsed sections, and resource, folder, page, url and
+# label activities of a synthetic site of configurable size, so that the
+# scraper can be run (and timed) without touching the real mebis.
+#
+# The Lernplattform is served on localhost, the login service (IdP) on
+# 127.0.0.1 of the same port: the scraper tells them apart by host name.
+import argparse
+import html
+import io
+import json
+import os.path
+import random
+import re
+import secrets
+import sys
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode, quote
+
+
+REVENG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'reveng')
+DASHBOARD_HTML = 'Schreibtisch-lernplattform.mebis.bayern.de.html'
+LOGIN_HTML = 'login-lernplattform.mebis.bayern.de.html'
+
+MEBIS_LERNPLATTFORM_URL = 'https://lernplattform.mebis.bayern.de'
+MEBIS_IDP_URL = 'https://idp.mebis.bayern.de'
+
+LERNPLATTFORM_HOST = 'localhost'
+IDP_HOST = '127.0.0.1'
+
+# (modtype, own page) of the generated activities, in the order in which
+# they are handed out
+ACTIVITY_KINDS = [
+    ('resource', False),
+    ('folder', False),
+    ('page', False),
+    ('resource', False),
+    ('url', False),
+    ('folder', True),
+    ('label', False),
+]
+
+ACCESSHIDE_NAMES = {
+    'resource': 'Datei',
+    'folder': 'Verzeichnis',
+    'page': 'Textseite',
+    'url': 'Link/URL'
+}
+
+
+class Activity:
+    def __init__(self, cmid, name, modtype, own_page=False, complete=None,
+                 file_size=0):
+        self.cmid = cmid
+        self.name = name
+        self.modtype = modtype
+        # folders only: whether the folder is shown on its own page instead
+        # of inline
+        self.own_page = own_page
+        # True/False, or None if the activity can't be completed
+        self.complete = complete
+        self.file_size = file_size
+
+
+class Section:
+    def __init__(self, section_id, name, activities):
+        self.id = section_id
+        self.name = name
+        self.activities = activities
+
+
+# one tab of a course; a course without subcourses has a single, unnamed one
+class CoursePage:
+    def __init__(self, course_id, name, sections):
+        self.id = course_id
+        self.name = name
+        self.sections = sections
+
+
+class Course:
+    def __init__(self, name, pages):
+        self.name = name
+        self.pages = pages
+
+
+class Site:
+    def __init__(self, courses, seed):
+        self.courses = courses
+        self.seed = seed
+
+        self.pages = {}
+        self.activities = {}
+        for course in courses:
+            for page in course.pages:
+                self.pages[page.id] = (course, page)
+                for section in page.sections:
+                    for activity in section.activities:
+                        self.activities[activity.cmid] = activity
+
+    def file_content(self, activity, index=0):
+        rng = random.Random(f'{self.seed}:{activity.cmid}:{index}')
+        return rng.randbytes(activity.file_size)
+
+
+# A synthetic site of COURSES courses with SUBCOURSES tabs each (0: no tabs),
+# SECTIONS sections per tab and ACTIVITIES activities per section. Files are
+# FILE_SIZE bytes large. The same SEED always gives the same site.
+def generate_site(courses=3, subcourses=0, sections=4, activities=6,
+                  file_size=1 << 16, seed=0):
+    rng = random.Random(seed)
+    next_id = iter(range(1000, 1 << 31))
+
+    result = []
+    for course_no in range(1, courses + 1):
+        tab_names = ([f'Kurs {course_no}.{tab}'
+                      for tab in range(1, subcourses + 1)]
+                     if subcourses > 0 else [None])
+
+        pages = []
+        for tab_name in tab_names:
+            page_sections = []
+            for section_no in range(1, sections + 1):
+                section_activities = []
+                for activity_no in range(activities):
+                    (modtype, own_page) = \
+                        ACTIVITY_KINDS[activity_no % len(ACTIVITY_KINDS)]
+                    cmid = next(next_id)
+                    section_activities.append(Activity(
+                        cmid, f'{modtype.capitalize()} {cmid}', modtype,
+                        own_page,
+                        complete=(None if modtype == 'label'
+                                  else rng.random() < 0.5),
+                        file_size=file_size))
+
+                page_sections.append(Section(
+                    section_no, f'Thema {section_no}', section_activities))
+
+            pages.append(CoursePage(next(next_id), tab_name, page_sections))
+
+        result.append(Course(f'Kurs {course_no}', pages))
+
+    return Site(result, seed)
+
+
+def section_names(page):
+    return [section.name for section in page.sections]
+
+
+# the scraper config (mebis-scraper-config.yml) that selects everything
+def scraper_config(site):
+    config = {}
+    for course in site.courses:
+        if course.pages[0].name is None:
+            config[course.name] = {'subjects': section_names(course.pages[0])}
+        else:
+            config[course.name] = {'subcourses': {
+                page.name: {'subjects': section_names(page)}
+                for page in course.pages
+            }}
+
+    return config
+
+
+# a completion overlay (as read by -S) that flips every completable activity
+def completion_overlay(site):
+    overlay = {}
+    for course in site.courses:
+        for page in course.pages:
+            for section in page.sections:
+                subjects = overlay.setdefault(course.name, {})
+                if page.name is not None:
+                    subjects = subjects.setdefault(page.name, {})
+
+                names = subjects.setdefault(section.name, {})
+                for activity in section.activities:
+                    if activity.complete is not None:
+                        names[activity.name] = {
+                            'complete': not activity.complete
+                        }
+
+    return overlay
+
+
+# replaces the content of the div starting with START_TAG in PAGE
+def replace_div_content(page, start_tag, content):
+    start = page.index(start_tag) + len(start_tag)
+
+    depth = 1
+    pos = start
+    for match in re.finditer(r'<div\b|</div>', page[start:]):
+        depth += 1 if match.group(0) == '<div' else -1
+        if depth == 0:
+            pos = start + match.start()
+            break
+
+    return page[:start] + content + page[pos:]
+
+
+# strips the reveng markup of everything that would load resources from
+# mebis, and points its links at the stand-in
+def localize(page, lernplattform_url, idp_url):
+    page = re.sub(r'<script\b.*?</script>', '', page, flags=re.DOTALL)
+    page = re.sub(r'<link\b[^>]*>', '', page)
+    page = re.sub(r'<img\b[^>]*>(\s*</img>)?', '', page)
+
+    page = page.replace(MEBIS_LERNPLATTFORM_URL, lernplattform_url)
+    return page.replace(MEBIS_IDP_URL, idp_url)
+
+
+# The JavaScript the scraper relies on: collapsed sections open on a click on
+# their toggle, and completion forms are sent in the background, like
+# Moodle's AJAX completion toggle.
+BEHAVIOUR_SCRIPT = '''
+function standinToggleSection(toggle) {
+    toggle.className = 'toggle_open';
+    toggle.parentNode.querySelector('ul.section').style.display = '';
+}
+function standinToggleCompletion(form) {
+    var data = new URLSearchParams(new FormData(form));
+    var state = form.querySelector('input[name="completionstate"]');
+    var img = form.querySelector('img');
+    var name = form.querySelector('input[name="modulename"]').value;
+    fetch(form.action, {method: 'POST', body: data, credentials: 'include'})
+        .then(function (response) {
+            if (!response.ok) {
+                return;
+            }
+            img.alt = (state.value === '1' ? 'Abgeschlossen: '
+                       : 'Nicht abgeschlossen: ') + name;
+            state.value = state.value === '1' ? '0' : '1';
+        });
+    return false;
+}
+'''
+
+
+class Templates:
+    def __init__(self, lernplattform_url, idp_url):
+        with open(os.path.join(REVENG_DIR, DASHBOARD_HTML)) as f:
+            self.page = localize(f.read(), lernplattform_url, idp_url)
+        with open(os.path.join(REVENG_DIR, LOGIN_HTML)) as f:
+            self.login = localize(f.read(), lernplattform_url, idp_url)
+
+    def render_page(self, title, sesskey, main):
+        cfg = json.dumps({'wwwroot': '', 'sesskey': sesskey},
+                         separators=(',', ':'))
+
+        page = re.sub(r'<title>.*?</title>',
+                      f'<title>{html.escape(title)}</title>', self.page,
+                      count=1, flags=re.DOTALL)
+        page = replace_div_content(page, '<div role="main">', main)
+        page = page.replace(
+            '</head>', f'<script>var M = {{}}; M.cfg = {cfg};</script>\n'
+            '    </head>', 1)
+        return page.replace(
+            '</body>', f'<script>{BEHAVIOUR_SCRIPT}</script>\n    </body>', 1)
+
+    def render_login(self, action):
+        return re.sub(r'<form action="[^"]*"',
+                      f'<form action="{html.escape(action)}"', self.login,
+                      count=1)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, site, port=0, username='user', password='password'):
+        super().__init__(('127.0.0.1', port), StandinRequestHandler)
+
+        self.site = site
+        self.username = username
+        self.password = password
+
+        port = self.server_address[1]
+        self.lernplattform_url = f'http://{LERNPLATTFORM_HOST}:{port}'
+        self.idp_url = f'http://{IDP_HOST}:{port}'
+        self.templates = Templates(self.lernplattform_url, self.idp_url)
+
+        self.lock = threading.Lock()
+        # MoodleSession cookie -> sesskey
+        self.moodle_sessions = {}
+        self.idp_sessions = set()
+        self.stats = {}
+
+    def count(self, what, amount=1):
+        with self.lock:
+            self.stats[what] = self.stats.get(what, 0) + amount
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def activity_url(lernplattform_url, activity):
+    return (f'{lernplattform_url}/mod/{activity.modtype}/view.php'
+            f'?id={activity.cmid}')
+
+
+def instancename_link(lernplattform_url, activity):
+    return (f'<a class="aalink" '
+            f'href="{activity_url(lernplattform_url, activity)}">'
+            f'<span class="instancename">{html.escape(activity.name)}'
+            f'<span class="accesshide "> '
+            f'{ACCESSHIDE_NAMES[activity.modtype]}</span></span></a>')
+
+
+def folder_download_form(lernplattform_url, activity, sesskey):
+    return (f'<form method="post" action="{lernplattform_url}'
+            f'/mod/folder/download_folder.php">'
+            f'<input type="hidden" name="id" value="{activity.cmid}">'
+            f'<input type="hidden" name="sesskey" value="{sesskey}">'
+            f'<input type="submit" value="Verzeichnis herunterladen">'
+            f'</form>')
+
+
+def completion_form(lernplattform_url, activity, sesskey):
+    if activity.complete is None:
+        return ''
+
+    name = html.escape(activity.name)
+    alt = ('Abgeschlossen: ' if activity.complete
+           else 'Nicht abgeschlossen: ') + name
+    return (f'<span class="actions"><form class="togglecompletion" '
+            f'method="post" action="{lernplattform_url}'
+            f'/course/togglecompletion.php" '
+            f'onsubmit="return standinToggleCompletion(this);">'
+            f'<input type="hidden" name="id" value="{activity.cmid}">'
+            f'<input type="hidden" name="sesskey" value="{sesskey}">'
+            f'<input type="hidden" name="modulename" value="{name}">'
+            f'<input type="hidden" name="completionstate" '
+            f'value="{0 if activity.complete else 1}">'
+            f'<button class="btn btn-link" type="submit">'
+            f'<img class="icon" alt="{alt}"></button></form></span>')
+
+
+def render_activity(lernplattform_url, activity, sesskey):
+    if activity.modtype == 'label':
+        body = (f'<div class="contentwithoutlink"><div class="no-overflow">'
+                f'<p>{html.escape(activity.name)}</p>'
+                f'<p>Hinweis zu Abschnitt {activity.cmid}</p></div></div>')
+    elif activity.modtype == 'folder' and not activity.own_page:
+        body = (f'<div class="foldertree"><span class="fp-filename-icon">'
+                f'<span class="fp-filename">{html.escape(activity.name)}'
+                f'</span></span></div>'
+                + folder_download_form(lernplattform_url, activity, sesskey))
+    else:
+        body = (f'<div class="activityinstance">'
+                f'{instancename_link(lernplattform_url, activity)}</div>')
+
+    return (f'<li class="activity {activity.modtype} '
+            f'modtype_{activity.modtype}" id="module-{activity.cmid}">'
+            f'<div><div class="mod-indent-outer">{body}'
+            f'<div class="contentafterlink"><p>Beschreibung von '
+            f'{html.escape(activity.name)}</p></div>'
+            f'{completion_form(lernplattform_url, activity, sesskey)}'
+            f'</div></div></li>')
+
+
+def render_section(lernplattform_url, section, sesskey):
+    activities = ''.join(render_activity(lernplattform_url, activity, sesskey)
+                         for activity in section.activities)
+
+    return (f'<li id="section-{section.id}" class="section main clearfix" '
+            f'role="region"><div class="content">'
+            f'<h3 class="sectionname"><span>{html.escape(section.name)}'
+            f'</span></h3>'
+            f'<span class="toggle_closed" '
+            f'onclick="standinToggleSection(this);">&#9654;</span>'
+            f'<ul class="section img-text" style="display: none;">'
+            f'{activities}</ul></div></li>')
+
+
+def render_tabs(lernplattform_url, course, current):
+    if current.name is None:
+        return ''
+
+    tabs = []
+    for page in course.pages:
+        active = ' class="active"' if page is current else ''
+        tabs.append(f'<li{active}><a href="{lernplattform_url}'
+                    f'/course/view.php?id={page.id}">'
+                    f'<span>{html.escape(page.name)}</span></a></li>')
+
+    return f'<ul class="nav nav-tabs">{"".join(tabs)}</ul>'
+
+
+def render_course_page(lernplattform_url, course, page, sesskey):
+    sections = ''.join(render_section(lernplattform_url, section, sesskey)
+                       for section in page.sections)
+
+    return (f'<div class="course-headline">{html.escape(course.name)}</div>'
+            f'{render_tabs(lernplattform_url, course, page)}'
+            f'<ul class="topics">{sections}</ul>')
+
+
+def render_dashboard(lernplattform_url, site):
+    boxes = []
+    for course in site.courses:
+        boxes.append(f'<li id="course-{course.pages[0].id}" '
+                     f'class="coursebox"><div class="coursebox-inner">'
+                     f'<div class="course_title"><a class="coursebox-link" '
+                     f'href="{lernplattform_url}/course/view.php'
+                     f'?id={course.pages[0].id}">'
+                     f'<span class="coursename internal">'
+                     f'{html.escape(course.name)}</span></a></div></div>'
+                     f'</li>')
+
+    return (f'<div class="block_mbsmycourses"><ul class="coursebox-list">'
+            f'{"".join(boxes)}</ul></div>')
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def cookies(self):
+        result = {}
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            (name, _, value) = part.strip().partition('=')
+            if name:
+                result[name] = value
+
+        return result
+
+    def form_data(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length).decode('utf-8')
+        return {k: v[0] for (k, v) in parse_qs(data).items()}
+
+    def send(self, status, body=b'', content_type='text/html; charset=utf-8',
+             headers={}):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def redirect(self, location, headers={}):
+        self.send(303, headers={'Location': location, **headers})
+
+    def send_page(self, kind, title, main):
+        self.server.count('pages')
+        self.server.count(f'pages.{kind}')
+        self.send(200, self.server.templates.render_page(
+            title, self.sesskey, main))
+
+    def do_GET(self):
+        self.route()
+
+    def do_HEAD(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def route(self):
+        self.server.count('requests')
+
+        url = urlparse(self.path)
+        self.query = {k: v[0] for (k, v) in parse_qs(url.query).items()}
+        host = (self.headers.get('Host') or '').rsplit(':', 1)[0]
+
+        if url.path == '/robots.txt':
+            self.send(200, 'User-agent: *\nDisallow: /\n', 'text/plain')
+        elif url.path == '/__stats':
+            with self.server.lock:
+                stats = dict(self.server.stats)
+            self.send(200, json.dumps(stats), 'application/json')
+        elif host == IDP_HOST:
+            self.route_idp(url.path)
+        else:
+            self.route_lernplattform(url.path)
+
+    def route_idp(self, path):
+        server = self.server
+
+        if path == '/idp/logout.jsp':
+            idp_session = self.cookies().get('shib_idp_session')
+            with server.lock:
+                server.idp_sessions.discard(idp_session)
+                server.moodle_sessions.clear()
+            server.count('logouts')
+            self.send(200, '<html><body>Abgemeldet</body></html>',
+                      headers={'Set-Cookie':
+                               'shib_idp_session=; Path=/; Max-Age=0'})
+        elif path.startswith('/idp/profile/SAML2/Redirect/SSO'):
+            return_url = self.query.get('return', server.lernplattform_url)
+            acs_url = (f'{server.lernplattform_url}/auth/saml2/sp/acs?'
+                       + urlencode({'return': return_url}))
+
+            if self.command == 'POST':
+                data = self.form_data()
+                if data.get('j_username') != server.username \
+                   or data.get('j_password') != server.password:
+                    server.count('failed_logins')
+                    self.send(403, 'Login fehlgeschlagen')
+                    return
+
+                idp_session = secrets.token_hex(16)
+                with server.lock:
+                    server.idp_sessions.add(idp_session)
+                server.count('logins')
+                self.redirect(acs_url, {
+                    'Set-Cookie': f'shib_idp_session={idp_session}; Path=/'
+                })
+            elif self.cookies().get('shib_idp_session') \
+                    in server.idp_sessions:
+                self.redirect(acs_url)
+            else:
+                server.count('pages')
+                server.count('pages.login')
+                self.send(200, server.templates.render_login(
+                    path + '?' + urlencode({'return': return_url})))
+        else:
+            self.send(404, 'Not found')
+
+    def login_redirect(self):
+        server = self.server
+        return_url = server.lernplattform_url + self.path
+        self.redirect(f'{server.idp_url}/idp/profile/SAML2/Redirect/SSO?'
+                      + urlencode({'return': return_url}))
+
+    def route_lernplattform(self, path):
+        server = self.server
+
+        if path == '/auth/saml2/sp/acs':
+            # the IdP's cookie isn't sent to this host: the redirect from the
+            # login service is trusted, like a SAML assertion would be
+            moodle_session = secrets.token_hex(16)
+            with server.lock:
+                server.moodle_sessions[moodle_session] = \
+                    secrets.token_urlsafe(8)
+            self.redirect(self.query.get('return', server.lernplattform_url),
+                          {'Set-Cookie':
+                           f'MoodleSession={moodle_session}; Path=/'})
+            return
+
+        with server.lock:
+            self.sesskey = server.moodle_sessions.get(
+                self.cookies().get('MoodleSession'))
+        if self.sesskey is None:
+            self.login_redirect()
+            return
+
+        if self.command == 'POST':
+            self.form = self.form_data()
+            if self.form.get('sesskey') != self.sesskey:
+                server.count('invalid_sesskey')
+                self.send(403, 'Ungültiger Sitzungsschlüssel')
+                return
+
+        routes = {
+            '/': self.get_dashboard,
+            '/my/': self.get_dashboard,
+            '/my/index.php': self.get_dashboard,
+            '/course/view.php': self.get_course,
+            '/course/togglecompletion.php': self.post_togglecompletion,
+            '/mod/resource/view.php': self.get_resource,
+            '/mod/folder/view.php': self.get_folder,
+            '/mod/folder/download_folder.php': self.post_download_folder,
+            '/mod/page/view.php': self.get_page,
+            '/mod/url/view.php': self.get_url,
+        }
+
+        if path.startswith('/pluginfile.php/'):
+            self.get_pluginfile(path)
+        elif path in routes:
+            routes[path]()
+        else:
+            self.send(404, 'Not found')
+
+    def get_activity(self, modtype, params=None):
+        params = self.query if params is None else params
+        try:
+            activity = self.server.site.activities[int(params['id'])]
+        except (KeyError, ValueError):
+            return None
+
+        return activity if activity.modtype == modtype else None
+
+    def get_dashboard(self):
+        self.send_page('dashboard', 'Schreibtisch', render_dashboard(
+            self.server.lernplattform_url, self.server.site))
+
+    def get_course(self):
+        try:
+            (course, page) = self.server.site.pages[int(self.query['id'])]
+        except (KeyError, ValueError):
+            self.send(404, 'Kurs nicht gefunden')
+            return
+
+        self.send_page('course', course.name, render_course_page(
+            self.server.lernplattform_url, course, page, self.sesskey))
+
+    def post_togglecompletion(self):
+        activity = None
+        if self.command == 'POST':
+            try:
+                activity = self.server.site.activities.get(
+                    int(self.form.get('id', 0)))
+            except ValueError:
+                pass
+        if activity is None or activity.complete is None:
+            self.send(404, 'Aktivität nicht gefunden')
+            return
+
+        activity.complete = self.form.get('completionstate') == '1'
+        self.server.count('completion_toggles')
+        self.send(200, 'OK', 'text/plain')
+
+    def send_file(self, filename, content, content_type):
+        self.server.count('files')
+        self.server.count('file_bytes', len(content))
+        self.send(200, content, content_type, {
+            'Content-Disposition':
+            f'attachment; filename*=UTF-8\'\'{quote(filename)}'
+        })
+
+    def get_resource(self):
+        activity = self.get_activity('resource')
+        if activity is None:
+            self.send(404, 'Datei nicht gefunden')
+            return
+
+        self.redirect(f'{self.server.lernplattform_url}/pluginfile.php/'
+                      f'{activity.cmid}/mod_resource/content/0/'
+                      f'{quote(activity.name)}.pdf')
+
+    def get_pluginfile(self, path):
+        try:
+            activity = self.server.site.activities[int(path.split('/')[2])]
+        except (IndexError, KeyError, ValueError):
+            self.send(404, 'Datei nicht gefunden')
+            return
+
+        self.send_file(f'{activity.name}.pdf',
+                       self.server.site.file_content(activity),
+                       'application/pdf')
+
+    def get_folder(self):
+        activity = self.get_activity('folder')
+        if activity is None or not activity.own_page:
+            self.send(404, 'Verzeichnis nicht gefunden')
+            return
+
+        self.send_page('folder', activity.name, (
+            f'<h2>{html.escape(activity.name)}</h2><div class="box '
+            f'generalbox foldertree">'
+            f'<span class="fp-filename">{html.escape(activity.name)}</span>'
+            f'</div><div class="box generalbox folderbuttons">'
+            + folder_download_form(self.server.lernplattform_url, activity,
+                                   self.sesskey)
+            + '</div>'))
+
+    def post_download_folder(self):
+        activity = (self.get_activity('folder', self.form)
+                    if self.command == 'POST' else None)
+        if activity is None:
+            self.send(404, 'Verzeichnis nicht gefunden')
+            return
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for index in range(2):
+                archive.writestr(f'{activity.name}/Datei {index}.bin',
+                                 self.server.site.file_content(activity,
+                                                               index))
+
+        self.send_file(f'{activity.name}.zip', buffer.getvalue(),
+                       'application/zip')
+
+    def get_page(self):
+        activity = self.get_activity('page')
+        if activity is None:
+            self.send(404, 'Seite nicht gefunden')
+            return
+
+        self.send_page('page', activity.name, (
+            f'<h2>{html.escape(activity.name)}</h2>'
+            f'<div class="box generalbox center clearfix">'
+            f'<div class="no-overflow"><p>Inhalt von '
+            f'{html.escape(activity.name)}</p></div></div>'))
+
+    def get_url(self):
+        activity = self.get_activity('url')
+        if activity is None:
+            self.send(404, 'Link nicht gefunden')
+            return
+
+        self.redirect(f'https://example.org/{activity.cmid}')
+
+
+def add_site_arguments(parser):
+    parser.add_argument('--courses', type=int, default=3,
+                        help='Number of courses')
+    parser.add_argument('--subcourses', type=int, default=0,
+                        help='Number of subcourse tabs per course (0: none)')
+    parser.add_argument('--sections', type=int, default=4,
+                        help='Number of sections per course page')
+    parser.add_argument('--activities', type=int, default=6,
+                        help='Number of activities per section')
+    parser.add_argument('--file-size', type=int, default=1 << 16,
+                        dest='file_size',
+                        help='Size of each generated file in bytes')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated site')
+
+
+def site_from_args(args):
+    return generate_site(args.courses, args.subcourses, args.sections,
+                         args.activities, args.file_size, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve a synthetic mebis Lernplattform')
+    add_site_arguments(parser)
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='Port to listen on')
+    parser.add_argument('--config-out', type=argparse.FileType('w'),
+                        dest='config_out',
+                        help=('Write a scraper config (JSON, which is also '
+                              'YAML) selecting the whole site to this file'))
+
+    args = parser.parse_args()
+
+    site = site_from_args(args)
+    server = StandinServer(site, args.port)
+
+    if args.config_out is not None:
+        json.dump(scraper_config(site), args.config_out, indent=4)
+        args.config_out.close()
+
+    print(f'Lernplattform: {server.lernplattform_url}', file=sys.stderr)
+    print(f'IdP: {server.idp_url} (user/password)', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Runs LernplattformScraper.py against the local stand-in (moodle_standin.py)
+# and reports wall time, pages loaded and WebDriver commands per activity.
+# Arguments after -- are passed on to the scraper, e.g.
+#
+#   bench/scraper_bench.py --courses 5 --actions LD -- -x script -j 4
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from moodle_standin import (StandinServer, add_site_arguments, site_from_args,
+                            scraper_config, completion_overlay)
+
+
+SCRAPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'LernplattformScraper.py')
+
+
+def server_stats(server):
+    with urllib.request.urlopen(server.lernplattform_url + '/__stats') as r:
+        return json.load(r)
+
+
+def stats_delta(before, after):
+    return {key: value - before.get(key, 0)
+            for (key, value) in after.items()
+            if value != before.get(key, 0)}
+
+
+def write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=4)
+
+    return path
+
+
+# one scraper run; returns its statistics
+def run_scraper(server, site, workdir, actions, scraper_args, run_no):
+    stats_file = os.path.join(workdir, f'stats-{run_no}.json')
+    command = [
+        sys.executable, SCRAPER,
+        '-l', os.path.join(workdir, 'credentials.json'),
+        '-c', os.path.join(workdir, 'config.yml'),
+        '--lernplattform-url', server.lernplattform_url,
+        '--idp-url', server.idp_url,
+        '--stats-file', stats_file
+    ]
+    if 'L' in actions:
+        command += ['-L', '-f']
+    if 'D' in actions:
+        command += ['-D', os.path.join(workdir, f'out-{run_no}')]
+    if 'S' in actions:
+        # each run flips every activity, so repeated runs have work to do
+        command += ['-S', write_json(
+            os.path.join(workdir, f'overlay-{run_no}.json'),
+            completion_overlay(site))]
+    command += scraper_args
+
+    before = server_stats(server)
+    start = time.monotonic()
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    wall_time = time.monotonic() - start
+    requests = stats_delta(before, server_stats(server))
+
+    with open(stats_file) as f:
+        scraper_stats = json.load(f)
+
+    listed = (len(json.loads(result.stdout)) if 'L' in actions
+              else None)
+
+    return {
+        'wall_time': wall_time,
+        'scraper_wall_time': scraper_stats['wall_time'],
+        'pages': requests.get('pages', 0),
+        'requests': requests,
+        'webdriver_commands': scraper_stats['webdriver_commands'],
+        'webdriver_commands_by_type':
+        scraper_stats['webdriver_commands_by_type'],
+        'auth': scraper_stats['auth'],
+        'listed': listed
+    }
+
+
+def report(run, activities):
+    print(f'wall time:          {run["wall_time"]:.2f}s '
+          f'({run["scraper_wall_time"]:.2f}s in the scraper)')
+    print(f'pages loaded:       {run["pages"]} '
+          f'({run["pages"] / activities:.2f} per activity)')
+    print(f'files served:       {run["requests"].get("files", 0)} '
+          f'({run["requests"].get("file_bytes", 0)} bytes)')
+    print(f'WebDriver commands: {run["webdriver_commands"]} '
+          f'({run["webdriver_commands"] / activities:.2f} per activity)')
+
+    top = sorted(run['webdriver_commands_by_type'].items(),
+                 key=lambda item: item[1], reverse=True)[:5]
+    print('  ' + ', '.join(f'{name}: {count}' for (name, count) in top))
+
+    if run['listed'] is not None and run['listed'] != activities:
+        print(f'WARNING: listed {run["listed"]} of {activities} activities')
+
+
+if __name__ == '__main__':
+    scraper_args = []
+    argv = sys.argv[1:]
+    if '--' in argv:
+        scraper_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(
+        description=('Benchmarks LernplattformScraper.py against a local '
+                     'stand-in; arguments after -- go to the scraper'))
+    add_site_arguments(parser)
+    parser.add_argument('-a', '--actions', default='L',
+                        help=('Scraper actions to run, any of L (list), D '
+                              '(download) and S (sync completion)'))
+    parser.add_argument('-r', '--runs', type=int, default=1,
+                        help='Number of runs against the same server')
+    parser.add_argument('--json', type=argparse.FileType('w'),
+                        help='Also write the results as JSON to this file')
+
+    args = parser.parse_args(argv)
+
+    site = site_from_args(args)
+    activities = len(site.activities)
+
+    server = StandinServer(site)
+    server.serve_in_background()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write_json(os.path.join(workdir, 'credentials.json'), {
+            'username': server.username,
+            'password': server.password
+        })
+        # JSON is valid YAML
+        write_json(os.path.join(workdir, 'config.yml'), scraper_config(site))
+
+        print(f'{len(site.courses)} courses, {activities} activities, '
+              f'actions {args.actions}, scraper arguments {scraper_args}')
+        for run_no in range(args.runs):
+            run = run_scraper(server, site, workdir, args.actions,
+                              scraper_args, run_no)
+            runs.append(run)
+
+            print(f'--- run {run_no + 1}')
+            report(run, activities)
+
+    server.shutdown()
+
+    if args.json is not None:
+        json.dump({
+            'site': {
+                'courses': len(site.courses),
+                'activities': activities
+            },
+            'actions': args.actions,
+            'scraper_args': scraper_args,
+            'runs': runs
+        }, args.json, indent=4)
@@ -1,108 +1,287 @@
 #!/usr/bin/env python3
 import argparse
-import sys
+import concurrent.futures
+import hashlib
 import json
-import subprocess
+import logging
+import os
+import os.path
+import sys
 
 from bs4 import BeautifulSoup
-from tools.flatten_coursedump import walk_json
-from mebis_scraper.acceptors import LernplattformDownloadAcceptor
+from tools.coursedump_io import CoursedumpReader, locator_path
+from tools.html2org import (CONVERTER_VERSION, ConversionCache, OrgWriter,
+                            log_cache_stats)
+from mebis_scraper.acceptors import (DownloadIndex,
+                                     LernplattformDownloadAcceptor)
+from mebis_scraper.snapshot import HTML_PARSER
 
 
-def pandoc_html_to_org(html):
-    pandoc = subprocess.run(['pandoc', '--from', 'html', '--to', 'org'],
-                            stdout=subprocess.PIPE,
-                            input=html.encode('utf-8'))
-    return pandoc.stdout.decode('utf-8')
+# only needed for HTML that goes to pandoc: html2org drops divs anyway
+def sanitize_html(html):
+    soup = BeautifulSoup(html, HTML_PARSER)
+    if soup.div is not None:
+        soup.div.attrs = {}  # erase useless classes
 
+    return str(soup)
 
-def sanitize_html(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    soup.div.attrs = {}  # erase useless classes
 
-    return soup.prettify()
+# the downloaded file of the activity NAME at LOCATOR, or None; INDEX is a
+# DownloadIndex of DL_DIR
+def find_content(index, dl_dir, locator, name):
+    return index.find_activity(LernplattformDownloadAcceptor.make_path(
+        dl_dir, *locator_path(locator), name))
 
 
-class OrgBuilderVisitor:
-    def __init__(self, dl_dir, workdir, out=sys.stdout):
-        self.out = out
+# Writes the org tree of a coursedump activity by activity: a heading for
+# each course, subcourse and subject, and below it the activities. Input that
+# isn't grouped by course, subcourse and subject gets a heading each time its
+# path changes. HTML is converted by html2org's OrgWriter (with CACHE, a
+# ConversionCache, if given), so close() must be called at the end. Relative
+# paths in links are made relative to LINK_BASE, if given: the directory of
+# the org file, if that isn't the current one.
+class OrgBuilder:
+    def __init__(self, dl_dir, workdir, out=sys.stdout, cache=None,
+                 link_base=None):
+        self.out = OrgWriter(out, cache=cache)
         self.dl_dir = dl_dir
+        self.dl_index = DownloadIndex()
         self.workdir = workdir
+        self.link_base = link_base
 
         self._dir_stack = []
-        self._level = 1
 
-    def enter_dict(self, obj):
-        return True
+    def link_path(self, path):
+        if self.link_base is None or os.path.isabs(path):
+            return path
+        return os.path.relpath(path, self.link_base)
+
+    def enter_path(self, path):
+        common = 0
+        while common < min(len(path), len(self._dir_stack)) \
+                and path[common] == self._dir_stack[common]:
+            common += 1
+
+        if common == len(path) == len(self._dir_stack):
+            return
+
+        for (level, key) in enumerate(path[common:], common + 1):
+            print('*'*level + f' {key}', file=self.out)
+
+        self._dir_stack = list(path)
+
+    # the heading of a course, subcourse or subject, which is otherwise only
+    # written with its first activity
+    def add_group(self, path):
+        self.enter_path(path)
+
+    def add_activity(self, locator, activity):
+        COMPLETE_TEXTS = {
+            False: 'TODO',
+            True: 'DONE'
+        }
+
+        self.enter_path(locator_path(locator))
+        # activities are two levels below their subject
+        level = len(self._dir_stack) + 2
+
+        complete = activity.get('complete', False) or False
+        completed_time = activity.get('completed')
+        name = activity['name']
+        subtext = activity.get('subtext')
+        activity_type = activity['type']
+
+        ctext = COMPLETE_TEXTS[complete]
+        course_wd = self.link_path(LernplattformDownloadAcceptor.make_path(
+            self.workdir, *self._dir_stack, name))
+        print('*'*level +
+              f' {ctext} [[file:{course_wd}/main.org][{name}]]',
+              file=self.out)
+
+        real_content_file = find_content(self.dl_index, self.dl_dir, locator,
+                                         name)
+
+        if completed_time is not None:
+            print(f'CLOSED: {completed_time}', file=self.out)
+
+        if real_content_file is not None:
+            if activity_type in ['modtype_label', 'modtype_page',
+                                 'modtype_url']:
+                with open(real_content_file, 'r') as content_file:
+                    content = content_file.read()
+                    if activity_type == 'modtype_url':
+                        print(f'[[{content}][Link]]', file=self.out)
+                    else:
+                        self.out.write_html(content, sanitize_html)
+            else:
+                print(f'[[{self.link_path(real_content_file)}][File]]',
+                      file=self.out)
+
+        if subtext is not None:
+            print('*'*(level + 1) + ' Note', file=self.out)
+            self.out.write_html(subtext)
+
+    def close(self):
+        self.out.close()
+
+
+# Partitioned output: one org file per course (or per subcourse) in a
+# directory, and index.org linking to them. Partitions are rendered in a
+# process pool. HASH_FILE remembers a hash of each partition's input (its
+# activities and the downloaded files they refer to), and a partition file is
+# only rewritten when that changed.
+INDEX_FILE = 'index.org'
+HASH_FILE = '.coursedump2org-hashes.json'
+
+
+def partition_key(locator, by):
+    (course, subcourse, _) = locator
+    if by == 'subcourse' and subcourse is not None:
+        return (course, subcourse)
+    return (course,)
+
+
+def partition_file(key):
+    return LernplattformDownloadAcceptor.make_path('', ' - '.join(key)) \
+        + '.org'
+
+
+def partition_hash(dl_index, dl_dir, workdir, items):
+    h = hashlib.sha256(json.dumps([CONVERTER_VERSION, dl_dir, workdir])
+                       .encode('utf-8'))
+    for (locator, activity) in items:
+        content = find_content(dl_index, dl_dir, locator, activity['name'])
+        stat = None
+        if content is not None:
+            st = os.stat(content)
+            stat = [content, st.st_size, st.st_mtime_ns]
+
+        h.update(json.dumps([locator, activity, stat]).encode('utf-8'))
+
+    return h.hexdigest()
 
-    def exit_dict(self):
-        pass
 
-    def enter_kv(self, key):
-        print('*'*self._level + f' {key}', file=self.out)
-        self._level += 1
-
-        self._dir_stack.append(key)
-
-        return True
-
-    def exit_kv(self):
-        self._dir_stack.pop()
-        self._level -= 1
-
-    def enter_list(self, obj):
-        self._level += 1
-
-        for activity in obj:
-            COMPLETE_TEXTS = {
-                False: 'TODO',
-                True: 'DONE'
-            }
-
-            complete = activity.get('complete', False) or False
-            completed_time = activity.get('completed')
-            name = activity['name']
-            subtext = activity.get('subtext')
-            activity_type = activity['type']
-
-            ctext = COMPLETE_TEXTS[complete]
-            course_wd = LernplattformDownloadAcceptor.make_path(
-                self.workdir, *self._dir_stack, name)
-            print('*'*self._level +
-                  f' {ctext} [[file:{course_wd}/main.org][{name}]]',
-                  file=self.out)
-
-            content_file = LernplattformDownloadAcceptor.make_path(
-                self.dl_dir, *self._dir_stack, name)
-            real_content_file = LernplattformDownloadAcceptor \
-                .find_activity(content_file)
-
-            if completed_time is not None:
-                print(f'CLOSED: {completed_time}', file=self.out)
-
-            if real_content_file is not None:
-                if activity_type in ['modtype_label', 'modtype_page',
-                                     'modtype_url']:
-                    with open(real_content_file, 'r') as content_file:
-                        content = content_file.read()
-                        if activity_type == 'modtype_url':
-                            print(f'[[{content}][Link]]', file=self.out)
-                        else:
-                            self.out.write(pandoc_html_to_org(
-                                sanitize_html(content)))
-                else:
-                    print(f'[[{real_content_file}][File]]', file=self.out)
-
-            if subtext is not None:
-                print('*'*(self._level + 1) + ' Note', file=self.out)
-                self.out.write(pandoc_html_to_org(subtext))
-
-        self._level -= 1
-        return False
-
-    def exit_list(self):
+# renders the activities ITEMS into the org file PATH; returns the
+# statistics of the conversion cache
+def render_partition(dl_dir, workdir, cache_path, cache_size, path, items):
+    cache = None
+    if cache_path is not None:
+        cache = ConversionCache(cache_path, cache_size)
+
+    with open(path + '.tmp', 'w') as out:
+        orgbuilder = OrgBuilder(dl_dir, workdir, out, cache,
+                                os.path.dirname(path))
+        for (locator, activity) in items:
+            orgbuilder.add_activity(locator, activity)
+        orgbuilder.close()
+    os.replace(path + '.tmp', path)
+
+    if cache is None:
+        return None
+
+    cache.close()
+    return cache.stats()
+
+
+def index_org(keys):
+    lines = []
+    courses = set()
+    for key in keys:
+        link = f'[[file:{partition_file(key)}][{key[-1]}]]'
+        if len(key) == 1:
+            lines.append(f'* {link}')
+            courses.add(key[0])
+        else:
+            if key[0] not in courses:
+                lines.append(f'* {key[0]}')
+                courses.add(key[0])
+            lines.append(f'** {link}')
+
+    return ''.join(line + '\n' for line in lines)
+
+
+def write_if_changed(path, text):
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return
+    except FileNotFoundError:
         pass
 
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def write_partitions(activities, out_dir, dl_dir, workdir, by='course',
+                     jobs=None, cache_path=None,
+                     cache_size=ConversionCache.MAX_SIZE):
+    os.makedirs(out_dir, exist_ok=True)
+
+    partitions = {}
+    for (locator, activity) in activities:
+        partitions.setdefault(partition_key(locator, by), []) \
+            .append((locator, activity))
+    paths = {key: os.path.join(out_dir, partition_file(key))
+             for key in partitions}
+
+    hash_path = os.path.join(out_dir, HASH_FILE)
+    try:
+        with open(hash_path) as f:
+            old_hashes = json.load(f)
+    except FileNotFoundError:
+        old_hashes = {}
+
+    dl_index = DownloadIndex()
+    hashes = {}
+    changed = []
+    for (key, items) in partitions.items():
+        name = partition_file(key)
+        hashes[name] = partition_hash(dl_index, dl_dir, workdir, items)
+        if hashes[name] != old_hashes.get(name) \
+           or not os.path.exists(paths[key]):
+            changed.append((name, paths[key], items))
+
+    logging.getLogger('coursedump2org').info(
+        f'{len(changed)} of {len(partitions)} partitions changed')
+
+    stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    done = {}
+    try:
+        if jobs == 1:
+            for (name, path, items) in changed:
+                done[name] = render_partition(dl_dir, workdir, cache_path,
+                                              cache_size, path, items)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+                futures = {pool.submit(render_partition, dl_dir, workdir,
+                                       cache_path, cache_size, path,
+                                       items): name
+                           for (name, path, items) in changed}
+                for future in concurrent.futures.as_completed(futures):
+                    done[futures[future]] = future.result()
+    finally:
+        # partitions that failed are rendered again next time
+        for (name, _, _) in changed:
+            if name not in done:
+                del hashes[name]
+
+        for name in set(old_hashes) - set(map(partition_file, partitions)):
+            # a course that is gone
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+
+        with open(hash_path, 'w') as f:
+            json.dump(hashes, f, indent=4)
+
+    write_if_changed(os.path.join(out_dir, INDEX_FILE),
+                     index_org(partitions))
+
+    for result in done.values():
+        for (stat, value) in (result or {}).items():
+            stats[stat] += value
+    if cache_path is not None:
+        log_cache_stats(stats)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -120,11 +299,57 @@ if __name__ == '__main__':
     parser.add_argument(
         'coursedump', metavar='coursedump',
         type=argparse.FileType('r'),
-        help='Hierarchical course-dump from which to generate the org file')
+        help=('Course-dump (hierarchical, flat, JSON Lines or binary) from '
+              'which to generate the org file'))
+    parser.add_argument(
+        '--conversion-cache', metavar='FILE',
+        dest='conversion_cache',
+        help=('SQLite file remembering the Org text of converted HTML '
+              'between runs; only new or changed HTML is converted'))
+    parser.add_argument(
+        '--conversion-cache-size', metavar='MIB',
+        dest='conversion_cache_size',
+        type=int,
+        default=ConversionCache.MAX_SIZE >> 20,
+        help=('Size of the conversion cache in MiB; the least recently used '
+              'entries are evicted beyond it'))
+    parser.add_argument(
+        '-o', '--output-dir', metavar='DIRECTORY',
+        dest='output_dir',
+        help=('Write an org file per course (or subcourse) and index.org to '
+              'DIRECTORY instead of everything to stdout; only files whose '
+              'activities or downloads changed are rewritten'))
+    parser.add_argument(
+        '--partition', choices=['course', 'subcourse'],
+        default='course',
+        help='What gets its own file with --output-dir')
+    parser.add_argument(
+        '-j', '--jobs', type=int,
+        help=('Processes rendering files in parallel with --output-dir '
+              '(default: one per CPU)'))
 
     args = parser.parse_args()
 
-    coursedump = json.load(args.coursedump)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.output_dir is not None:
+        write_partitions(CoursedumpReader(args.coursedump), args.output_dir,
+                         args.dl_dir, args.workdir, args.partition,
+                         args.jobs, args.conversion_cache,
+                         args.conversion_cache_size << 20)
+        sys.exit(0)
+
+    cache = None
+    if args.conversion_cache is not None:
+        cache = ConversionCache(args.conversion_cache,
+                                args.conversion_cache_size << 20)
+
+    orgbuilder = OrgBuilder(args.dl_dir, args.workdir, cache=cache)
+    for (locator, activity) in CoursedumpReader(
+            args.coursedump, on_group=orgbuilder.add_group):
+        orgbuilder.add_activity(locator, activity)
+    orgbuilder.close()
 
-    orgbuilder = OrgBuilderVisitor(args.dl_dir, args.workdir)
-    walk_json(orgbuilder, coursedump)
+    if cache is not None:
+        cache.close()
+        log_cache_stats(cache.stats())
@@ -1,10 +1,21 @@
+import concurrent.futures
+import json
 import logging
+import os
 import os.path
 import shutil
+import time
+
+import requests
+from selenium.common.exceptions import NoSuchElementException
 
 from .exceptions import (UncompletableActivityException,
                          UnsupportedActivityException)
+from .snapshot import parse_page_content, parse_folder_page, parse_sesskey
 from selenium_scraping.download import await_download
+from selenium_scraping.profiles import set_download_dir
+from selenium_scraping.streaming import (make_requests_session,
+                                         stream_download)
 
 
 class LernplattformCompletionFilterAcceptor:
@@ -17,10 +28,38 @@ class LernplattformCompletionFilterAcceptor:
             self.acceptor.accept_activity(course, subcourse, subj, activity,
                                           auth, driver)
 
+    def finish(self):
+        self.acceptor.finish()
+
 
+# Sets the completion state of the activities in COMPLETION_DICT (course ->
+# [subcourse ->] subject -> name -> {'complete': ...}). The changes are
+# collected while visiting and sent at finish(): each is a POST of the form
+# behind the activity's completion button (Moodle's togglecompletion.php),
+# CONCURRENCY at a time, retried up to RETRIES times. If some are still
+# rejected, the session may have expired: the driver reloads its page
+# (logging in again if it is sent to the login service) and those changes are
+# sent once more, with the new session and its sesskey. Activities without
+# such a form (e.g. from a structure cache older than it) are clicked right
+# away instead.
 class LernplattformCompletionSyncAcceptor:
-    def __init__(self, completion_dict):
+    RETRIES = 3
+    RETRY_DELAY = 1
+
+    def __init__(self, completion_dict, concurrency=8, retries=RETRIES):
         self.completion_dict = completion_dict
+        self.concurrency = concurrency
+        self.retries = retries
+
+        # (activity name, request, state) of the changes to send, with the
+        # driver whose session they are sent in and its authentication
+        # manager
+        self._changes = []
+        self.driver = None
+        self.auth = None
+
+        self.stats = {'changed': 0, 'unchanged': 0, 'uncompletable': 0,
+                      'failed': 0}
 
     def accept_activity(self, course, subcourse, subj, activity, auth, driver):
         state = None
@@ -35,18 +74,201 @@ class LernplattformCompletionSyncAcceptor:
         except KeyError:
             return  # an unknown activity is normal and shouldn't be changed
 
-        if state is not None:
+        if state is None:
+            return
+
+        try:
+            if state == activity.get_complete_button_state():
+                self.stats['unchanged'] += 1
+                return
+
+            request = activity.get_completion_request()
+            if request is None:
+                activity.toggle_complete_button()
+                self.stats['changed'] += 1
+            else:
+                self._changes.append((activity_name, request, state))
+                self.driver = driver
+                self.auth = auth
+        except UncompletableActivityException:
+            logging.getLogger('activity_sync') \
+                   .warning(f'{activity_name} cannot be completed')
+            self.stats['uncompletable'] += 1
+
+    # sets the completion state with REQUEST, the completion button's form;
+    # returns whether Moodle accepted it
+    def send_change(self, session, request, state):
+        (method, url, params) = request
+        # the form toggles; asking for STATE itself makes retries harmless.
+        # With fromajax, Moodle answers with just "OK".
+        params = dict(params, completionstate=int(state), fromajax=1)
+        if method.lower() == 'get':
+            kwargs = {'params': params}
+        else:
+            kwargs = {'data': params}
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.RETRY_DELAY * 2 ** (attempt - 1))
+
             try:
-                activity.set_complete_button_state(state)
-            except UncompletableActivityException:
-                logging.getLogger('activity_sync') \
-                       .warning(f'{activity_name} cannot be completed')
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException:
+                continue
+
+            if response.ok and response.text.strip() == 'OK':
+                return True
+
+        return False
+
+    # sends CHANGES in a new session of the driver; returns the ones that
+    # failed
+    def send_changes(self, changes):
+        session = make_requests_session(self.driver)
+        with concurrent.futures.ThreadPoolExecutor(
+                self.concurrency) as executor:
+            results = executor.map(
+                lambda change: self.send_change(session, *change[1:]),
+                changes)
+
+            failed = []
+            for (change, ok) in zip(changes, results):
+                if ok:
+                    self.stats['changed'] += 1
+                else:
+                    failed.append(change)
+
+            return failed
+
+    # reloads the driver's page, logging in again if the session has
+    # expired; returns CHANGES with the (new) session's sesskey
+    def renew_session(self, changes):
+        self.auth.invalidate_session()
+        self.auth.acquire_page(self.driver, self.driver.current_url)
+
+        sesskey = parse_sesskey(self.driver.page_source)
+        if sesskey is None:
+            return changes
+
+        renewed = []
+        for (activity_name, (method, url, params), state) in changes:
+            if 'sesskey' in params:
+                params = dict(params, sesskey=sesskey)
+            renewed.append((activity_name, (method, url, params), state))
+
+        return renewed
+
+    def finish(self):
+        if self._changes:
+            failed = self.send_changes(self._changes)
+            if failed:
+                logging.getLogger('activity_sync').info(
+                    f'{len(failed)} changes were rejected; renewing the '
+                    f'session to send them again')
+                failed = self.send_changes(self.renew_session(failed))
+
+            for (activity_name, _, _) in failed:
+                logging.getLogger('activity_sync').warning(
+                    f'Could not change the completion of {activity_name}')
+                self.stats['failed'] += 1
+
+            self._changes = []
+
+        logging.getLogger('activity_sync').info(
+            f'{self.stats["changed"]} changed, {self.stats["unchanged"]} '
+            f'unchanged, {self.stats["uncompletable"]} uncompletable, '
+            f'{self.stats["failed"]} failed')
+
+
+# The files of a download tree by directory and name without extension, the
+# way LernplattformDownloadAcceptor.find_activity looks for them, so that
+# finding an activity's file doesn't list its directory again for every
+# activity. Directories are listed the first time they are looked into;
+# files that are added later must be reported with add().
+class DownloadIndex:
+    def __init__(self):
+        # directory -> {name without extension: file name}
+        self._dirs = {}
+
+    def _listing(self, directory):
+        listing = self._dirs.get(directory)
+        if listing is None:
+            listing = {}
+            try:
+                for activity_file in os.listdir(directory):
+                    (name, ext) = os.path.splitext(activity_file)
+                    listing.setdefault(name, activity_file)
+            except FileNotFoundError:
+                # created when the first download lands, and add()ed to then
+                pass
+            self._dirs[directory] = listing
+
+        return listing
+
+    def find_activity(self, target_file):
+        (directory, activity_name) = os.path.split(target_file)
+
+        activity_file = self._listing(directory).get(activity_name)
+        if activity_file is None:
+            return None
+        return os.path.join(directory, activity_file)
+
+    def add(self, path):
+        (directory, activity_file) = os.path.split(path)
+
+        # directories that haven't been listed yet will be listed with it
+        listing = self._dirs.get(directory)
+        if listing is not None:
+            (name, ext) = os.path.splitext(activity_file)
+            listing.setdefault(name, activity_file)
+
+    def remove(self, path):
+        (directory, activity_file) = os.path.split(path)
+
+        listing = self._dirs.get(directory)
+        name = os.path.splitext(activity_file)[0]
+        if listing is not None and listing.get(name) == activity_file:
+            del listing[name]
 
 
 class LernplattformDownloadAcceptor:
-    def __init__(self, path, driver_download_dir):
+    BROWSER_DOWNLOAD_TYPES = ['modtype_resource', 'modtype_folder']
+    STREAM_TYPES = ['modtype_resource', 'modtype_folder', 'modtype_page']
+
+    # If WATCHER (a DownloadWatcher) is given, browser downloads are not
+    # awaited one after another: each is saved into its own directory and
+    # moved into place once the watcher sees it finish. With a BlobStore
+    # (STORE), files are kept there once and only linked into PATH.
+    #
+    # With a DownloadManifest (MANIFEST), every file is recorded there once
+    # it is complete. A file whose entry has another size (e.g. cut short by
+    # a crash) is downloaded again, and only replaced once the new download
+    # has succeeded; files without an entry (e.g. from before there was a
+    # manifest) are taken as they are. With RESUME, interrupted streamed
+    # downloads continue where they stopped.
+    def __init__(self, path, driver_download_dir, stream=True, watcher=None,
+                 store=None, manifest=None, resume=False):
         self.out_dir = path
         self.src_dir = driver_download_dir
+        self.stream = stream
+        self.watcher = watcher
+        self.store = store
+        self.manifest = manifest
+        self.resume = resume
+
+        # made from the driver's cookies on first use, when it is logged in
+        self.session = None
+
+        # target file -> (source, type) of browser downloads that are still
+        # in progress
+        self._pending = {}
+        self.index = DownloadIndex()
+
+        # target file -> incomplete file to replace once it is downloaded
+        self._stale = {}
+
+        # the last browser download handed to the watcher
+        self._last_download = None
 
     def make_path(basedir, *args):
         def escape_filename(filename):
@@ -55,22 +277,164 @@ class LernplattformDownloadAcceptor:
         paths = filter(lambda f: f is not None, args)
         return os.path.join(basedir, *map(escape_filename, paths))
 
+    # one-off lookup; use a DownloadIndex for more than one
     def find_activity(target_file):
-        activity_path = os.path.dirname(target_file)
-        activity_name = os.path.basename(target_file)
+        return DownloadIndex().find_activity(target_file)
 
+    def activity_source(activity):
         try:
-            for activity_file in os.listdir(activity_path):
-                (name, ext) = os.path.splitext(activity_file)
+            return activity.get_download_href()
+        except NoSuchElementException:
+            return None
+
+    # PATH, the file of TARGET_FILE's activity, is complete: make it count
+    # as downloaded, in place of the incomplete file it replaces. DIGEST is
+    # its hash, if the blob store has already computed it.
+    def add_download(self, target_file, path, source, activity_type,
+                     digest=None):
+        stale = self._stale.pop(target_file, None)
+        if stale is not None and stale != path:
+            os.remove(stale)
+            self.index.remove(stale)
+            self.manifest.forget(stale)
+
+        self.index.add(path)
+        if self.manifest is not None:
+            self.manifest.record(path, source, activity_type, digest)
+
+    # the file of TARGET_FILE's activity (ACTIVITY) if it was downloaded
+    # completely; an incomplete one is remembered to be replaced
+    def find_download(self, target_file, activity):
+        path = self.index.find_activity(target_file)
+        if path is None or self.manifest is None:
+            return path
+
+        entry = self.manifest.lookup(path)
+        if entry is None:
+            # downloaded before there was a manifest: take it as it is
+            self.manifest.record(path,
+                                 self.__class__.activity_source(activity),
+                                 activity.get_type())
+            return path
+        if os.path.getsize(path) == entry['size']:
+            return path
+
+        logging.getLogger('download').warning(
+            f'\'{path}\' is incomplete; downloading it again')
+        self._stale[target_file] = path
+        return None
 
-                if name == activity_name:
-                    return os.path.join(activity_path, activity_file)
-        except FileNotFoundError:
-            # if its directory doesn't exist, the activity file can't either,
-            # so return None (below)
-            pass
+    def get_session(self, driver):
+        if self.session is None:
+            self.session = make_requests_session(driver)
 
-        return None
+        return self.session
+
+    def fetch_page(self, url, driver):
+        response = self.get_session(driver).get(url)
+        response.raise_for_status()
+
+        return response.text
+
+    # Downloads the activity over HTTP, without the browser. Pages and
+    # folders that have their own page are fetched the same way, so the
+    # browser never has to leave the course page for them. Returns whether
+    # that was possible; if not, most likely the session has expired, so
+    # the browser has to log in again and its new cookies are picked up next
+    # time.
+    def stream_activity(self, activity, target_file, driver):
+        activity_type = activity.get_type()
+        if activity_type not in self.STREAM_TYPES:
+            return False
+
+        href = activity.get_download_href()
+        if href is None:
+            return False
+
+        if activity_type == 'modtype_page':
+            content = parse_page_content(self.fetch_page(href, driver))
+            if content is None:
+                self.session = None
+                return False
+
+            os.makedirs(os.path.dirname(target_file), exist_ok=True)
+            self.add_download(target_file, self.__class__.write_content(
+                target_file, activity_type, content), href, activity_type)
+            return True
+
+        request = activity.get_download_request()
+        if request is None and activity_type == 'modtype_folder':
+            form = parse_folder_page(self.fetch_page(href, driver))
+            if form is None:
+                self.session = None
+                return False
+
+            request = (form['method'], form['action'], form['params'])
+        elif request is None:
+            return False
+
+        (method, url, params) = request
+        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+        (path, digest) = stream_download(
+            self.get_session(driver), method, url, params, target_file,
+            store=self.store, partials=self.manifest if self.resume else None)
+        if path is None:
+            self.session = None
+            return False
+
+        self.add_download(target_file, path, href, activity_type, digest)
+        return True
+
+    def write_content(target_file, activity_type, content):
+        TYPE_EXT_MAPPING = {
+            'modtype_page': '.page',
+            'modtype_label': '.label',
+            'modtype_url': '.url'
+        }
+        ext = TYPE_EXT_MAPPING[activity_type]
+
+        # a file it replaces is kept until the new one is complete
+        with open(target_file + ext + '.part', 'w') as out:
+            out.write(content)
+        os.replace(target_file + ext + '.part', target_file + ext)
+
+        return target_file + ext
+
+    def move_download(self, download_file, target_file, source,
+                      activity_type):
+        ext = os.path.splitext(download_file)[1]
+
+        digest = None
+        if self.store is not None:
+            digest = self.store.add_file(download_file)
+            self.store.link(digest, target_file + ext)
+        else:
+            shutil.move(download_file, target_file + ext + '.part')
+            os.replace(target_file + ext + '.part', target_file + ext)
+
+        self.add_download(target_file, target_file + ext, source,
+                          activity_type, digest)
+
+    def _handle_watched(self, finished, failed):
+        for (target_file, download_file) in finished:
+            (source, activity_type) = self._pending.pop(target_file)
+            self.move_download(download_file, target_file, source,
+                               activity_type)
+            self.watcher.cleanup(os.path.dirname(download_file))
+
+        for e in failed:
+            logging.getLogger('download').warning(
+                f'Download of \'{e.download.key}\' failed: {e.reason}')
+            self.watcher.cleanup(e.download.directory)
+            self._pending.pop(e.download.key, None)
+            self._stale.pop(e.download.key, None)
+
+    def collect_downloads(self):
+        self._handle_watched(*self.watcher.poll())
+
+    def finish(self):
+        if self.watcher is not None:
+            self._handle_watched(*self.watcher.wait_all())
 
     def accept_activity(self, course, subcourse, subj, activity, auth, driver):
         activity_name = activity.get_name()
@@ -79,38 +443,59 @@ class LernplattformDownloadAcceptor:
         target_file = self.__class__.make_path(
             self.out_dir, course, subcourse, subj, activity_name)
 
-        if self.__class__.find_activity(target_file) is None:
+        if target_file not in self._pending \
+           and self.find_download(target_file, activity) is None:
             logging.getLogger('download').info(
                 f'Download activity \'{activity_name}\' ({activity_type})')
 
+            if self.stream:
+                if self.stream_activity(activity, target_file, driver):
+                    return
+                elif self.session is None:
+                    # the HTTP session expired, so the browser's has, too
+                    auth.invalidate_session()
+
+            download_dir = None
+            if self.watcher is not None \
+               and activity_type in self.BROWSER_DOWNLOAD_TYPES:
+                if self._last_download is not None \
+                   and not self.watcher.wait_started(self._last_download):
+                    logging.getLogger('download').warning(
+                        f'Download of \'{self._last_download.key}\' hasn\'t '
+                        'started; its file may end up with the next one')
+                download_dir = self.watcher.new_download_dir()
+                set_download_dir(driver, download_dir)
+
             try:
                 res = activity.download(driver, auth)
             except UnsupportedActivityException:
                 logging.getLogger('download').warning(
                     f'Cannot download activity \'{activity_name}\': '
                     f'its type ({activity_type}) is unsupported.')
+                if download_dir is not None:
+                    self.watcher.cleanup(download_dir)
+                self._stale.pop(target_file, None)
                 return
 
             os.makedirs(os.path.dirname(target_file), exist_ok=True)
-
-            if res is None:
+            source = (self.__class__.activity_source(activity)
+                      if self.manifest is not None else None)
+
+            if res is None and download_dir is not None:
+                self._last_download = self.watcher.add(download_dir,
+                                                       target_file)
+                self._pending[target_file] = (source, activity_type)
+                self.collect_downloads()
+            elif res is None:
                 await_download(self.src_dir)
 
                 download_file = os.listdir(self.src_dir)[0]
-                src_file = os.path.join(self.src_dir, download_file)
-
-                ext = os.path.splitext(download_file)[1]
-                shutil.move(src_file, target_file + ext)
+                self.move_download(
+                    os.path.join(self.src_dir, download_file), target_file,
+                    source, activity_type)
             else:
-                TYPE_EXT_MAPPING = {
-                    'modtype_page': '.page',
-                    'modtype_label': '.label',
-                    'modtype_url': '.url'
-                }
-                ext = TYPE_EXT_MAPPING[activity_type]
-
-                with open(target_file + ext, 'w') as out:
-                    out.write(res)
+                self.add_download(target_file, self.__class__.write_content(
+                    target_file, activity_type, res), source, activity_type)
         else:
             logging.getLogger('download').info(
                 f'Skip download of \'{activity_name}\': already downloaded')
@@ -138,13 +523,16 @@ class LernplattformListerAcceptor:
                 .setdefault(subcourse, {}) \
                 .setdefault(subj, []).append(res)
 
+    def finish(self):
+        pass
+
 
 class LernplattformFlatListerAcceptor:
     def __init__(self):
         self.result = []
 
-    def accept_activity(self, course, subcourse, subj, activity, auth, driver):
-        self.result.append({
+    def flat_record(course, subcourse, subj, activity):
+        return {
             'name': activity.get_name(),
             'type': activity.get_type(),
             'complete': activity.get_complete_button_state_none(),
@@ -153,7 +541,66 @@ class LernplattformFlatListerAcceptor:
             'course': course,
             'subcourse': subcourse,
             'subject': subj
-        })
+        }
+
+    def accept_activity(self, course, subcourse, subj, activity, auth, driver):
+        self.result.append(self.__class__.flat_record(
+            course, subcourse, subj, activity))
+
+    def finish(self):
+        pass
+
+
+# Writes each activity to OUT as soon as it is accepted, as a line of JSON in
+# the flat format (JSON Lines), so that a crashed run still leaves everything
+# listed up to then. OUT is flushed at most every FLUSH_INTERVAL seconds.
+class LernplattformStreamingListerAcceptor:
+    FLUSH_INTERVAL = 5
+
+    def __init__(self, out, flush_interval=FLUSH_INTERVAL):
+        self.out = out
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def write_record(self, locator, record):
+        self.out.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.out.flush()
+
+    def accept_activity(self, course, subcourse, subj, activity, auth, driver):
+        record = LernplattformFlatListerAcceptor.flat_record(
+            course, subcourse, subj, activity)
+        self.write_record((course, subcourse, subj), record)
+
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+            self._last_flush = now
+
+    def finish(self):
+        self.flush()
+
+
+# Like LernplattformStreamingListerAcceptor, but writes a binary coursedump
+# through WRITER (a BinaryCoursedumpWriter from tools/coursedump_binary.py).
+# Flushing writes out a partial block, so a crashed run leaves a readable
+# dump here too.
+class LernplattformBinaryListerAcceptor(LernplattformStreamingListerAcceptor):
+    def __init__(self, writer,
+                 flush_interval=LernplattformStreamingListerAcceptor
+                 .FLUSH_INTERVAL):
+        super().__init__(None, flush_interval)
+        self.writer = writer
+
+    def write_record(self, locator, record):
+        self.writer.write(locator, record)
+
+    def flush(self):
+        self.writer.flush()
+
+    def finish(self):
+        self.writer.close()
 
 
 class LernplattformCompositeAcceptor:
@@ -167,3 +614,7 @@ class LernplattformCompositeAcceptor:
         for acceptor in self.acceptors:
             acceptor.accept_activity(course, subcourse, subj,
                                      activity, auth, driver)
+
+    def finish(self):
+        for acceptor in self.acceptors:
+            acceptor.finish()
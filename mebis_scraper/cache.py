@@ -0,0 +1,115 @@
+import json
+import logging
+import sqlite3
+import threading
+
+from .snapshot import ActivityRecord, SectionRecord
+
+
+FORM_FIELDS = ['download_form', 'completion_form']
+
+
+def replace_sesskey(record, sesskey):
+    # the session key in a folder's download form (and in completion forms)
+    # changes with every login, so it isn't stored; cached records get the
+    # current one instead. Without one, such a form is useless and dropped:
+    # the activity is then clicked instead.
+    for field in FORM_FIELDS:
+        form = getattr(record, field)
+        if form is not None and 'sesskey' in form['params']:
+            if sesskey is None:
+                setattr(record, field, None)
+            else:
+                form['params']['sesskey'] = sesskey
+
+
+# Remembers the structure of course pages between runs: for each section of a
+# page, its activity records and a fingerprint of the section's HTML. A
+# section whose fingerprint hasn't changed needn't be extracted again.
+class StructureCache:
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sections (
+        page TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        section_id TEXT,
+        fingerprint TEXT NOT NULL,
+        name TEXT NOT NULL,
+        activities TEXT NOT NULL,
+        PRIMARY KEY (page, position)
+    )
+    '''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(self.SCHEMA)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # {section id: fingerprint} of the sections of PAGE seen last time
+    def fingerprints(self, page):
+        with self._lock:
+            rows = self.db.execute(
+                'SELECT section_id, fingerprint FROM sections WHERE page = ?',
+                (page,)).fetchall()
+
+        return dict(rows)
+
+    # counts a section that was extracted without looking it up
+    def count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def get_section(self, page, section_id, fingerprint, sesskey=None):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT name, activities FROM sections WHERE page = ? '
+                'AND section_id = ? AND fingerprint = ?',
+                (page, section_id, fingerprint)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        (name, activities) = row
+        records = list(map(ActivityRecord.from_dict, json.loads(activities)))
+        for record in records:
+            replace_sesskey(record, sesskey)
+
+        return SectionRecord(section_id, name, records)
+
+    # replaces everything known about PAGE with SECTIONS:
+    # [(fingerprint, SectionRecord)]
+    def put_sections(self, page, sections):
+        rows = []
+        for (position, (fingerprint, section)) in enumerate(sections):
+            activities = [record.as_dict() for record in section.activities]
+            for activity in activities:
+                for field in FORM_FIELDS:
+                    form = activity[field]
+                    if form is not None and 'sesskey' in form['params']:
+                        # a copy: the record itself is still used
+                        activity[field] = dict(
+                            form, params=dict(form['params'], sesskey=''))
+
+            rows.append((page, position, section.id, fingerprint,
+                         section.name, json.dumps(activities)))
+
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM sections WHERE page = ?', (page,))
+            self.db.executemany(
+                'INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        logging.getLogger('structure_cache').info(
+            f'{self.hits} sections reused, {self.misses} extracted')
+        self.db.close()
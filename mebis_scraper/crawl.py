@@ -0,0 +1,73 @@
+from .scrapers import LernplattformScraper
+from .snapshot import (make_soup, parse_sections, parse_sesskey,
+                       parse_active_subcourse, parse_secondary_subcourses)
+
+
+# Shared by the crawlers that fetch pages out of order (concurrently) and then
+# drive the visitor in the order LernplattformScraper.visit would.
+
+class CoursePage:
+    def __init__(self, url, subcourse, sections, secondary_subcourses):
+        self.url = url
+        self.subcourse = subcourse
+        self.sections = sections
+        self.secondary_subcourses = secondary_subcourses
+
+    def from_page(url, page_source, cache=None):
+        soup = make_soup(page_source)
+
+        return CoursePage(url, parse_active_subcourse(soup),
+                          parse_sections(soup, cache, url,
+                                         parse_sesskey(page_source)),
+                          parse_secondary_subcourses(soup))
+
+
+def wanted_courses(visitor, courses):
+    result = []
+    for (name, href) in courses.items():
+        if visitor.enter_course(name):
+            result.append((name, href))
+            visitor.exit_course()
+
+    return result
+
+
+def wanted_subcourses(visitor, course_name, subcourses):
+    result = []
+    if visitor.enter_course(course_name):
+        for subcourse in subcourses:
+            if visitor.enter_subcourse(subcourse[0]):
+                result.append(subcourse)
+                visitor.exit_subcourse()
+
+        visitor.exit_course()
+
+    return result
+
+
+# tabs: {subcourse name: CoursePage} for every wanted secondary subcourse
+def visit_course_page(driver, auth, visitor, page, tabs):
+    course_handler = LernplattformScraper.Course(driver)
+
+    if page.subcourse is not None:
+        if visitor.enter_subcourse(page.subcourse):
+            course_handler.visit_sections(page.sections, visitor, auth,
+                                          page.url)
+            visitor.exit_subcourse()
+
+        for (name, _) in page.secondary_subcourses:
+            if visitor.enter_subcourse(name):
+                tab = tabs[name]
+                course_handler.visit_sections(tab.sections, visitor, auth,
+                                              tab.url)
+                visitor.exit_subcourse()
+    else:
+        course_handler.visit_sections(page.sections, visitor, auth, page.url)
+
+
+# crawled: [(course name, CoursePage, tabs)], in dashboard order
+def visit_crawled(driver, auth, visitor, crawled):
+    for (name, page, tabs) in crawled:
+        if visitor.enter_course(name):
+            visit_course_page(driver, auth, visitor, page, tabs)
+            visitor.exit_course()
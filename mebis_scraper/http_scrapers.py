@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from urllib.parse import urlparse
+
+import aiohttp
+from yarl import URL
+
+from .scrapers import LernplattformScraper
+from .snapshot import parse_course_links
+from .crawl import (CoursePage, wanted_courses, wanted_subcourses,
+                    visit_crawled)
+from selenium_scraping.sessions import get_user_agent, cookie_url
+
+
+# Crawls the Lernplattform over plain HTTP, reusing the cookies of a WebDriver
+# session that has already been logged in. Pages are fetched concurrently; the
+# visitor is then driven in the same order LernplattformScraper.visit would
+# drive it. Pages that can't be fetched over HTTP (e.g. because the session
+# expired) are loaded with the WebDriver instead.
+class LernplattformHTTPScraper:
+    lernplattform_url = LernplattformScraper.lernplattform_url
+
+    def __init__(self, driver, auth, concurrency=8, cache=None,
+                 lernplattform_url=None):
+        self.driver = driver
+        self.auth = auth
+        self.concurrency = concurrency
+        self.cache = cache
+        if lernplattform_url is not None:
+            self.lernplattform_url = lernplattform_url
+
+        self.pages_fetched = 0
+        self.driver_fallbacks = 0
+
+        self._driver_lock = None
+
+    def is_lernplattform_url(self, url):
+        return (urlparse(url).hostname
+                == urlparse(self.lernplattform_url).hostname)
+
+    def update_cookie_jar(self, jar):
+        for cookie in self.driver.get_cookies():
+            jar.update_cookies({cookie['name']: cookie['value']},
+                               response_url=URL(cookie_url(cookie)))
+
+    def make_session(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.concurrency)
+        jar = aiohttp.CookieJar()
+        self.update_cookie_jar(jar)
+
+        return aiohttp.ClientSession(
+            connector=connector, cookie_jar=jar,
+            headers={'User-Agent': get_user_agent(self.driver)})
+
+    async def _fetch_http(self, session, url):
+        try:
+            async with session.get(url) as response:
+                # a redirect away from the Lernplattform means that we have
+                # been sent to the login service
+                if response.status == 200 \
+                   and self.is_lernplattform_url(str(response.url)):
+                    self.pages_fetched += 1
+                    return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.getLogger('http_scraper') \
+                   .warning(f'Fetching {url} failed: {e}')
+
+        return None
+
+    def _fetch_driver(self, url):
+        self.auth.acquire_page(self.driver, url)
+        LernplattformScraper.Course.expand_sections(self.driver)
+
+        return self.driver.page_source
+
+    async def fetch_page(self, session, url):
+        page = await self._fetch_http(session, url)
+        if page is not None:
+            return page
+
+        logging.getLogger('http_scraper') \
+               .info(f'Falling back to WebDriver for {url}')
+
+        # there is only one driver, so fallbacks can't run concurrently
+        async with self._driver_lock:
+            self.driver_fallbacks += 1
+            page = await asyncio.get_running_loop().run_in_executor(
+                None, self._fetch_driver, url)
+
+            # the driver may have logged in again
+            self.update_cookie_jar(session.cookie_jar)
+
+        return page
+
+    async def fetch_course_page(self, session, url):
+        return CoursePage.from_page(url, await self.fetch_page(session, url),
+                                    self.cache)
+
+    async def crawl_course(self, session, visitor, name, href):
+        page = await self.fetch_course_page(session, href)
+
+        # no await between entering and leaving the course, so visitor state
+        # never interleaves between courses
+        wanted = wanted_subcourses(visitor, name, page.secondary_subcourses)
+        tabs = await asyncio.gather(*(
+            self.fetch_course_page(session, subcourse_href)
+            for (_, subcourse_href) in wanted))
+
+        return (name, page, dict(zip((n for (n, _) in wanted), tabs)))
+
+    async def crawl(self, visitor):
+        self._driver_lock = asyncio.Lock()
+
+        async with self.make_session() as session:
+            dashboard = await self.fetch_page(session,
+                                              self.lernplattform_url)
+
+            courses = wanted_courses(visitor, parse_course_links(dashboard))
+
+            return await asyncio.gather(*(
+                self.crawl_course(session, visitor, name, href)
+                for (name, href) in courses))
+
+    def visit(self, visitor):
+        # log in through the browser; its cookies are then used for HTTP
+        self.auth.acquire_page(self.driver, self.lernplattform_url)
+
+        visit_crawled(self.driver, self.auth, visitor,
+                      asyncio.run(self.crawl(visitor)))
+
+        logging.getLogger('http_scraper').info(
+            f'Fetched {self.pages_fetched} pages over HTTP, '
+            f'{self.driver_fallbacks} through the WebDriver')
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .scrapers import LernplattformScraper
+from .snapshot import parse_course_links
+from .crawl import (CoursePage, wanted_courses, wanted_subcourses,
+                    visit_crawled)
+
+
+# Loads course pages and subcourse tabs on a WebDriverPool, one page per idle
+# session. Once everything has been extracted, the visitor is driven on the
+# caller's driver in the same order LernplattformScraper.visit would drive it,
+# so the acceptors' results don't depend on which session loaded which page.
+class LernplattformParallelScraper:
+    lernplattform_url = LernplattformScraper.lernplattform_url
+
+    def __init__(self, driver, auth, pool, cache=None,
+                 lernplattform_url=None):
+        self.driver = driver
+        self.auth = auth
+        self.pool = pool
+        self.cache = cache
+        if lernplattform_url is not None:
+            self.lernplattform_url = lernplattform_url
+
+    def fetch_course_page(self, url):
+        with self.pool.acquire() as driver:
+            self.auth.acquire_page(driver, url)
+            LernplattformScraper.Course.expand_sections(driver)
+
+            return CoursePage.from_page(url, driver.page_source, self.cache)
+
+    def crawl(self, courses, visitor):
+        pages = {}
+        tab_futures = {}
+
+        with ThreadPoolExecutor(max_workers=len(self.pool)) as executor:
+            course_futures = {
+                executor.submit(self.fetch_course_page, href): name
+                for (name, href) in courses}
+
+            # subcourse tabs are only known once their course page has been
+            # loaded; hand them to the pool as soon as that happens
+            for future in as_completed(course_futures):
+                name = course_futures[future]
+                page = future.result()
+                pages[name] = page
+
+                for (tab, href) in wanted_subcourses(
+                        visitor, name, page.secondary_subcourses):
+                    tab_futures[(name, tab)] = executor.submit(
+                        self.fetch_course_page, href)
+
+            return [(name, pages[name],
+                     {tab: future.result()
+                      for ((course, tab), future) in tab_futures.items()
+                      if course == name})
+                    for (name, _) in courses]
+
+    def visit(self, visitor):
+        self.auth.acquire_page(self.driver, self.lernplattform_url)
+        courses = wanted_courses(visitor,
+                                 parse_course_links(self.driver.page_source))
+
+        self.pool.share_login()
+
+        visit_crawled(self.driver, self.auth, visitor,
+                      self.crawl(courses, visitor))
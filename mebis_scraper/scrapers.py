@@ -1,17 +1,41 @@
 from selenium.common.exceptions import NoSuchElementException
 from .exceptions import (UnsupportedActivityException,
                          UncompletableActivityException)
+from .snapshot import parse_course_page
+from .scripts import extract_course_page
+from selenium_scraping.windows import new_window, submit_form
 from contextlib import contextmanager
 import logging
 
 
 class LernplattformScraper:
     lernplattform_url = 'https://lernplattform.mebis.bayern.de'
+    logout_url = 'https://idp.mebis.bayern.de/idp/logout.jsp'
 
+    # Attributes read from the page are remembered, so that several acceptors
+    # asking for them cost one WebDriver round trip. They are forgotten
+    # whenever the element is replaced (as download() does) and after the
+    # completion button is clicked.
     class Activity:
         def __init__(self, webelement):
             self.el = webelement
 
+        @property
+        def el(self):
+            return self._el
+
+        @el.setter
+        def el(self, webelement):
+            self._el = webelement
+            self._attrs = {}
+
+        def _memoized(self, key, compute):
+            try:
+                return self._attrs[key]
+            except KeyError:
+                value = self._attrs[key] = compute()
+                return value
+
         def from_id(driver, el_id):
             return LernplattformScraper.Activity(
                 driver.find_element_by_id(el_id))
@@ -20,6 +44,9 @@ class LernplattformScraper:
             return LernplattformScraper.Activity(webelement)
 
         def get_type(self):
+            return self._memoized('type', self._read_type)
+
+        def _read_type(self):
             classes = self.el.get_attribute('class').split(' ')
 
             for class_name in classes:
@@ -33,6 +60,9 @@ class LernplattformScraper:
                 './/span[contains(@class, "instancename")]/..')
 
         def get_name(self):
+            return self._memoized('name', self._read_name)
+
+        def _read_name(self):
             try:
                 return self.el.find_element_by_css_selector(
                     'span.instancename').text.split('\n', maxsplit=1)[0]
@@ -48,6 +78,9 @@ class LernplattformScraper:
                     return ''
 
         def get_subtext(self):
+            return self._memoized('subtext', self._read_subtext)
+
+        def _read_subtext(self):
             try:
                 return self.el.find_element_by_class_name(
                     'contentafterlink').get_attribute('outerHTML')
@@ -62,33 +95,52 @@ class LernplattformScraper:
                 raise UncompletableActivityException
 
         def get_complete_button_state(self):
-            btn = self.get_complete_button_element()
+            state = self.get_complete_button_state_none()
+            if state is None:
+                raise UncompletableActivityException
+
+            return state
+
+        def _read_complete_button_state(self):
+            try:
+                btn = self.get_complete_button_element()
+            except UncompletableActivityException:
+                return None
 
             img = btn.find_element_by_tag_name('img')
             alt = img.get_attribute('alt')
             return alt.startswith('Abgeschlossen')
 
         def get_complete_button_state_none(self):
-            try:
-                return self.get_complete_button_state()
-            except UncompletableActivityException:
-                return None
+            return self._memoized('complete',
+                                  self._read_complete_button_state)
 
         def get_complete_button_state_false(self):
-            try:
-                return self.get_complete_button_state()
-            except UncompletableActivityException:
-                return False
+            return self.get_complete_button_state_none() or False
 
         def toggle_complete_button(self):
             self.get_complete_button_element().click()
+            self._attrs = {}
 
         def set_complete_button_state(self, state):
             if state != self.get_complete_button_state():
                 self.toggle_complete_button()
 
-        # all Activity instances _may_ be invalidated after a call to this
-        # function. Use IDs instead.
+        # (method, url, params) of the form the completion button submits,
+        # or None
+        def get_completion_request(self):
+            try:
+                form = self.get_complete_button_element() \
+                           .find_element_by_xpath('./ancestor::form')
+            except NoSuchElementException:
+                return None
+
+            return self.__class__.form_download_request(form)
+
+        # pages and folders with their own page are loaded in a second window,
+        # so the course page isn't left. Still, all Activity instances _may_
+        # be invalidated after a call to this function (e.g. if the login
+        # page shows up). Use IDs instead.
         def download(self, driver, auth):
             DOWNLOADERS = {
                 'modtype_resource': self._download_resource,
@@ -113,6 +165,40 @@ class LernplattformScraper:
 
             return None
 
+        def resource_download_request(href):
+            # redirect=1 makes view.php send the file itself, even if the
+            # resource is configured to be embedded into a page
+            return ('get', href, {'redirect': 1})
+
+        def form_download_request(form):
+            params = {}
+            for hidden in form.find_elements_by_css_selector(
+                    'input[type="hidden"]'):
+                params[hidden.get_attribute('name')] = \
+                    hidden.get_attribute('value')
+
+            return (form.get_attribute('method') or 'get',
+                    form.get_attribute('action'), params)
+
+        # (method, url, params) with which the activity's file can be
+        # downloaded without the browser, or None
+        def get_download_request(self):
+            activity_type = self.get_type()
+            if activity_type == 'modtype_resource':
+                return self.__class__.resource_download_request(
+                    self.get_download_href())
+            elif activity_type == 'modtype_folder':
+                try:
+                    button = self.__class__.find_folder_download_button(
+                        self.el)
+                except NoSuchElementException:
+                    return None  # the folder has its own page
+
+                return self.__class__.form_download_request(
+                    button.find_element_by_xpath('./ancestor::form'))
+
+            return None
+
         def find_folder_download_button(el):
             return el.find_element_by_xpath(
                 ".//input[@value='Verzeichnis herunterladen']")
@@ -121,36 +207,38 @@ class LernplattformScraper:
             LernplattformScraper.Activity.find_folder_download_button(el) \
                                          .click()
 
-        # may change page
+        def get_download_href(self):
+            return self._memoized(
+                'href',
+                lambda: self.get_download_link().get_attribute('href'))
+
         def _download_folder(self, driver, auth):
             try:
                 self.__class__.download_folder(self.el)
                 auth.handle_login_page(driver)
             except NoSuchElementException:
-                old_page = driver.current_url
-
-                self.get_download_link().click()
-                auth.handle_login_page(driver)
-
-                self.__class__.download_folder(driver)
+                # the folder has its own page: read its download form in a
+                # second window and submit it from the course page, which
+                # stays loaded since the response is a download
+                with new_window(driver, self.get_download_href()):
+                    auth.check_login_page(driver)
+
+                    button = self.__class__.find_folder_download_button(
+                        driver)
+                    request = self.__class__.form_download_request(
+                        button.find_element_by_xpath('./ancestor::form'))
+
+                submit_form(driver, *request)
                 auth.handle_login_page(driver)
 
-                driver.get(old_page)
-
             return None
 
         def _download_page(self, driver, auth):
-            old_page = driver.current_url
-
-            self.get_download_link().click()
-            auth.handle_login_page(driver)
-
-            res = driver.find_element_by_class_name('generalbox') \
-                        .get_attribute('outerHTML')
+            with new_window(driver, self.get_download_href()):
+                auth.check_login_page(driver)
 
-            driver.get(old_page)
-
-            return res
+                return driver.find_element_by_class_name('generalbox') \
+                             .get_attribute('outerHTML')
 
         def _download_link(self, driver, auth):
             return self.get_download_link().get_attribute('href')
@@ -161,6 +249,86 @@ class LernplattformScraper:
         def _download_label(self, driver, auth):
             return self.get_label_element().get_attribute('outerHTML')
 
+    # Activity backed by a record parsed from a page snapshot. Attributes are
+    # served from the record; only actions that need a click go through the
+    # live DOM.
+    class RecordActivity:
+        def __init__(self, record, driver, auth, page_url):
+            self.record = record
+            self.driver = driver
+            self.auth = auth
+            self.page_url = page_url
+
+        def get_type(self):
+            return self.record.modtype
+
+        def get_name(self):
+            return self.record.name
+
+        def get_subtext(self):
+            return self.record.subtext
+
+        def get_download_href(self):
+            return self.record.href
+
+        def get_download_request(self):
+            Activity = LernplattformScraper.Activity
+
+            if self.record.modtype == 'modtype_resource' \
+               and self.record.href is not None:
+                return Activity.resource_download_request(self.record.href)
+            elif self.record.modtype == 'modtype_folder' \
+                    and self.record.download_form is not None:
+                form = self.record.download_form
+                return (form['method'], form['action'], form['params'])
+
+            return None
+
+        def get_complete_button_state(self):
+            if self.record.complete is None:
+                raise UncompletableActivityException
+
+            return self.record.complete
+
+        def get_complete_button_state_none(self):
+            return self.record.complete
+
+        def get_complete_button_state_false(self):
+            return self.record.complete or False
+
+        def get_live_activity(self, auth):
+            if self.driver.current_url != self.page_url:
+                auth.acquire_page(self.driver, self.page_url)
+                LernplattformScraper.Course.expand_sections(self.driver)
+
+            return LernplattformScraper.Activity.from_id(self.driver,
+                                                         self.record.id)
+
+        def toggle_complete_button(self):
+            self.get_live_activity(self.auth).toggle_complete_button()
+            self.record.complete = not self.get_complete_button_state()
+
+        def set_complete_button_state(self, state):
+            if state != self.get_complete_button_state():
+                self.toggle_complete_button()
+
+        def get_completion_request(self):
+            form = self.record.completion_form
+            if form is None:
+                return None
+
+            return (form['method'], form['action'], form['params'])
+
+        def download(self, driver, auth):
+            if self.record.modtype == 'modtype_label' \
+               and self.record.content is not None:
+                return self.record.content
+            if self.record.modtype == 'modtype_url' \
+               and self.record.href is not None:
+                return self.record.href
+
+            return self.get_live_activity(auth).download(driver, auth)
+
     class Subject:
         def __init__(self, webelement):
             self.el = webelement
@@ -216,8 +384,17 @@ class LernplattformScraper:
                     driver.get(activity_page)
 
     class Course:
-        def __init__(self, driver):
+        EXTRACT_MODES = ['live', 'snapshot', 'script']
+
+        def __init__(self, driver, extract_mode='live', cache=None):
             self.driver = driver
+            self.extract_mode = extract_mode
+            self.cache = cache
+
+        def expand_sections(driver):
+            for button in driver.find_elements_by_css_selector(
+                    'li.section.main span.toggle_closed'):
+                button.click()
 
         def get_subject_elements(self):
             return self.driver.find_elements_by_css_selector('li.section.main')
@@ -267,7 +444,42 @@ class LernplattformScraper:
             return self.driver.find_element_by_xpath(
                 '//div[@class="course-headline"]').text
 
+        # extracts the whole (expanded) course page at once, either from its
+        # page source or through a single script call; the visitor receives
+        # RecordActivity instances.
+        def get_section_records(self, page_url):
+            if self.extract_mode == 'script':
+                return extract_course_page(self.driver, self.cache, page_url)
+
+            self.__class__.expand_sections(self.driver)
+
+            return parse_course_page(self.driver.page_source, self.cache,
+                                     page_url)
+
+        def visit_sections(self, sections, visitor, auth, page_url):
+            for section in sections:
+                if visitor.enter_subject(section.name):
+                    for record in section.activities:
+                        activity = LernplattformScraper.RecordActivity(
+                            record, self.driver, auth, page_url)
+
+                        visitor.accept_activity(activity, auth, self.driver)
+
+                    visitor.exit_subject()
+
+        def visit_subjects_snapshot(self, visitor, auth):
+            page_url = self.driver.current_url
+            self.visit_sections(self.get_section_records(page_url), visitor,
+                                auth, page_url)
+
+            if self.driver.current_url != page_url:
+                auth.acquire_page(self.driver, page_url)
+
         def visit_subjects(self, visitor, auth):
+            if self.extract_mode in ['snapshot', 'script']:
+                self.visit_subjects_snapshot(visitor, auth)
+                return
+
             for subject_id in self.get_subject_ids():
                 subject = LernplattformScraper.Subject.from_id(self.driver,
                                                                subject_id)
@@ -320,22 +532,31 @@ class LernplattformScraper:
         def accept_activity(self, activity, auth, driver):
             pass
 
-    def __init__(self, driver, auth):
+    def __init__(self, driver, auth, extract_mode='live', cache=None,
+                 lernplattform_url=None, logout_url=None):
         self.auth = auth
         self.driver = driver
+        self.extract_mode = extract_mode
+        self.cache = cache
+        if lernplattform_url is not None:
+            self.lernplattform_url = lernplattform_url
+        if logout_url is not None:
+            self.logout_url = logout_url
 
     @contextmanager
-    def create(driver, auth):
-        scraper = LernplattformScraper(driver, auth)
+    def create(driver, auth, extract_mode='live', cache=None, logout=True,
+               lernplattform_url=None, logout_url=None):
+        scraper = LernplattformScraper(driver, auth, extract_mode, cache,
+                                       lernplattform_url, logout_url)
 
         try:
             yield scraper
         finally:
-            scraper.logout()
+            if logout:
+                scraper.logout()
 
     def _acquire_page(self, page):
-        self.driver.get(page)
-        self.auth.handle_login_page(self.driver)
+        self.auth.acquire_page(self.driver, page)
 
     def debug_dump_page(self):
         with open('debug.html', 'w') as f:
@@ -345,19 +566,24 @@ class LernplattformScraper:
         return self.driver.page_source()
 
     def logout(self):
-        self.driver.get(self.lernplattform_url)
         if self.auth.is_login_page(self.driver):
             return True  # no need to log back in just to log out
 
-        # span inside a logout link
+        # span inside a logout link; every Lernplattform page has one, so
+        # there's no need to load another page first
         try:
             self.driver.find_element_by_xpath(
                 "//span[text() = 'Logout']/..").click()
         except NoSuchElementException:
+            # not on a Lernplattform page; log out of the IdP directly, which
+            # can't be confirmed
             logging.getLogger('LernplattformScraper') \
-                   .warning('Logout failed')
+                   .warning('No logout link; logging out at the IdP')
+            self.driver.get(self.logout_url)
+            self.auth.invalidate_session()
             return False
 
+        self.auth.invalidate_session()
         return True
 
     def scrape_courses(self):
@@ -378,7 +604,9 @@ class LernplattformScraper:
 
     def visit(self, visitor):
         courses = self.scrape_courses()
-        course_handler = LernplattformScraper.Course(self.driver)
+        course_handler = LernplattformScraper.Course(self.driver,
+                                                     self.extract_mode,
+                                                     self.cache)
 
         for course in courses.items():
             (name, href) = course
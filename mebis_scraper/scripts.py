@@ -0,0 +1,197 @@
+import json
+
+from .snapshot import ActivityRecord, SectionRecord, completion_alt_to_state
+
+
+# Expands every section of the current course page and returns all of its
+# sections and activities as a JSON string, so that extracting a course page
+# costs a single WebDriver round trip. If given {section id: fingerprint}
+# (see StructureCache), sections whose fingerprint matches are only returned
+# as {id, fingerprint, cached: true}.
+EXTRACT_COURSE_SCRIPT = r'''
+var known = arguments[0];
+var sesskey = (window.M && M.cfg && M.cfg.sesskey) || null;
+
+var toggles = document.querySelectorAll('li.section.main span.toggle_closed');
+for (var i = 0; i < toggles.length; i++) {
+    toggles[i].click();
+}
+
+function firstLine(text) {
+    return text.trim().split('\n')[0].trim();
+}
+
+function instanceName(el) {
+    var copy = el.cloneNode(true);
+    var hidden = copy.querySelectorAll('.accesshide');
+    for (var i = 0; i < hidden.length; i++) {
+        hidden[i].remove();
+    }
+    return firstLine(copy.textContent);
+}
+
+function modType(el) {
+    for (var i = 0; i < el.classList.length; i++) {
+        if (el.classList[i].indexOf('modtype_') === 0) {
+            return el.classList[i];
+        }
+    }
+    return null;
+}
+
+// FNV-1a over the section's HTML, without the per-login session key
+function fingerprint(el) {
+    var html = el.outerHTML;
+    if (sesskey !== null) {
+        html = html.split(sesskey).join('');
+    }
+
+    var hash = 0x811c9dc5;
+    for (var i = 0; i < html.length; i++) {
+        hash ^= html.charCodeAt(i);
+        hash = Math.imul(hash, 0x01000193);
+    }
+    return 'fnv1a:' + (hash >>> 0).toString(16) + ':' + html.length;
+}
+
+function outerHTML(el) {
+    return el !== null ? el.outerHTML : null;
+}
+
+function extractForm(form) {
+    var params = {};
+    var hidden = form.querySelectorAll('input[type="hidden"]');
+    for (var i = 0; i < hidden.length; i++) {
+        if (hidden[i].name) {
+            params[hidden[i].name] = hidden[i].value;
+        }
+    }
+
+    return {
+        method: form.getAttribute('method') || 'get',
+        action: form.action,
+        params: params
+    };
+}
+
+function extractActivity(el) {
+    var type = modType(el);
+    var label = el.querySelector('.contentwithoutlink');
+    var instancename = el.querySelector('span.instancename');
+    var name = '';
+    var href = null;
+
+    if (instancename !== null) {
+        name = instanceName(instancename);
+        var link = instancename.closest('a');
+        if (link !== null) {
+            href = link.href;
+        }
+    } else {
+        var filename = el.querySelector('span.fp-filename');
+        if (filename !== null) {
+            name = firstLine(filename.innerText);
+        } else if (type === 'modtype_label' && label !== null) {
+            name = firstLine(label.innerText);
+        }
+    }
+
+    var img = el.querySelector('button.btn.btn-link img');
+    var completionForm = null;
+    if (img !== null && img.closest('form') !== null) {
+        completionForm = extractForm(img.closest('form'));
+    }
+
+    var downloadForm = null;
+    var folderButton = el.querySelector(
+        'input[value="Verzeichnis herunterladen"]');
+    if (folderButton !== null && folderButton.form !== null) {
+        downloadForm = extractForm(folderButton.form);
+    }
+
+    return {
+        id: el.id,
+        name: name,
+        modtype: type,
+        subtext: outerHTML(el.querySelector('.contentafterlink')),
+        complete_alt: img !== null ? img.alt : null,
+        href: href,
+        content: outerHTML(label),
+        download_form: downloadForm,
+        completion_form: completionForm
+    };
+}
+
+var result = [];
+var sections = document.querySelectorAll('li.section.main');
+for (var i = 0; i < sections.length; i++) {
+    var print = null;
+    if (known) {
+        print = fingerprint(sections[i]);
+        if (known[sections[i].id] === print) {
+            result.push({id: sections[i].id, fingerprint: print,
+                         cached: true});
+            continue;
+        }
+    }
+
+    var sectionname = sections[i].querySelector('.sectionname');
+    var activities = sections[i].querySelectorAll('li.activity');
+    var records = [];
+    for (var j = 0; j < activities.length; j++) {
+        records.push(extractActivity(activities[j]));
+    }
+
+    result.push({
+        id: sections[i].id,
+        name: sectionname !== null ? sectionname.innerText.trim() : '',
+        activities: records,
+        fingerprint: print,
+        cached: false
+    });
+}
+
+return JSON.stringify({sesskey: sesskey, sections: result});
+'''
+
+
+def activity_from_script(obj):
+    return ActivityRecord(obj['id'], obj['name'], obj['modtype'],
+                          subtext=obj['subtext'],
+                          complete=completion_alt_to_state(
+                              obj['complete_alt']),
+                          href=obj['href'],
+                          content=obj['content'],
+                          download_form=obj['download_form'],
+                          completion_form=obj['completion_form'])
+
+
+def section_from_script(obj):
+    return SectionRecord(obj['id'], obj['name'],
+                         list(map(activity_from_script, obj['activities'])))
+
+
+def extract_course_page(driver, cache=None, page=None):
+    known = cache.fingerprints(page) if cache is not None else None
+    result = json.loads(driver.execute_script(EXTRACT_COURSE_SCRIPT, known))
+
+    if cache is None:
+        return list(map(section_from_script, result['sections']))
+
+    sections = []
+    for obj in result['sections']:
+        if obj['cached']:
+            section = cache.get_section(page, obj['id'], obj['fingerprint'],
+                                        result['sesskey'])
+            if section is None:
+                # the cache changed under our feet; extract everything
+                return extract_course_page(driver)
+        else:
+            cache.count_miss()
+            section = section_from_script(obj)
+
+        sections.append((obj['fingerprint'], section))
+
+    cache.put_sections(page, sections)
+
+    return [section for (_, section) in sections]
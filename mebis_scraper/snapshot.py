@@ -0,0 +1,265 @@
+import hashlib
+import re
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+class ActivityRecord:
+    __slots__ = ('id', 'name', 'modtype', 'subtext', 'complete', 'href',
+                 'content', 'download_form', 'completion_form')
+
+    def __init__(self, el_id, name, modtype, subtext=None, complete=None,
+                 href=None, content=None, download_form=None,
+                 completion_form=None):
+        self.id = el_id
+        self.name = name
+        self.modtype = modtype
+        self.subtext = subtext
+        # True/False, or None if the activity can't be completed
+        self.complete = complete
+        self.href = href
+        # label HTML, as returned by Activity._download_label
+        self.content = content
+        # {'method', 'action', 'params'} of a folder's download button
+        self.download_form = download_form
+        # {'method', 'action', 'params'} of the completion button's form
+        self.completion_form = completion_form
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def from_dict(d):
+        return ActivityRecord(d['id'], d['name'], d['modtype'],
+                              d.get('subtext'), d.get('complete'),
+                              d.get('href'), d.get('content'),
+                              d.get('download_form'),
+                              d.get('completion_form'))
+
+
+class SectionRecord:
+    __slots__ = ('id', 'name', 'activities')
+
+    def __init__(self, el_id, name, activities):
+        self.id = el_id
+        self.name = name
+        self.activities = activities
+
+
+def make_soup(html):
+    return BeautifulSoup(html, HTML_PARSER)
+
+
+def first_line(text):
+    return text.strip().split('\n', maxsplit=1)[0].strip()
+
+
+def completion_alt_to_state(alt):
+    if alt is None:
+        return None
+
+    return alt.startswith('Abgeschlossen')
+
+
+def has_class(tag, class_name):
+    return class_name in (tag.get('class') or [])
+
+
+def parse_modtype(tag):
+    for class_name in tag.get('class') or []:
+        if class_name.startswith('modtype_'):
+            return class_name
+
+    return None
+
+
+def text_without_accesshide(tag):
+    parts = []
+    for child in tag.children:
+        if child.name is None:
+            parts.append(str(child))
+        elif not has_class(child, 'accesshide'):
+            parts.append(text_without_accesshide(child))
+
+    return ''.join(parts)
+
+
+def parse_instancename(tag):
+    # the instancename span also contains an invisible span naming the
+    # activity's type ("Datei", "Link/URL", ...); skip it like Selenium's
+    # .text does.
+    return first_line(text_without_accesshide(tag))
+
+
+def parse_form(form):
+    params = {}
+    for hidden in form.select('input[type="hidden"]'):
+        if hidden.get('name') is not None:
+            params[hidden['name']] = hidden.get('value', '')
+
+    return {
+        'method': form.get('method', 'get'),
+        'action': form.get('action'),
+        'params': params
+    }
+
+
+def find_folder_download_form(tag):
+    button = tag.select_one('input[value="Verzeichnis herunterladen"]')
+    if button is None:
+        return None
+
+    form = button.find_parent('form')
+    return parse_form(form) if form is not None else None
+
+
+def parse_activity(tag):
+    modtype = parse_modtype(tag)
+
+    label = tag.select_one('.contentwithoutlink')
+
+    name = ''
+    href = None
+    instancename = tag.select_one('span.instancename')
+    if instancename is not None:
+        name = parse_instancename(instancename)
+
+        link = instancename.find_parent('a')
+        if link is not None:
+            href = link.get('href')
+    else:
+        filename = tag.select_one('span.fp-filename')
+        if filename is not None:
+            name = first_line(filename.get_text())
+        elif modtype == 'modtype_label' and label is not None:
+            name = first_line(label.get_text())
+
+    subtext = tag.select_one('.contentafterlink')
+
+    complete = None
+    completion_form = None
+    img = tag.select_one('button.btn.btn-link img')
+    if img is not None:
+        complete = completion_alt_to_state(img.get('alt', ''))
+
+        form = img.find_parent('form')
+        if form is not None:
+            completion_form = parse_form(form)
+
+    download_form = find_folder_download_form(tag)
+
+    return ActivityRecord(
+        tag.get('id'), name, modtype,
+        subtext=str(subtext) if subtext is not None else None,
+        complete=complete, href=href,
+        content=str(label) if label is not None else None,
+        download_form=download_form, completion_form=completion_form)
+
+
+def parse_section(tag):
+    sectionname = tag.select_one('.sectionname')
+    name = (sectionname.get_text().strip() if sectionname is not None
+            else '')
+
+    activities = [parse_activity(activity)
+                  for activity in tag.select('li.activity')]
+
+    return SectionRecord(tag.get('id'), name, activities)
+
+
+SESSKEY_RE = re.compile(r'"sesskey":"([^"]+)"')
+
+
+def parse_sesskey(page_source):
+    match = SESSKEY_RE.search(page_source)
+    return match.group(1) if match is not None else None
+
+
+def section_fingerprint(tag, sesskey=None):
+    html = str(tag)
+    if sesskey is not None:
+        html = html.replace(sesskey, '')
+
+    return 'blake2b:' + hashlib.blake2b(html.encode('utf-8'),
+                                        digest_size=16).hexdigest()
+
+
+# With a StructureCache, sections whose fingerprint is unchanged since the
+# last visit of PAGE are taken from the cache instead of being parsed.
+def parse_sections(soup, cache=None, page=None, sesskey=None):
+    tags = soup.select('li.section.main')
+    if cache is None:
+        return list(map(parse_section, tags))
+
+    sections = []
+    for tag in tags:
+        fingerprint = section_fingerprint(tag, sesskey)
+        section = cache.get_section(page, tag.get('id'), fingerprint,
+                                    sesskey)
+        if section is None:
+            section = parse_section(tag)
+
+        sections.append((fingerprint, section))
+
+    cache.put_sections(page, sections)
+
+    return [section for (_, section) in sections]
+
+
+def parse_course_page(page_source, cache=None, page=None):
+    return parse_sections(make_soup(page_source), cache, page,
+                          parse_sesskey(page_source))
+
+
+def parse_active_subcourse(soup):
+    for tab in soup.select('ul.nav-tabs > li'):
+        if tab.get('class') == ['active']:
+            span = tab.select_one('span')
+            return span.get_text() if span is not None else None
+
+    return None
+
+
+# the content of a page activity's own page, as Activity._download_page
+# returns it
+def parse_page_content(page_source):
+    content = make_soup(page_source).select_one('.generalbox')
+    return str(content) if content is not None else None
+
+
+# the download form on a folder activity's own page
+def parse_folder_page(page_source):
+    return find_folder_download_form(make_soup(page_source))
+
+
+# the counterpart of Course.list_secondary_sub_courses: [(name, href)]
+def parse_secondary_subcourses(soup):
+    result = []
+    for tab in soup.select('ul.nav-tabs > li'):
+        if tab.get('class') == ['active']:
+            continue
+
+        link = tab.select_one('a')
+        span = link.select_one('span') if link is not None else None
+        if span is not None:
+            result.append((span.get_text(), link.get('href')))
+
+    return result
+
+
+# the counterpart of LernplattformScraper.scrape_courses: {name: href}
+def parse_course_links(page_source):
+    soup = make_soup(page_source)
+
+    course_link_map = {}
+    for course in soup.select('.coursename'):
+        link = course.find_parent('a')
+        if link is not None:
+            course_link_map[course.get_text()] = link.get('href')
+
+    return course_link_map
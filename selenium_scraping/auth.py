@@ -1,6 +1,30 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+
 class AuthenticationManager:
-    def __init__(self, authl=[]):
+    # Every check compares the current URL with the login services'. After a
+    # page has been found not to be a login page, the session is assumed to
+    # stay valid for SESSION_VALIDITY seconds: handle_login_page skips the
+    # slower page checks (see is_login_page) during that time.
+    SESSION_VALIDITY = 300
+
+    def __init__(self, authl=[], session_validity=SESSION_VALIDITY):
         self.authl = authl
+        self.login_listeners = []
+
+        self.session_validity = session_validity
+        self._valid_until = 0
+
+        self.stats = {
+            'url_checks': 0,
+            'page_checks': 0,
+            'skipped_checks': 0,
+            'logins': 0
+        }
+        self._lock = threading.Lock()
 
     def acquire_page(self, driver, url):
         driver.get(url)
@@ -9,27 +33,92 @@ class AuthenticationManager:
     def add_authenticator(self, auth):
         self.authl.append(auth)
 
-    def is_login_page(self, driver):
+    # LISTENER(driver) is called after each login
+    def add_login_listener(self, listener):
+        self.login_listeners.append(listener)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def session_valid(self):
+        return time.monotonic() < self._valid_until
+
+    def invalidate_session(self):
+        self._valid_until = 0
+
+    def _login_authenticator(self, url):
         for auth in self.authl:
-            if auth.is_login_page(driver):
-                return True
+            if auth.is_login_url(url):
+                return auth
 
-        return False
+        return None
 
-    def handle_login_page(self, driver):
+    def _login_page_authenticator(self, driver, thorough):
+        self._count('url_checks')
+        auth = self._login_authenticator(driver.current_url)
+        if auth is not None or not thorough:
+            return auth
+
+        self._count('page_checks')
         for auth in self.authl:
             if auth.is_login_page(driver):
-                auth.handle_login_page(driver)
-                break
+                return auth
+
+        return None
+
+    def is_login_page(self, driver):
+        return self._login_page_authenticator(driver, True) is not None
+
+    # THOROUGH: also look at the page if its URL isn't a login URL
+    def check_login_page(self, driver, thorough=True):
+        auth = self._login_page_authenticator(driver, thorough)
+        if auth is not None:
+            auth.handle_login_page(driver)
+            self._count('logins')
+
+            for listener in self.login_listeners:
+                listener(driver)
+
+        self._valid_until = time.monotonic() + self.session_validity
+
+    def handle_login_page(self, driver):
+        thorough = not self.session_valid()
+        if not thorough:
+            self._count('skipped_checks')
+
+        self.check_login_page(driver, thorough)
+
+    def log_stats(self):
+        logging.getLogger('auth').info(
+            f'Login checks: {self.stats["url_checks"]} URL checks, '
+            f'{self.stats["page_checks"]} page checks, '
+            f'{self.stats["skipped_checks"]} skipped as the session was '
+            f'known to be valid, {self.stats["logins"]} logins')
 
 
 class MebisSAMLAuthenticator:
-    def __init__(self, username, password):
+    login_host = 'idp.mebis.bayern.de'
+    login_path = '/idp/profile/'
+
+    def __init__(self, username, password, login_host=None,
+                 login_path=None):
         self.username = username
         self.password = password
+        if login_host is not None:
+            self.login_host = login_host
+        if login_path is not None:
+            self.login_path = login_path
+
+    def is_login_url(self, url):
+        parsed = urlparse(url)
+        return (parsed.hostname == self.login_host
+                and parsed.path.startswith(self.login_path))
 
+    # also catches the login form at URLs is_login_url doesn't know
     def is_login_page(self, driver):
-        return driver.title == 'Mebis Login Service'
+        return (self.is_login_url(driver.current_url)
+                or driver.title == 'Mebis Login Service')
 
     def handle_login_page(self, driver):
         driver.find_element_by_id('username').send_keys(self.username)
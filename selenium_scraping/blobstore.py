@@ -0,0 +1,144 @@
+import fcntl
+import hashlib
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+
+FICLONE = 0x40049409
+
+
+# Makes TARGET a copy of SOURCE that shares its data: a reflink where the file
+# system supports it (so that the copies can change independently), otherwise
+# a hard link, otherwise a plain copy. The copy is made under a temporary name
+# and renamed over TARGET, which is never opened: it may be a hard link to a
+# blob itself.
+def link_file(source, target):
+    tmp = target + '.tmp'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)  # left by a crash; may be a link, too
+
+    with open(source, 'rb') as src, open(tmp, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            cloned = True
+        except OSError:
+            cloned = False
+
+    if not cloned:
+        os.unlink(tmp)
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+
+    os.replace(tmp, target)
+
+
+class BlobWriter:
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.digest = None
+
+        (fd, self.tmp_path) = tempfile.mkstemp(dir=store.tmp_dir)
+        self.file = os.fdopen(fd, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.file.close()
+            os.unlink(self.tmp_path)
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        self.digest = self.hash.hexdigest()
+        self.store._add_blob(self.tmp_path, self.digest)
+
+        return self.digest
+
+
+# Keeps every downloaded file once, named by its SHA-256. An index maps a
+# download's source (URL and size) to its blob, so that a file that is
+# already known can be linked into place without transferring it again.
+class BlobStore:
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sources (
+        source TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (source, size)
+    )
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'),
+                                  check_same_thread=False)
+        self.db.execute(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest[2:])
+
+    def _add_blob(self, path, digest):
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.unlink(path)  # deduplicated
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+
+    def writer(self):
+        return BlobWriter(self)
+
+    # moves the (already complete) file PATH into the store
+    def add_file(self, path):
+        with self.writer() as blob, open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                blob.write(chunk)
+
+        os.unlink(path)
+        return blob.digest
+
+    def lookup(self, source, size):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT hash FROM sources WHERE source = ? AND size = ?',
+                (source, size)).fetchone()
+
+        if row is None or not os.path.exists(self.blob_path(row[0])):
+            return None
+
+        return row[0]
+
+    def record(self, source, size, digest):
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                (source, size, digest))
+
+    # a file TARGET replaces is kept until the link is in place
+    def link(self, digest, target):
+        link_file(self.blob_path(digest), target)
+
+    def close(self):
+        self.db.close()
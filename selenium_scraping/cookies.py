@@ -0,0 +1,84 @@
+import base64
+import json
+import logging
+import os
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+except ImportError:
+    Fernet = None
+
+from .sessions import add_cookies
+
+
+# Session cookies, kept on disk between runs, encrypted with a key derived
+# from a passphrase. WebDriver only reports the cookies of the current page's
+# domain, so saving merges them into the ones already known.
+class EncryptedCookieJar:
+    KDF_ITERATIONS = 390000
+
+    def __init__(self, path, passphrase):
+        if Fernet is None:
+            raise RuntimeError('Encrypted cookie jars need the cryptography '
+                               'package')
+
+        self.path = path
+        self.passphrase = passphrase.encode('utf-8')
+        self.salt = None
+        self.cookies = {}
+
+        self._read()
+
+    def _fernet(self):
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32,
+                         salt=self.salt, iterations=self.KDF_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(
+            kdf.derive(self.passphrase)))
+
+    def cookie_key(cookie):
+        return (cookie['domain'], cookie.get('path', '/'), cookie['name'])
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+
+            self.salt = base64.b64decode(stored['salt'])
+            cookies = json.loads(self._fernet().decrypt(
+                stored['token'].encode('ascii')))
+        except FileNotFoundError:
+            cookies = []
+        except (InvalidToken, ValueError, KeyError):
+            logging.getLogger('cookie_jar').warning(
+                f'Ignoring unreadable cookie jar {self.path}')
+            cookies = []
+
+        if self.salt is None:
+            self.salt = os.urandom(16)
+
+        now = time.time()
+        for cookie in cookies:
+            if cookie.get('expiry', now + 1) > now:
+                self.cookies[self.__class__.cookie_key(cookie)] = cookie
+
+    def load(self, driver):
+        add_cookies(driver, list(self.cookies.values()))
+
+    def save(self, driver):
+        for cookie in driver.get_cookies():
+            self.cookies[self.__class__.cookie_key(cookie)] = cookie
+
+        token = self._fernet().encrypt(
+            json.dumps(list(self.cookies.values())).encode('utf-8'))
+
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'salt': base64.b64encode(self.salt).decode('ascii'),
+                'token': token.decode('ascii')
+            }, f)
+        os.replace(tmp_path, self.path)
@@ -1,4 +1,12 @@
+import ctypes
+import ctypes.util
+import logging
 import os
+import os.path
+import select
+import shutil
+import struct
+import tempfile
 import time
 
 
@@ -9,3 +17,231 @@ def await_download(dir_watch):
     # wait until all that remains is the main file.
     while len(os.listdir(dir_watch)) != 1:
         time.sleep(1)
+
+
+class DownloadFailedException(Exception):
+    def __init__(self, download, reason):
+        super().__init__(f'Download into {download.directory} {reason}')
+        self.download = download
+        self.reason = reason
+
+
+class Inotify:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'Can\'t watch {path}')
+
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    # [(wd, mask, name)]; waits at most TIMEOUT seconds for events
+    def read_events(self, timeout):
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, _, length) = self.EVENT_HEADER.unpack_from(data,
+                                                                  offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Download:
+    def __init__(self, directory, key, timeout, stall_timeout):
+        self.directory = directory
+        self.key = key
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.last_state = None
+        self.wd = None
+
+    # whether the browser has created a file for it yet
+    def has_started(self):
+        return bool(os.listdir(self.directory))
+
+    # (name, size, mtime) of each file in the directory; when polling, any
+    # change to it counts as activity
+    def state(self):
+        state = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # renamed in the meantime
+                state.append((entry.name, stat.st_size, stat.st_mtime_ns))
+
+        return sorted(state)
+
+    # the downloaded file, if the download is complete
+    def finished_file(self):
+        files = os.listdir(self.directory)
+        if len(files) != 1 or files[0].endswith('.part'):
+            return None
+
+        return os.path.join(self.directory, files[0])
+
+    def check_timeouts(self, now):
+        if now - self.started > self.timeout:
+            raise DownloadFailedException(self, 'timed out')
+        if now - self.last_activity > self.stall_timeout:
+            raise DownloadFailedException(self, 'stalled')
+
+
+# Tracks any number of browser downloads at once. Each download gets its own
+# subdirectory of BASE_DIR (see new_download_dir), which the browser must be
+# pointed at before the download starts. A download is complete as soon as
+# its .part file has been renamed to the final file. Without inotify, the
+# directories are polled instead.
+class DownloadWatcher:
+    WATCH_MASK = (Inotify.IN_CREATE | Inotify.IN_MODIFY
+                  | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, base_dir, timeout=600, stall_timeout=60):
+        self.base_dir = base_dir
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+
+        self.downloads = []
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError, TypeError):
+            logging.getLogger('download') \
+                   .info('inotify is unavailable, polling downloads')
+            self.inotify = None
+
+    def __len__(self):
+        return len(self.downloads)
+
+    def new_download_dir(self):
+        return tempfile.mkdtemp(dir=self.base_dir)
+
+    def add(self, directory, key):
+        download = Download(directory, key, self.timeout, self.stall_timeout)
+        if self.inotify is not None:
+            download.wd = self.inotify.add_watch(directory, self.WATCH_MASK)
+
+        self.downloads.append(download)
+        return download
+
+    def _remove(self, download):
+        self.downloads.remove(download)
+        if download.wd is not None:
+            self.inotify.rm_watch(download.wd)
+
+    def cleanup(self, directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def _read_activity(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            for download in self.downloads:
+                state = download.state()
+                if state != download.last_state:
+                    download.last_state = state
+                    download.last_activity = time.monotonic()
+            return
+
+        by_wd = {download.wd: download for download in self.downloads}
+        for (wd, _, _) in self.inotify.read_events(timeout):
+            if wd in by_wd:
+                by_wd[wd].last_activity = time.monotonic()
+
+    # Waits at most TIMEOUT seconds for downloads to finish. Returns
+    # ([(key, file)], [DownloadFailedException]); finished and failed
+    # downloads are no longer tracked afterwards.
+    def poll(self, timeout=0):
+        self._read_activity(timeout if self.inotify is not None
+                            else min(timeout, self.POLL_INTERVAL))
+
+        finished = []
+        failed = []
+        now = time.monotonic()
+        for download in list(self.downloads):
+            finished_file = download.finished_file()
+            try:
+                if finished_file is None:
+                    download.check_timeouts(now)
+                    continue
+            except DownloadFailedException as e:
+                failed.append(e)
+            else:
+                finished.append((download.key, finished_file))
+
+            self._remove(download)
+
+        return (finished, failed)
+
+    # The browser's download directory is the same for all of its downloads,
+    # so it may only be pointed at the next download's directory once the
+    # file of DOWNLOAD has been created in its own. Waits for that, at most
+    # the stall timeout; returns whether it happened.
+    def wait_started(self, download):
+        deadline = time.monotonic() + self.stall_timeout
+        while download in self.downloads and not download.has_started():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            self._read_activity(min(remaining, self.POLL_INTERVAL))
+
+        return True
+
+    def wait_all(self):
+        finished = []
+        failed = []
+        while self.downloads:
+            (new_finished, new_failed) = self.poll(self.POLL_INTERVAL * 10)
+            finished += new_finished
+            failed += new_failed
+
+        return (finished, failed)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
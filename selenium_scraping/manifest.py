@@ -0,0 +1,136 @@
+import hashlib
+import mmap
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+
+# SHA-256 of the file PATH. The file is mapped rather than read, and hashlib
+# releases the GIL while it hashes, so several files can be hashed in
+# parallel from a thread pool.
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:  # empty files can't be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+
+    return digest.hexdigest()
+
+
+# Records each file of a download tree (below ROOT) with where it came from,
+# its size, hash, the type of its activity and when it was downloaded. A file
+# without an entry, or whose size differs from its entry's, was not
+# completely downloaded.
+#
+# It also remembers which version of a file (its ETag or Last-Modified) each
+# .part file holds, so that an interrupted download can be resumed with a
+# range request only if the file hasn't changed since.
+class DownloadManifest:
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS downloads (
+        path TEXT PRIMARY KEY,
+        source TEXT,
+        size INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        modtype TEXT,
+        downloaded REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS partials (
+        path TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        validator TEXT NOT NULL
+    );
+    '''
+
+    def __init__(self, path, root):
+        self.root = root
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # paths are stored relative to the root, so that the tree can be moved
+    def _key(self, path):
+        return os.path.relpath(path, self.root)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    # hashes the (complete) file PATH and records it; DIGEST is its hash if
+    # that is already known
+    def record(self, path, source, modtype, digest=None):
+        size = os.path.getsize(path)
+        if digest is None:
+            digest = hash_file(path)
+
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)',
+                (self._key(path), source, size, digest, modtype,
+                 time.time()))
+
+    # the entry of PATH as a dict, or None
+    def lookup(self, path):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT path, source, size, hash, modtype, downloaded '
+                'FROM downloads WHERE path = ?',
+                (self._key(path),)).fetchone()
+
+        if row is None:
+            return None
+        return dict(zip(['path', 'source', 'size', 'hash', 'modtype',
+                         'downloaded'], row))
+
+    # whether PATH has an entry and still has its size; doesn't hash it
+    def is_complete(self, path):
+        entry = self.lookup(path)
+        try:
+            return entry is not None \
+                and os.path.getsize(path) == entry['size']
+        except FileNotFoundError:
+            return False
+
+    def forget(self, path):
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM downloads WHERE path = ?',
+                            (self._key(path),))
+
+    # all entries, as (path relative to the root, size, hash)
+    def entries(self):
+        with self._lock:
+            return self.db.execute(
+                'SELECT path, size, hash FROM downloads ORDER BY path'
+            ).fetchall()
+
+    # the version of SOURCE that PART_FILE holds the start of, or None
+    def partial_validator(self, part_file, source):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT validator FROM partials WHERE path = ? '
+                'AND source = ?', (self._key(part_file), source)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def start_partial(self, part_file, source, validator):
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO partials VALUES (?, ?, ?)',
+                (self._key(part_file), source, validator))
+
+    def finish_partial(self, part_file):
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM partials WHERE path = ?',
+                            (self._key(part_file),))
+
+    def close(self):
+        self.db.close()
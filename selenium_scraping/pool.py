@@ -0,0 +1,52 @@
+import queue
+from contextlib import contextmanager
+
+from .profiles import make_firefox_profile
+from .sessions import copy_cookies
+
+
+# A set of WebDriver sessions that are handed out to whichever worker is
+# idle. The first session is the one the caller already has (and logs in
+# with); the others are made with make_firefox_profile. They only load pages:
+# downloads go through the caller's session, so they have no download
+# directory.
+class WebDriverPool:
+    def __init__(self, driver, size, headless=True):
+        self.sessions = [driver]
+        self._own_sessions = []
+        for _ in range(size - 1):
+            (_, own_driver) = make_firefox_profile(headless, downloads=False)
+            self.sessions.append(own_driver)
+            self._own_sessions.append(own_driver)
+
+        self._idle = queue.Queue()
+        for driver in self.sessions:
+            self._idle.put(driver)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        for driver in self._own_sessions:
+            driver.quit()
+
+        self._own_sessions = []
+
+    # copies the (logged in) first session's cookies into all other sessions
+    def share_login(self):
+        for driver in self.sessions[1:]:
+            copy_cookies(self.sessions[0], driver)
+
+    @contextmanager
+    def acquire(self):
+        driver = self._idle.get()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
@@ -4,7 +4,9 @@ from selenium import webdriver
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 
 
-def make_firefox_profile(headless=True):
+# DOWNLOADS: whether the browser will download files; without, it gets no
+# download directory, which is returned as None
+def make_firefox_profile(headless=True, downloads=True):
     AUTODOWNLOAD_MIMETYPES = [
         "audio/aac",
         "application/x-abiword",
@@ -75,11 +77,12 @@ def make_firefox_profile(headless=True):
                  " (Windows NT 10.0; Win64; x64; rv:77.0)"
                  " Gecko/20100101 Firefox/77.0")
 
-    dl_dir = tempfile.mkdtemp()
+    dl_dir = tempfile.mkdtemp() if downloads else None
 
     prefs = {
         'general.useragent.override': USERAGENT,
-
+    }
+    download_prefs = {
         'browser.download.folderList': 2,
         'browser.download.manager.showWhenStarting': False,
         'browser.helperApps.alwaysAsk.force': False,
@@ -92,6 +95,8 @@ def make_firefox_profile(headless=True):
 
         'browser.download.dir': dl_dir,
     }
+    if downloads:
+        prefs.update(download_prefs)
 
     profile = webdriver.FirefoxProfile()
     for (pref, value) in prefs.items():
@@ -104,3 +109,11 @@ def make_firefox_profile(headless=True):
 
     return (dl_dir, webdriver.Firefox(firefox_profile=profile,
                                       options=options))
+
+
+# changes where the (already running) browser saves downloads to
+def set_download_dir(driver, path):
+    with driver.context(driver.CONTEXT_CHROME):
+        driver.execute_script(
+            'Services.prefs.setStringPref("browser.download.dir", '
+            'arguments[0]);', path)
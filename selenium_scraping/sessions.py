@@ -0,0 +1,35 @@
+# Helpers for handing a logged in WebDriver session over to a plain HTTP
+# client.
+
+
+def get_user_agent(driver):
+    return driver.execute_script('return navigator.userAgent')
+
+
+def cookie_url(cookie):
+    scheme = 'https' if cookie.get('secure') else 'http'
+    domain = cookie['domain'].lstrip('.')
+    path = cookie.get('path', '/')
+
+    return f'{scheme}://{domain}{path}'
+
+
+# WebDriver only accepts cookies for the domain of the current page, so
+# visit each domain first. robots.txt is requested because it doesn't
+# redirect to the login service.
+def add_cookies(driver, cookies):
+    by_domain = {}
+    for cookie in cookies:
+        by_domain.setdefault(cookie['domain'].lstrip('.'), []).append(cookie)
+
+    for (domain, domain_cookies) in by_domain.items():
+        scheme = ('https' if any(c.get('secure') for c in domain_cookies)
+                  else 'http')
+        driver.get(f'{scheme}://{domain}/robots.txt')
+
+        for cookie in domain_cookies:
+            driver.add_cookie(cookie)
+
+
+def copy_cookies(src_driver, dst_driver):
+    add_cookies(dst_driver, src_driver.get_cookies())
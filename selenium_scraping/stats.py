@@ -0,0 +1,18 @@
+from collections import Counter
+
+
+# Counts the WebDriver commands DRIVER sends (per command name) into
+# COUNTER. Element methods go through their driver's execute, so those are
+# included.
+def count_commands(driver, counter=None):
+    if counter is None:
+        counter = Counter()
+
+    execute = driver.execute
+
+    def counting_execute(driver_command, params=None):
+        counter[driver_command] += 1
+        return execute(driver_command, params)
+
+    driver.execute = counting_execute
+    return counter
@@ -0,0 +1,194 @@
+import os
+import os.path
+from email.message import Message
+from urllib.parse import urlparse, unquote, urlencode
+
+import requests
+
+from .sessions import get_user_agent
+
+
+CHUNK_SIZE = 1 << 16
+
+
+def make_requests_session(driver):
+    session = requests.Session()
+    session.headers['User-Agent'] = get_user_agent(driver)
+
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'],
+                            domain=cookie['domain'],
+                            path=cookie.get('path', '/'))
+
+    return session
+
+
+def content_disposition_filename(header):
+    if header is None:
+        return None
+
+    # Message knows how to decode RFC 2231 (filename*=UTF-8''...) parameters
+    msg = Message()
+    msg['Content-Disposition'] = header
+    return msg.get_filename()
+
+
+def response_filename(response):
+    filename = content_disposition_filename(
+        response.headers.get('Content-Disposition'))
+    if filename is None:
+        filename = unquote(os.path.basename(urlparse(response.url).path))
+
+    return filename
+
+
+# identifies what was downloaded, for BlobStore's index. The session key
+# changes with every login, so it isn't part of it.
+def download_source(method, response, params):
+    if method.lower() == 'get':
+        return response.url
+
+    return response.url + '?' + urlencode(sorted(
+        (k, v) for (k, v) in params.items() if k != 'sesskey'))
+
+
+def write_response(response, path, chunk_size, mode='wb'):
+    with open(path, mode) as out:
+        for chunk in response.iter_content(chunk_size):
+            out.write(chunk)
+
+
+# what identifies the version of a response's file for If-Range; weak ETags
+# can't be used there
+def response_validator(response):
+    etag = response.headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+
+    return response.headers.get('Last-Modified')
+
+
+def note_partial(partials, part_file, source, validator):
+    if validator is None:
+        partials.finish_partial(part_file)  # can't be resumed
+    else:
+        partials.start_partial(part_file, source, validator)
+
+
+def content_range_start(response):
+    # "bytes START-END/SIZE"
+    try:
+        (unit, spec) = response.headers['Content-Range'].split(' ', 1)
+        return int(spec.split('-', 1)[0]) if unit == 'bytes' else None
+    except (KeyError, ValueError):
+        return None
+
+
+# Writes the GET response RESPONSE (to URL with PARAMS) to PART_FILE. If
+# PART_FILE already holds the start of the same version of the file, as
+# recorded in PARTIALS (a DownloadManifest), only the rest is requested with
+# a range request. Servers that ignore the range get the file written from
+# the start.
+def write_resumable(session, response, url, params, part_file, chunk_size,
+                    partials):
+    source = response.url
+    validator = response_validator(response)
+
+    offset = 0
+    if validator is not None and os.path.exists(part_file) \
+       and response.headers.get('Accept-Ranges') == 'bytes' \
+       and partials.partial_validator(part_file, source) == validator:
+        offset = os.path.getsize(part_file)
+
+    size = response.headers.get('Content-Length')
+    if offset and size is not None and offset >= int(size):
+        # complete, but not moved into place; or longer than the file
+        if offset == int(size):
+            response.close()
+            return
+        offset = 0
+
+    if not offset:
+        note_partial(partials, part_file, source, validator)
+        write_response(response, part_file, chunk_size)
+        return
+
+    response.close()
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+    with session.get(url, params=params, stream=True,
+                     headers=headers) as rest:
+        rest.raise_for_status()
+
+        if rest.status_code == 206 and content_range_start(rest) == offset:
+            write_response(rest, part_file, chunk_size, 'ab')
+        elif rest.status_code == 200:
+            # the file changed after all
+            note_partial(partials, part_file, source,
+                         response_validator(rest))
+            write_response(rest, part_file, chunk_size)
+        else:
+            raise requests.HTTPError(
+                f'Unexpected answer to a range request for {url}',
+                response=rest)
+
+
+# Streams the response to (method, url, params) to TARGET_STEM + the extension
+# of the file name the server sent. The data is written to a .part file first,
+# so that a crashed download never looks finished. With a BlobStore, the file
+# is hashed while it is written and stored there instead; TARGET is then only
+# a link into the store. If the store already knows the URL and size, no data
+# is transferred at all. With PARTIALS (a DownloadManifest), GET downloads
+# that were interrupted are resumed from their .part file (see
+# write_resumable). Returns the path of the downloaded file and, with a
+# store, its hash (else None); or (None, None) if the server answered with an
+# HTML page instead of a file (e.g. the login page).
+def stream_download(session, method, url, params, target_stem,
+                    chunk_size=CHUNK_SIZE, store=None, partials=None):
+    if method.lower() == 'get':
+        kwargs = {'params': params}
+    else:
+        kwargs = {'data': params}
+
+    with session.request(method, url, stream=True, **kwargs) as response:
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.startswith('text/html') \
+           and 'Content-Disposition' not in response.headers:
+            return (None, None)
+
+        ext = os.path.splitext(response_filename(response))[1]
+        target = target_stem + ext
+
+        if store is None:
+            part_file = target + '.part'
+            if partials is not None and method.lower() == 'get':
+                write_resumable(session, response, url, params, part_file,
+                                chunk_size, partials)
+                os.replace(part_file, target)
+                partials.finish_partial(part_file)
+            else:
+                write_response(response, part_file, chunk_size)
+                os.replace(part_file, target)
+
+            return (target, None)
+
+        source = download_source(method, response, params)
+        size = response.headers.get('Content-Length')
+        digest = (store.lookup(source, int(size)) if size is not None
+                  else None)
+
+        if digest is None:
+            with store.writer() as blob:
+                for chunk in response.iter_content(chunk_size):
+                    blob.write(chunk)
+
+            # index by the advertised size, which is what a later lookup
+            # has to go by (it differs from blob.size for encoded responses)
+            digest = blob.digest
+            store.record(source, int(size) if size is not None
+                         else blob.size, digest)
+
+    store.link(digest, target)
+
+    return (target, digest)
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+
+
+# Opens URL in a new window and switches to it; the window is closed and the
+# original one selected again afterwards. The original window's page (and
+# its element handles) stays intact.
+@contextmanager
+def new_window(driver, url):
+    original = driver.current_window_handle
+    handles = set(driver.window_handles)
+
+    driver.execute_script('window.open(arguments[0], "_blank");', url)
+    (window,) = set(driver.window_handles) - handles
+    driver.switch_to.window(window)
+
+    try:
+        yield driver
+    finally:
+        driver.close()
+        driver.switch_to.window(original)
+
+
+SUBMIT_FORM_SCRIPT = '''
+var form = document.createElement('form');
+form.method = arguments[0];
+form.action = arguments[1];
+for (var name in arguments[2]) {
+    var input = document.createElement('input');
+    input.type = 'hidden';
+    input.name = name;
+    input.value = arguments[2][name];
+    form.appendChild(input);
+}
+document.body.appendChild(form);
+form.submit();
+form.remove();
+'''
+
+
+# Submits a form from the current page. If the response is a download, the
+# page isn't left.
+def submit_form(driver, method, action, params):
+    driver.execute_script(SUBMIT_FORM_SCRIPT, method, action, params)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+
+try:
+    from .coursedump_binary import (COMPRESSIONS, DEFAULT_COMPRESSION,
+                                    BinaryCoursedumpWriter)
+    from .coursedump_io import (CoursedumpReader, CoursedumpWriter,
+                                NotGroupedError)
+except ImportError:  # run as a script
+    from coursedump_binary import (COMPRESSIONS, DEFAULT_COMPRESSION,
+                                   BinaryCoursedumpWriter)
+    from coursedump_io import (CoursedumpReader, CoursedumpWriter,
+                               NotGroupedError)
+
+
+FORMATS = ['flat', 'hierarchical', 'jsonl', 'binary']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=('Converts a coursedump between the JSON formats and '
+                     'the binary one'))
+
+    parser.add_argument('coursedump', type=argparse.FileType('r'), nargs='?',
+                        default=sys.stdin,
+                        help='Course-dump to convert (any format)')
+    parser.add_argument('-f', '--format', choices=FORMATS, required=True,
+                        help='Format to convert to')
+    parser.add_argument('-z', '--compression', choices=COMPRESSIONS,
+                        default=DEFAULT_COMPRESSION,
+                        help='Compression of binary coursedumps')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='Write the coursedump to this file')
+
+    args = parser.parse_args()
+
+    if args.format == 'binary':
+        # like CoursedumpWriter(..., 'binary'), with the compression chosen
+        writer = BinaryCoursedumpWriter(args.output.buffer, args.compression)
+    else:
+        writer = CoursedumpWriter(args.output, args.format)
+
+    try:
+        for (locator, activity) in CoursedumpReader(args.coursedump):
+            writer.write(locator, activity)
+    except NotGroupedError as e:
+        sys.exit(f'{sys.argv[0]}: {e}')
+
+    writer.close()
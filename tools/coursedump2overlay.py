@@ -3,6 +3,13 @@ import argparse
 import sys
 import json
 
+try:
+    from .coursedump_io import (CoursedumpReader, HierarchicalWriter,
+                                as_flat, locator_path, write_hierarchical)
+except ImportError:  # run as a script
+    from coursedump_io import (CoursedumpReader, HierarchicalWriter,
+                               as_flat, locator_path, write_hierarchical)
+
 
 def coursedump_to_completion_overlay(activities):
     result = {}
@@ -23,14 +30,42 @@ def coursedump_to_completion_overlay(activities):
     return result
 
 
+# like coursedump_to_completion_overlay, but writes the overlay to OUT while
+# reading ACTIVITIES, ((course, subcourse, subject), activity) pairs grouped
+# by course, subcourse and subject
+def coursedump_to_completion_overlay_stream(activities, out):
+    writer = HierarchicalWriter(out, leaf='dict')
+    for (locator, activity) in activities:
+        writer.write(locator_path(locator),
+                     (activity['name'], as_flat(activity, locator)))
+    writer.close()
+
+
+# the same for ACTIVITIES in any order, which are all kept in memory
+def coursedump_to_completion_overlay_in_memory(activities, out):
+    coursedump = [as_flat(activity, locator)
+                  for (locator, activity) in activities]
+    json.dump(coursedump_to_completion_overlay(coursedump), out, indent=4)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument('coursedump', type=argparse.FileType('r'), nargs='?',
-                        help='(flat) coursedump to be converted',
+                        help='coursedump to be converted',
                         default=sys.stdin)
+    parser.add_argument('--ungrouped', action='store_true',
+                        help=('Read the input into memory right away instead '
+                              'of trying to stream it first, for input that '
+                              'isn\'t grouped by course, subcourse and '
+                              'subject'))
 
     args = parser.parse_args()
 
-    json.dump(coursedump_to_completion_overlay(json.load(args.coursedump)),
-              sys.stdout, indent=4)
+    if args.ungrouped:
+        coursedump_to_completion_overlay_in_memory(
+            CoursedumpReader(args.coursedump), sys.stdout)
+    else:
+        write_hierarchical(args.coursedump, sys.stdout,
+                           coursedump_to_completion_overlay_stream,
+                           coursedump_to_completion_overlay_in_memory)
@@ -0,0 +1,359 @@
+import json
+import logging
+import struct
+import sys
+import zlib
+from array import array
+from itertools import groupby, islice, repeat
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The binary coursedump format: a compact, faster-to-load alternative to the
+# JSON ones, for the same activities. A file starts with MAGIC, a version and
+# a compression byte; the rest (compressed as one stream, if at all) is a
+# sequence of blocks, each a header (BLOCK_HEADER) and
+#
+# - the values newly added to the table of interned values, as a JSON list;
+#   short strings (like course, subject and activity names, types and the
+#   keys of activities), booleans, numbers and null are interned: each is
+#   stored once for the whole file
+# - the newly seen shapes (the key lists of activities), as a JSON list
+# - the values only used in this block (long strings like subtexts, lists,
+#   dicts), as a JSON list; they follow the interned ones in the table while
+#   the block is read
+# - the shape of each record, as uint32s
+# - the table indices of each record's course, subcourse and subject, then
+#   those of the records' values, in the order of their shapes' keys, as
+#   uint32s
+#
+# Records of the same shape in a row are rebuilt with map() and zip() alone,
+# without running Python code for each of them.
+#
+# All integers are little-endian. A block with a header of zeros ends the
+# file; a file without one was cut short (e.g. by a crashed scraper) but can
+# still be read up to its last complete block.
+
+MAGIC = b'\x89MCD\r\n\x1a\n'
+VERSION = 1
+HEADER = struct.Struct('<BB')
+BLOCK_HEADER = struct.Struct('<5I')
+
+COMPRESSIONS = ['none', 'zlib', 'zstd']
+DEFAULT_COMPRESSION = 'zlib' if zstandard is None else 'zstd'
+
+# strings longer than this are stored with their block instead of being
+# interned, as are values of types other than str and INTERNED_TYPES
+INTERN_MAX_LENGTH = 64
+INTERNED_TYPES = (bool, int, float, type(None))
+
+# compresses coursedumps about 15% worse than zlib's default level, in a
+# third of the time
+ZLIB_LEVEL = 3
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression}')
+    if compression == 'zstd' and zstandard is None:
+        raise RuntimeError('zstd compression needs the zstandard package')
+
+
+def to_uint32s(ints):
+    data = array('I', ints)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def from_uint32s(data):
+    ints = array('I')
+    ints.frombytes(data)
+    if sys.byteorder == 'big':
+        ints.byteswap()
+    return ints
+
+
+# the binary stream behind F if F is a binary coursedump (F may be a text
+# file that hasn't been read from yet), else None
+def binary_stream(f):
+    stream = getattr(f, 'buffer', f)
+    peek = getattr(stream, 'peek', None)
+    if peek is None:
+        return None
+
+    try:
+        start = peek(len(MAGIC))
+    except (OSError, ValueError):
+        return None
+
+    return stream if start[:len(MAGIC)] == MAGIC else None
+
+
+def is_binary_coursedump(f):
+    return binary_stream(f) is not None
+
+
+class _Decompressor:
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, f, compression):
+        self.f = f
+        if compression == 'zlib':
+            self._decompressor = zlib.decompressobj()
+        elif compression == 'zstd':
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            self._decompressor = None
+
+        self._buf = bytearray()
+        self._pos = 0
+
+    # up to SIZE bytes; fewer only at the end of the stream
+    def read(self, size):
+        while len(self._buf) - self._pos < size:
+            data = self.f.read(self.CHUNK_SIZE)
+            if not data:
+                break
+
+            if self._pos:
+                del self._buf[:self._pos]
+                self._pos = 0
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            self._buf += data
+
+        data = bytes(self._buf[self._pos:self._pos + size])
+        self._pos += len(data)
+        return data
+
+
+# a block that ends with the stream, as left by a run that was killed while
+# writing it
+class _TruncatedBlock(Exception):
+    pass
+
+
+class BinaryCoursedumpReader:
+    """Reads a binary coursedump from the binary file F.
+
+    Iterating yields ((course, subcourse, subject), activity) pairs like
+    CoursedumpReader does, a block at a time. Interned values are shared
+    between activities and each shape's keys are only decoded once.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.compression = None
+
+    def _error(self, message):
+        return ValueError(f'{getattr(self.f, "name", "<coursedump>")}: '
+                          f'{message}')
+
+    def _read_header(self):
+        magic = self.f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise self._error('not a binary coursedump')
+
+        header = self.f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise self._error('truncated header')
+
+        (version, compression) = HEADER.unpack(header)
+        if version != VERSION:
+            raise self._error(f'unsupported version {version}')
+        if compression >= len(COMPRESSIONS):
+            raise self._error(f'unknown compression {compression}')
+
+        self.compression = COMPRESSIONS[compression]
+        check_compression(self.compression)
+
+    def _read(self, stream, size):
+        data = stream.read(size)
+        if len(data) != size:
+            raise _TruncatedBlock()
+        return data
+
+    def __iter__(self):
+        self._read_header()
+        stream = _Decompressor(self.f, self.compression)
+
+        try:
+            yield from self._read_blocks(stream)
+        except _TruncatedBlock:
+            # everything up to the last complete block is kept
+            logging.getLogger('coursedump schema').warning(
+                'Binary coursedump without end marker; the run that '
+                'wrote it may not have finished')
+
+    def _read_blocks(self, stream):
+        table = []
+        shapes = []
+        while True:
+            header = stream.read(BLOCK_HEADER.size)
+            if len(header) != BLOCK_HEADER.size:
+                raise _TruncatedBlock()
+
+            (values_size, shapes_size, locals_size, n_records, n_refs) = \
+                BLOCK_HEADER.unpack(header)
+            if not any([values_size, shapes_size, locals_size, n_records]):
+                if stream.read(1):
+                    raise self._error('extra data after the coursedump')
+                return
+
+            try:
+                table.extend(json.loads(self._read(stream, values_size)))
+                shapes.extend(map(tuple, json.loads(
+                    self._read(stream, shapes_size))))
+                base = len(table)
+                table.extend(json.loads(self._read(stream, locals_size)))
+
+                record_shapes = from_uint32s(self._read(stream,
+                                                        4 * n_records))
+                values = list(map(table.__getitem__,
+                                  from_uint32s(self._read(stream,
+                                                          4 * n_refs))))
+                del table[base:]
+
+                locators = iter(values[:3 * n_records])
+                locators = list(zip(locators, locators, locators))
+                fields = iter(values[3 * n_records:])
+
+                activities = []
+                for (shape, run) in groupby(record_shapes):
+                    keys = shapes[shape]
+                    count = len(list(run))
+                    rows = (islice(zip(*[fields] * len(keys)), count)
+                            if keys else repeat((), count))
+                    activities.extend(map(dict, map(zip, repeat(keys),
+                                                    rows)))
+            except (IndexError, json.JSONDecodeError):
+                raise self._error('corrupt block')
+
+            if len(locators) != n_records or len(activities) != n_records \
+               or next(fields, fields) is not fields:
+                raise self._error('corrupt block')
+
+            yield from zip(locators, activities)
+
+
+class BinaryCoursedumpWriter:
+    """Writes a binary coursedump to the binary file OUT.
+
+    write(locator, activity) adds an activity (with or without locator
+    keys; it is read back as it was written). Activities are written a
+    block of BLOCK_SIZE at a time; flush() writes a partial block, so that
+    everything written so far can be read even if close() is never called.
+    """
+    BLOCK_SIZE = 1024
+
+    def __init__(self, out, compression=DEFAULT_COMPRESSION,
+                 block_size=BLOCK_SIZE):
+        check_compression(compression)
+
+        self.out = out
+        self.compression = compression
+        self.block_size = block_size
+
+        if compression == 'zlib':
+            self._compressor = zlib.compressobj(ZLIB_LEVEL)
+        elif compression == 'zstd':
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            self._compressor = None
+
+        # (type, value) -> table index, for the interned values
+        self._interned = {}
+        self._shapes = {}
+
+        # the block being built; the indices of local values are stored as
+        # ~index until the size of the table is known
+        self._new_values = []
+        self._new_shapes = []
+        self._locals = []
+        self._record_shapes = []
+        self._locator_refs = []
+        self._refs = []
+
+        self.out.write(MAGIC + HEADER.pack(VERSION,
+                                           COMPRESSIONS.index(compression)))
+
+    def _ref(self, value):
+        cls = type(value)
+        if (len(value) > INTERN_MAX_LENGTH if cls is str
+                else cls not in INTERNED_TYPES):
+            self._locals.append(value)
+            return ~(len(self._locals) - 1)
+
+        key = (cls, value)
+        ref = self._interned.get(key)
+        if ref is None:
+            ref = self._interned[key] = len(self._interned)
+            self._new_values.append(value)
+        return ref
+
+    def write(self, locator, activity):
+        keys = tuple(activity)
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = len(self._shapes)
+            self._new_shapes.append(keys)
+
+        self._record_shapes.append(shape)
+        self._locator_refs.extend(map(self._ref, locator))
+        self._refs.extend(map(self._ref, activity.values()))
+
+        if len(self._record_shapes) >= self.block_size:
+            self._write_block()
+
+    def _write_raw(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self.out.write(data)
+
+    def _write_block(self):
+        if not self._record_shapes:
+            return
+
+        base = len(self._interned)
+        refs = [ref if ref >= 0 else base + ~ref
+                for ref in self._locator_refs + self._refs]
+
+        values = json.dumps(self._new_values).encode('utf-8')
+        shapes = json.dumps(self._new_shapes).encode('utf-8')
+        local_values = json.dumps(self._locals).encode('utf-8')
+
+        self._write_raw(b''.join([
+            BLOCK_HEADER.pack(len(values), len(shapes), len(local_values),
+                              len(self._record_shapes), len(refs)),
+            values, shapes, local_values,
+            to_uint32s(self._record_shapes), to_uint32s(refs)
+        ]))
+
+        self._new_values = []
+        self._new_shapes = []
+        self._locals = []
+        self._record_shapes = []
+        self._locator_refs = []
+        self._refs = []
+
+    def flush(self):
+        self._write_block()
+
+        if self.compression == 'zlib':
+            self.out.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        elif self.compression == 'zstd':
+            self.out.write(self._compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+        self.out.flush()
+
+    def close(self):
+        self._write_block()
+        self._write_raw(BLOCK_HEADER.pack(0, 0, 0, 0, 0))
+
+        if self._compressor is not None:
+            self.out.write(self._compressor.flush())
+        self.out.flush()
@@ -1,6 +1,23 @@
 #!/usr/bin/env python3
-import sys
+import argparse
+import heapq
+import itertools
 import json
+import os.path
+import sys
+import tempfile
+
+try:
+    from .coursedump_io import (CoursedumpReader, JSONListWriter,
+                                JSONLinesWriter, as_flat, flat_activities,
+                                load_coursedump)
+except ImportError:  # run as a script
+    from coursedump_io import (CoursedumpReader, JSONListWriter,
+                               JSONLinesWriter, as_flat, flat_activities,
+                               load_coursedump)
+
+
+DIFF_FIELDS = ['complete', 'subtext', 'type']
 
 
 def activity_to_locator_tuple(activity):
@@ -24,15 +41,185 @@ def activity_dict_subtract(activities_b, activities_a):
     return [v for k, v in activities_b.items() if k not in activities_a]
 
 
+def field_changes(old, new, fields):
+    return {field: {'old': old.get(field), 'new': new.get(field)}
+            for field in fields if old.get(field) != new.get(field)}
+
+
+def change_record(change, activity, changes=None):
+    record = {
+        'change': change,
+        'course': activity['course'],
+        'subcourse': activity.get('subcourse'),
+        'subject': activity['subject'],
+        'name': activity['name']
+    }
+    if changes is not None:
+        record['changes'] = changes
+    record['activity'] = activity
+
+    return record
+
+
+# Yields a change record for each activity that is only in B ('added'), only
+# in A ('removed') or in both with different FIELDS ('changed'). Activities
+# are identified by (course, subcourse, subject, name); of several with the
+# same locator, the last one counts. Both dumps are kept in memory: added and
+# changed activities come in B's order, then the removed ones in A's.
+def diff_activities(activities_b, activities_a, fields=DIFF_FIELDS):
+    b = activity_list_to_dict(activities_b)
+    a = activity_list_to_dict(activities_a)
+
+    for (key, new) in b.items():
+        old = a.get(key)
+        if old is None:
+            yield change_record('added', new)
+            continue
+
+        changes = field_changes(old, new, fields)
+        if changes:
+            yield change_record('changed', new, changes)
+
+    for (key, old) in a.items():
+        if key not in b:
+            yield change_record('removed', old)
+
+
+# a locator as a sort key: None (e.g. no subcourse) sorts apart from (and
+# before) every name, so that keys of any locators can be compared
+def sort_key(activity):
+    key = []
+    for part in activity_to_locator_tuple(activity):
+        key += [part is not None, part or '']
+    return key
+
+
+# Sorts ACTIVITIES by locator on disk: runs of RUN_SIZE activities are sorted
+# in memory, written to DIRECTORY (as PREFIX-*.jsonl) and merged. Yields
+# (key, activity), with only the last of several activities with the same
+# locator.
+def external_sort(activities, directory, run_size, prefix='run'):
+    runs = []
+    seq = itertools.count()
+    for run_no in itertools.count():
+        run = [(sort_key(activity), next(seq), activity)
+               for activity in itertools.islice(activities, run_size)]
+        if not run:
+            break
+
+        run.sort(key=lambda item: (item[0], item[1]))
+
+        path = os.path.join(directory, f'{prefix}-{run_no}.jsonl')
+        with open(path, 'w') as f:
+            for item in run:
+                f.write(json.dumps(item) + '\n')
+        runs.append(path)
+
+    def read_run(path):
+        with open(path) as f:
+            for line in f:
+                yield json.loads(line)
+
+    merged = heapq.merge(*map(read_run, runs),
+                         key=lambda item: (item[0], item[1]))
+
+    previous = None
+    for item in merged:
+        if previous is not None and previous[0] != item[0]:
+            yield (previous[0], previous[2])
+        previous = item
+    if previous is not None:
+        yield (previous[0], previous[2])
+
+
+# diff_activities for dumps that don't fit into memory: both are sorted
+# externally (in DIRECTORY) and merged. Records come in locator order.
+def diff_activities_external(activities_b, activities_a, directory,
+                             fields=DIFF_FIELDS, run_size=100000):
+    b = external_sort(activities_b, directory, run_size, 'b')
+    a = external_sort(activities_a, directory, run_size, 'a')
+
+    new = next(b, None)
+    old = next(a, None)
+    while new is not None or old is not None:
+        if old is None or (new is not None and new[0] < old[0]):
+            yield change_record('added', new[1])
+            new = next(b, None)
+        elif new is None or old[0] < new[0]:
+            yield change_record('removed', old[1])
+            old = next(a, None)
+        else:
+            changes = field_changes(old[1], new[1], fields)
+            if changes:
+                yield change_record('changed', new[1], changes)
+            new = next(b, None)
+            old = next(a, None)
+
+
+def read_activities(f):
+    return (as_flat(activity, locator)
+            for (locator, activity) in CoursedumpReader(f))
+
+
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print(f'{sys.argv[0]}: usage: {sys.argv[0]} [b] [a]', file=sys.stderr)
+    parser = argparse.ArgumentParser(
+        description=('Compares two coursedumps; by default, prints the '
+                     'activities of B that are not in A'))
+
+    parser.add_argument('b', type=argparse.FileType('r'),
+                        help='New coursedump (any format)')
+    parser.add_argument('a', type=argparse.FileType('r'),
+                        help='Old coursedump (any format)')
+    parser.add_argument('-c', '--changes', action='store_true',
+                        help=('Report added, removed and changed activities, '
+                              'with the changed fields'))
+    parser.add_argument('--fields', nargs='+', default=DIFF_FIELDS,
+                        help=('Fields compared for --changes (default: '
+                              f'{" ".join(DIFF_FIELDS)})'))
+    parser.add_argument('-x', '--external', action='store_true',
+                        help=('Sort the dumps on disk instead of keeping them '
+                              'in memory, for dumps bigger than RAM; output '
+                              'comes in locator order'))
+    parser.add_argument('--run-size', type=int, default=100000,
+                        dest='run_size',
+                        help=('Activities sorted in memory at a time with '
+                              '--external'))
+    parser.add_argument('--tmpdir',
+                        help='Directory for the sorted runs of --external')
+    parser.add_argument('--format', choices=['json', 'jsonl'],
+                        default='json',
+                        help='Output a JSON list or one record per line')
+    parser.add_argument('-s', '--summary', action='store_true',
+                        help='Print the number of changes to stderr')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as directory:
+        if args.external:
+            records = diff_activities_external(
+                read_activities(args.b), read_activities(args.a), directory,
+                args.fields, args.run_size)
+        else:
+            # both dumps end up in memory anyway; loading them at once is
+            # faster than reading them incrementally
+            records = diff_activities(
+                flat_activities(load_coursedump(args.b)),
+                flat_activities(load_coursedump(args.a)), args.fields)
+
+        writer = (JSONLinesWriter(sys.stdout) if args.format == 'jsonl'
+                  else JSONListWriter(sys.stdout, indent=None))
+
+        counts = {'added': 0, 'removed': 0, 'changed': 0}
+        for record in records:
+            counts[record['change']] += 1
 
-    with open(sys.argv[1], 'r') as b_file, open(sys.argv[2]) as a_file:
-        b = json.load(b_file)
-        a = json.load(a_file)
+            if args.changes:
+                writer.write(record)
+            elif record['change'] == 'added':
+                writer.write(record['activity'])
 
-        res = list(activity_dict_subtract(activity_list_to_dict(b),
-                                          activity_list_to_dict(a)))
+        writer.close()
 
-        json.dump(res, sys.stdout)
+    if args.summary:
+        print(f'{counts["added"]} added, {counts["removed"]} removed, '
+              f'{counts["changed"]} changed', file=sys.stderr)
@@ -0,0 +1,532 @@
+import io
+import json
+import logging
+import shutil
+import tempfile
+
+try:
+    from .coursedump_binary import (BinaryCoursedumpReader,
+                                    BinaryCoursedumpWriter, binary_stream)
+except ImportError:  # imported by a script in tools/
+    from coursedump_binary import (BinaryCoursedumpReader,
+                                   BinaryCoursedumpWriter, binary_stream)
+
+
+# Coursedumps come either as one JSON document (a flat list of activities or
+# the hierarchical course -> [subcourse ->] subject -> [activity] dict) or as
+# JSON Lines, one flat activity per line (LernplattformScraper.py
+# --list-format jsonl). Binary coursedumps (coursedump_binary.py) are told
+# apart by their magic bytes.
+
+
+def is_flat_activity(obj):
+    return (isinstance(obj, dict) and isinstance(obj.get('name'), str)
+            and 'subject' in obj and 'course' in obj)
+
+
+# parses coursedump text: JSON Lines is told apart by there being more than
+# one document, or a single document that is a flat activity (a hierarchical
+# dump's values are never strings)
+def parse_coursedump(text):
+    if not text.strip():
+        return []  # JSON Lines of a run that listed nothing
+
+    decoder = json.JSONDecoder()
+
+    start = len(text) - len(text.lstrip())
+    (obj, end) = decoder.raw_decode(text, start)
+    rest = text[end:].strip()
+
+    if not rest:
+        return [obj] if is_flat_activity(obj) else obj
+
+    activities = [obj]
+    for line in rest.splitlines():
+        if line.strip():
+            activities.append(json.loads(line))
+
+    return activities
+
+
+# reads a coursedump from F in any format: returns a list for flat
+# coursedumps, JSON Lines and binary ones, a dict for hierarchical ones
+def load_coursedump(f):
+    binary = binary_stream(f)
+    if binary is not None:
+        return [as_flat(activity, locator)
+                for (locator, activity) in BinaryCoursedumpReader(binary)]
+
+    return parse_coursedump(f.read())
+
+
+# the activities of a coursedump returned by load_coursedump, as flat
+# activities
+def flat_activities(coursedump):
+    if isinstance(coursedump, list):
+        yield from coursedump
+        return
+
+    for (course, subjects) in coursedump.items():
+        for (key, value) in subjects.items():
+            if isinstance(value, dict):
+                for (subject, activities) in value.items():
+                    for activity in activities:
+                        yield as_flat(activity, (course, key, subject))
+            else:
+                for activity in value:
+                    yield as_flat(activity, (course, None, key))
+
+
+def activity_locator(activity):
+    return (activity['course'], activity.get('subcourse'),
+            activity['subject'])
+
+
+# a flat activity: ACTIVITY with the keys of LOCATOR added; ACTIVITY itself
+# isn't changed
+def locate(activity, locator):
+    (course, subcourse, subject) = locator
+    return {**activity, 'course': course, 'subcourse': subcourse,
+            'subject': subject}
+
+
+# ACTIVITY as found in a flat coursedump: activities from flat dumps are
+# returned as they are, those from hierarchical ones located
+def as_flat(activity, locator):
+    return activity if 'course' in activity else locate(activity, locator)
+
+
+# the keys of the containers LOCATOR's activity lives in in a hierarchical
+# coursedump
+def locator_path(locator):
+    return tuple(key for key in locator if key is not None)
+
+
+class CoursedumpReader:
+    """Reads a coursedump of any format incrementally.
+
+    Iterating yields ((course, subcourse, subject), activity) pairs one by
+    one, reading F in chunks; only one activity at a time is decoded, so
+    memory use doesn't depend on the size of the dump. The hierarchy is
+    tracked with an explicit stack. After iteration has started, format is
+    'flat', 'hierarchical', 'jsonl' or 'binary'.
+
+    ON_GROUP, if given, is called with the path (course, [subcourse,]
+    [subject]) of each course, subcourse and subject of a hierarchical dump
+    as it is entered, before its activities are yielded; so groups without
+    activities are seen, too. The other formats have no such groups.
+    """
+    CHUNK_SIZE = 1 << 16
+    WHITESPACE = ' \t\r\n'
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE, on_group=None):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.on_group = on_group
+        self.format = None
+
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        # buffer position that must be kept when compacting the buffer
+        self._mark = None
+
+    def _read_more(self, size=None):
+        if self._eof:
+            return False
+
+        keep = self._pos if self._mark is None else self._mark
+        if keep > self.chunk_size:
+            self._buf = self._buf[keep:]
+            self._pos -= keep
+            if self._mark is not None:
+                self._mark -= keep
+
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self._eof = True
+            return False
+
+        self._buf += data
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) \
+                    and self._buf[self._pos] in self.WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read_more():
+                return None
+
+    def _error(self, message):
+        return ValueError(f'{getattr(self.f, "name", "<coursedump>")}: '
+                          f'{message}')
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c is None or c not in chars:
+            raise self._error(f'expected {chars!r}, got '
+                              f'{"end of file" if c is None else repr(c)}')
+
+        self._pos += 1
+        return c
+
+    def _decode(self):
+        if self._peek() is None:
+            raise self._error('unexpected end of file')
+
+        while True:
+            try:
+                (obj, end) = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                # read as much as there is already, so that a huge value
+                # is only decoded a logarithmic number of times
+                self._read_more(max(self.chunk_size,
+                                    len(self._buf) - self._pos))
+                continue
+
+            # a number at the end of the buffer might go on
+            if end == len(self._buf) \
+               and not isinstance(obj, (dict, list, str)) \
+               and self._read_more():
+                continue
+
+            self._pos = end
+            return obj
+
+    def _list_items(self):
+        self._expect('[')
+        first = True
+        while True:
+            if self._peek() == ']':
+                self._pos += 1
+                return
+            if not first:
+                self._expect(',')
+            first = False
+
+            yield self._decode()
+
+    def _activities(self, locator):
+        for activity in self._list_items():
+            if not isinstance(activity, dict):
+                logging.getLogger('coursedump schema') \
+                    .warning('Activities must be dicts')
+                continue
+
+            yield (locator, activity)
+
+    def _flat_activity(self, activity):
+        try:
+            return (activity_locator(activity), activity)
+        except (KeyError, TypeError):
+            logging.getLogger('coursedump schema') \
+                .warning('Flat activities need a course and a subject')
+            return None
+
+    def _flat(self):
+        for activity in self._list_items():
+            located = self._flat_activity(activity)
+            if located is not None:
+                yield located
+
+    def _jsonl(self):
+        while self._peek() is not None:
+            located = self._flat_activity(self._decode())
+            if located is not None:
+                yield located
+
+    def _hierarchical(self):
+        self._expect('{')
+
+        # keys of the open dicts below the top-level one: (course,
+        # subcourse?)
+        path = []
+        first = True
+        while True:
+            c = self._peek()
+            if c == '}':
+                self._pos += 1
+                if not path:
+                    return
+
+                path.pop()
+                first = False
+                continue
+
+            if not first:
+                self._expect(',')
+            first = False
+
+            key = self._decode()
+            self._expect(':')
+
+            c = self._peek()
+            if c == '{':
+                if len(path) >= 2:
+                    logging.getLogger('coursedump schema') \
+                        .warning('Course-dump too deep')
+                    self._decode()
+                    continue
+
+                self._pos += 1
+                path.append(key)
+                first = True
+
+                if self.on_group is not None:
+                    self.on_group(tuple(path))
+            elif c == '[':
+                if len(path) == 1:
+                    locator = (path[0], None, key)
+                elif len(path) == 2:
+                    locator = (path[0], path[1], key)
+                else:
+                    logging.getLogger('coursedump schema') \
+                        .warning('Course-dump depth incorrect')
+                    self._decode()
+                    continue
+
+                if self.on_group is not None:
+                    self.on_group(tuple(path) + (key,))
+                yield from self._activities(locator)
+            else:
+                logging.getLogger('coursedump schema') \
+                    .warning('Illegal bare atom')
+                self._decode()
+
+    # tells a hierarchical dump from JSON Lines: the values of a
+    # hierarchical dump's top-level dict are dicts, those of a flat activity
+    # never are
+    def _detect_object_format(self):
+        self._mark = self._pos
+        self._expect('{')
+
+        if self._peek() == '}':
+            fmt = 'hierarchical'
+        else:
+            self._decode()
+            self._expect(':')
+            fmt = 'hierarchical' if self._peek() == '{' else 'jsonl'
+
+        self._pos = self._mark
+        self._mark = None
+        return fmt
+
+    def __iter__(self):
+        binary = binary_stream(self.f)
+        if binary is not None:
+            self.format = 'binary'
+            yield from BinaryCoursedumpReader(binary)
+            return
+
+        c = self._peek()
+        if c is None:
+            self.format = 'jsonl'  # of a run that listed nothing
+            return
+        elif c == '[':
+            self.format = 'flat'
+            yield from self._flat()
+        elif c == '{':
+            self.format = self._detect_object_format()
+            if self.format == 'hierarchical':
+                yield from self._hierarchical()
+            else:
+                yield from self._jsonl()
+        else:
+            raise self._error(f'not a coursedump: starts with {c!r}')
+
+        if self._peek() is not None:
+            raise self._error('extra data after the coursedump')
+
+
+def iter_coursedump(f):
+    return iter(CoursedumpReader(f))
+
+
+# dumps OBJ like json.dump(..., indent=INDENT) would inside a container
+# nested LEVEL deep
+def dumps_nested(obj, indent, level):
+    return json.dumps(obj, indent=indent) \
+               .replace('\n', '\n' + ' ' * (indent * level))
+
+
+# Writes a JSON list item by item; the output is the same as that of
+# json.dump(list, f, indent=INDENT).
+class JSONListWriter:
+    def __init__(self, out, indent=4):
+        self.out = out
+        self.indent = indent
+        self._first = True
+
+        self.out.write('[')
+
+    def write(self, obj):
+        if self.indent is None:
+            self.out.write(('' if self._first else ', ') + json.dumps(obj))
+        else:
+            self.out.write(('\n' if self._first else ',\n')
+                           + ' ' * self.indent
+                           + dumps_nested(obj, self.indent, 1))
+        self._first = False
+
+    def close(self):
+        self.out.write(']' if self._first or self.indent is None else '\n]')
+
+
+class JSONLinesWriter:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, obj):
+        self.out.write(json.dumps(obj) + '\n')
+
+    def close(self):
+        pass
+
+
+class NotGroupedError(Exception):
+    def __init__(self, path):
+        super().__init__(f'{" / ".join(map(str, path))} shows up again after '
+                         f'other entries: the input isn\'t grouped')
+        self.path = path
+
+
+# Writes a hierarchical coursedump (or another tree of nested dicts, like a
+# completion overlay) entry by entry: write(PATH, ITEM) adds ITEM to the
+# container at PATH, a tuple of keys. With LEAF 'list', the innermost
+# containers are lists; with 'dict', items are (key, value) pairs. The output
+# is the same as that of json.dump(tree, f, indent=INDENT), as long as the
+# entries come grouped by their paths; NotGroupedError is raised when a
+# container that was already closed would have to be opened again.
+class HierarchicalWriter:
+    def __init__(self, out, indent=4, leaf='list'):
+        self.out = out
+        self.indent = indent
+        self.leaf = leaf
+
+        # keys, closing brackets and "no item yet" flags of the open
+        # containers; the top-level dict isn't in _path
+        self._path = []
+        self._closers = ['}']
+        self._first = [True]
+        self._closed = set()
+
+        self.out.write('{')
+
+    def _begin_item(self):
+        self.out.write(('\n' if self._first[-1] else ',\n')
+                       + ' ' * (self.indent * len(self._closers)))
+        self._first[-1] = False
+
+    def _close_container(self):
+        depth = len(self._closers) - 1
+        if not self._first.pop():
+            self.out.write('\n' + ' ' * (self.indent * depth))
+        self.out.write(self._closers.pop())
+
+        if self._path:
+            self._closed.add(tuple(self._path))
+            self._path.pop()
+
+    def _open_path(self, path):
+        common = 0
+        while common < min(len(path), len(self._path)) \
+                and path[common] == self._path[common]:
+            common += 1
+
+        while len(self._path) > common:
+            self._close_container()
+
+        for (i, key) in enumerate(path[common:], common):
+            if tuple(path[:i + 1]) in self._closed:
+                raise NotGroupedError(path[:i + 1])
+
+            is_leaf = i == len(path) - 1 and self.leaf == 'list'
+            self._begin_item()
+            self.out.write(json.dumps(key) + ': ' + ('[' if is_leaf else '{'))
+
+            self._path.append(key)
+            self._closers.append(']' if is_leaf else '}')
+            self._first.append(True)
+
+    def write(self, path, item):
+        self._open_path(tuple(path))
+
+        self._begin_item()
+        level = len(self._closers)
+        if self.leaf == 'list':
+            self.out.write(dumps_nested(item, self.indent, level))
+        else:
+            (key, value) = item
+            self.out.write(json.dumps(key) + ': '
+                           + dumps_nested(value, self.indent, level))
+
+    def close(self):
+        while self._closers:
+            self._close_container()
+
+
+# F itself if it can be rewound, otherwise (e.g. for a pipe) a temporary file
+# with its content
+def rewindable(f):
+    if f.seekable():
+        return f
+
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(getattr(f, 'buffer', f), copy)
+    copy.seek(0)
+    return io.TextIOWrapper(copy, encoding='utf-8')
+
+
+# Writes the coursedump F to OUT with WRITE_STREAM(activities, out), which
+# needs the activities grouped by course, subcourse and subject (see
+# HierarchicalWriter). Its output is kept in a temporary file until it has
+# succeeded; if F turns out not to be grouped, it is read again and written
+# with WRITE_IN_MEMORY(activities, out) instead.
+def write_hierarchical(f, out, write_stream, write_in_memory):
+    f = rewindable(f)
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as tmp:
+        try:
+            write_stream(CoursedumpReader(f), tmp)
+        except NotGroupedError as e:
+            logging.getLogger('coursedump schema').info(
+                f'{e}; reading it into memory')
+            f.seek(0)
+            write_in_memory(CoursedumpReader(f), out)
+            return
+
+        tmp.seek(0)
+        shutil.copyfileobj(tmp, out)
+
+
+# writes activities to OUT in FORMAT (as found in CoursedumpReader.format):
+# write(locator, activity) takes activities with or without locator keys.
+# Binary coursedumps go to OUT's binary buffer if it is a text file.
+class CoursedumpWriter:
+    def __init__(self, out, fmt):
+        self.format = fmt
+        if fmt == 'binary':
+            self._writer = BinaryCoursedumpWriter(getattr(out, 'buffer', out))
+        elif fmt == 'hierarchical':
+            self._writer = HierarchicalWriter(out)
+        elif fmt == 'jsonl':
+            self._writer = JSONLinesWriter(out)
+        else:
+            self._writer = JSONListWriter(out)
+
+    def write(self, locator, activity):
+        if self.format == 'binary':
+            self._writer.write(locator, activity)
+        elif self.format == 'hierarchical':
+            self._writer.write(locator_path(locator), activity)
+        else:
+            self._writer.write(as_flat(activity, locator))
+
+    def close(self):
+        self._writer.close()
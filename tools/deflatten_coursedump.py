@@ -3,6 +3,13 @@ import argparse
 import json
 import sys
 
+try:
+    from .coursedump_io import (CoursedumpReader, HierarchicalWriter,
+                                as_flat, locator_path, write_hierarchical)
+except ImportError:  # run as a script
+    from coursedump_io import (CoursedumpReader, HierarchicalWriter,
+                               as_flat, locator_path, write_hierarchical)
+
 
 def deflatten_coursedump(coursedump):
     result = {}
@@ -24,14 +31,40 @@ def deflatten_coursedump(coursedump):
     return result
 
 
+# writes ACTIVITIES, ((course, subcourse, subject), activity) pairs, as a
+# hierarchical coursedump without keeping them in memory; they must come
+# grouped by course, subcourse and subject, as the scraper lists them.
+def deflatten_coursedump_stream(activities, out):
+    writer = HierarchicalWriter(out)
+    for (locator, activity) in activities:
+        writer.write(locator_path(locator), as_flat(activity, locator))
+    writer.close()
+
+
+# the same for ACTIVITIES in any order, which are all kept in memory
+def deflatten_coursedump_in_memory(activities, out):
+    coursedump = [as_flat(activity, locator)
+                  for (locator, activity) in activities]
+    json.dump(deflatten_coursedump(coursedump), out, indent=4)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument('coursedump', type=argparse.FileType('r'), nargs='?',
                         default=sys.stdin)
+    parser.add_argument('--ungrouped', action='store_true',
+                        help=('Read the input into memory right away instead '
+                              'of trying to stream it first, for input that '
+                              'isn\'t grouped by course, subcourse and '
+                              'subject'))
 
     args = parser.parse_args()
 
-    coursedump = json.load(args.coursedump)
-
-    json.dump(deflatten_coursedump(coursedump), sys.stdout, indent=4)
+    if args.ungrouped:
+        deflatten_coursedump_in_memory(CoursedumpReader(args.coursedump),
+                                       sys.stdout)
+    else:
+        write_hierarchical(args.coursedump, sys.stdout,
+                           deflatten_coursedump_stream,
+                           deflatten_coursedump_in_memory)
@@ -1,27 +1,52 @@
 #!/usr/bin/env python3
-import json
 import sys
 import logging
 import argparse
 
+try:
+    from .coursedump_io import (CoursedumpReader, JSONListWriter, as_flat,
+                                locate)
+except ImportError:  # run as a script
+    from coursedump_io import (CoursedumpReader, JSONListWriter, as_flat,
+                               locate)
 
+
+# Walks OBJ depth-first, calling VISITOR's enter_*/exit_*/accept_atom
+# methods. Pending steps are kept on an explicit stack, so deeply nested
+# input can't exhaust Python's recursion limit.
 def walk_json(visitor, obj):
+    stack = [(walk_json_value, obj)]
+    while stack:
+        (step, arg) = stack.pop()
+        step(visitor, arg, stack)
+
+
+def walk_json_value(visitor, obj, stack):
     if isinstance(obj, dict):
         if visitor.enter_dict(obj):
-            for (key, value) in obj.items():
-                if visitor.enter_kv(key):
-                    walk_json(visitor, value)
-                    visitor.exit_kv()
-            visitor.exit_dict()
+            stack.append((walk_json_exit, visitor.exit_dict))
+            for item in reversed(list(obj.items())):
+                stack.append((walk_json_kv, item))
     elif isinstance(obj, list):
         if visitor.enter_list(obj):
-            for sobj in obj:
-                walk_json(visitor, sobj)
-            visitor.exit_list()
+            stack.append((walk_json_exit, visitor.exit_list))
+            for sobj in reversed(obj):
+                stack.append((walk_json_value, sobj))
     else:
         visitor.accept_atom(obj)
 
 
+def walk_json_kv(visitor, item, stack):
+    (key, value) = item
+    if visitor.enter_kv(key):
+        stack.append((walk_json_exit, visitor.exit_kv))
+        stack.append((walk_json_value, value))
+
+
+def walk_json_exit(visitor, exit_method, stack):
+    exit_method()
+
+
 class ActivityTupleBuilderVisitor:
     def __init__(self):
         self.result = []
@@ -70,11 +95,7 @@ class ActivityTupleBuilderVisitor:
         subcourse = self._stack[1] if len(self._stack) == 3 else None
         subject = self._stack[2] if len(self._stack) == 3 else self._stack[1]
 
-        activity['course'] = course
-        activity['subcourse'] = subcourse
-        activity['subject'] = subject
-
-        self.result.append(activity)
+        self.result.append(locate(activity, (course, subcourse, subject)))
 
     def accept_atom(self, _):
         logging.getLogger('coursedump schema') \
@@ -91,9 +112,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    coursedump = json.load(args.coursedump)
-    visitor = ActivityTupleBuilderVisitor()
-
-    walk_json(visitor, coursedump)
-
-    json.dump(visitor.result, sys.stdout, indent=4)
+    writer = JSONListWriter(sys.stdout)
+    for (locator, activity) in CoursedumpReader(args.coursedump):
+        writer.write(as_flat(activity, locator))
+    writer.close()
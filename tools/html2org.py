@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import logging
+import re
+import sqlite3
+import subprocess
+import sys
+import uuid
+from html.parser import HTMLParser
+
+
+# Converts the HTML of Moodle labels, pages and activity descriptions to Org
+# without starting a process for each of them. Only the markup the Moodle
+# editor produces is handled (paragraphs, line breaks, emphasis, links,
+# images, headings, lists, quotes, preformatted text); the output follows
+# that of pandoc --from html --to org, except that divs are dropped instead
+# of turning into #+begin_CLASS blocks. Anything else (tables, embedded
+# media, ...) raises UnsupportedMarkup: OrgWriter hands such fragments to
+# pandoc, many of them per process.
+
+# part of the keys of ConversionCache; to be bumped whenever the output of
+# html_to_org changes
+CONVERTER_VERSION = 2
+
+WIDTH = 72
+
+INLINE_MARKERS = {
+    'strong': '*', 'b': '*',
+    'em': '/', 'i': '/',
+    'u': '_', 'ins': '_',
+    's': '+', 'strike': '+', 'del': '+'
+}
+VERBATIM_TAGS = {'code', 'kbd', 'samp', 'tt'}
+TRANSPARENT_INLINE_TAGS = {'span', 'font', 'small', 'big', 'abbr', 'cite',
+                           'mark', 'label', 'time', 'nobr', 'q'}
+INLINE_TAGS = (set(INLINE_MARKERS) | VERBATIM_TAGS | TRANSPARENT_INLINE_TAGS
+               | {'a', 'img', 'br', 'wbr', 'sup', 'sub'})
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+TRANSPARENT_BLOCK_TAGS = {'html', 'body', 'div', 'section', 'article',
+                          'center', 'main', 'header', 'footer'}
+BLOCK_TAGS = (HEADING_TAGS | TRANSPARENT_BLOCK_TAGS
+              | {'p', 'ul', 'ol', 'li', 'blockquote', 'pre', 'hr'})
+
+# dropped with their content, like pandoc does
+DROPPED_TAGS = {'head', 'title', 'meta', 'link', 'script', 'style'}
+
+VOID_TAGS = {'br', 'wbr', 'img', 'hr', 'meta', 'link'}
+
+WHITESPACE = re.compile(r'[ \t\n\r\f]+')
+# words that would start a heading, keyword, table or list item if a line
+# began with them
+UNSAFE_LINE_START = re.compile(r'\*+$|#\+|\||:$|[-+]$|\d+[.)]$')
+
+# stands in for spaces that mustn't be broken at, like those in links
+NO_BREAK = '\x00'
+
+# mark where emphasis markup starts and ends until its neighbours are known;
+# Org only sees markup as such next to the characters in EMPHASIS_PRE and
+# EMPHASIS_POST, so a ZERO_WIDTH_SPACE goes in between otherwise. It also
+# keeps a line from starting with an UNSAFE_LINE_START word.
+MARKUP_START = '\x01'
+MARKUP_END = '\x02'
+ZERO_WIDTH_SPACE = '\u200b'
+EMPHASIS_PRE = set(' \t\n-(\'"{' + NO_BREAK + ZERO_WIDTH_SPACE)
+EMPHASIS_POST = set(' \t\n-.,;:!?\')}"\\' + NO_BREAK + ZERO_WIDTH_SPACE)
+
+
+class UnsupportedMarkup(Exception):
+    pass
+
+
+class Element:
+    __slots__ = ('tag', 'attrs', 'children')
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+
+
+# builds a tree of Elements and strings, closing elements the way browsers
+# do for the tags we support: a block closes an open paragraph, a list item
+# the previous one
+class TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Element(None, {})
+        self.stack = [self.root]
+
+    def _truncate_at(self, tag, stop_tags=()):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+            if self.stack[i].tag in stop_tags:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in INLINE_TAGS and tag not in BLOCK_TAGS \
+           and tag not in DROPPED_TAGS:
+            raise UnsupportedMarkup(tag)
+
+        if tag in BLOCK_TAGS:
+            self._truncate_at('p')
+        if tag == 'li':
+            self._truncate_at('li', ['ul', 'ol'])
+
+        element = Element(tag, dict(attrs))
+        self.stack[-1].children.append(element)
+        if tag not in VOID_TAGS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_TAGS:
+            self._truncate_at(tag)
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+
+def parse_html(html):
+    builder = TreeBuilder()
+    builder.feed(html)
+    builder.close()
+
+    return builder.root
+
+
+def text_content(node):
+    if isinstance(node, str):
+        return node
+    if node.tag in DROPPED_TAGS:
+        return ''
+    if node.tag == 'br':
+        return '\n'
+    return ''.join(map(text_content, node.children))
+
+
+def is_inline(node):
+    return isinstance(node, str) or node.tag in INLINE_TAGS \
+        or node.tag in DROPPED_TAGS
+
+
+# puts BEFORE and AFTER around CONTENT, keeping the spaces at its ends
+# outside (Org markup can't begin or end with one). Unless SEPARATE is false
+# (for markup that belongs to its word, like superscripts), it is marked to
+# be kept apart from touching words.
+def emphasize(content, before, after, separate=True):
+    core = content.strip(' ')
+    if not core:
+        return content
+
+    lead = content[:len(content) - len(content.lstrip(' '))]
+    trail = content[len(content.rstrip(' ')):]
+    if not separate:
+        return f'{lead}{before}{core}{after}{trail}'
+    return f'{lead}{MARKUP_START}{before}{core}{after}{MARKUP_END}{trail}'
+
+
+# replaces the markers of emphasize() by zero-width spaces where the markup
+# would touch a word, and drops them elsewhere
+def separate_markup(text):
+    if MARKUP_START not in text:
+        return text
+
+    out = []
+    for (i, c) in enumerate(text):
+        if c == MARKUP_START:
+            if out and out[-1] not in EMPHASIS_PRE:
+                out.append(ZERO_WIDTH_SPACE)
+        elif c == MARKUP_END:
+            following = text[i + 1:].lstrip(MARKUP_START + MARKUP_END)
+            if following and following[0] not in EMPHASIS_POST:
+                out.append(ZERO_WIDTH_SPACE)
+        else:
+            out.append(c)
+
+    return ''.join(out)
+
+
+def link_target(url):
+    return url.replace('[', '%5B').replace(']', '%5D')
+
+
+# the Org text of inline NODE; line breaks are '\n', spaces in links
+# NO_BREAK
+def render_inline(node):
+    if isinstance(node, str):
+        return WHITESPACE.sub(' ', node)
+
+    tag = node.tag
+    if tag in DROPPED_TAGS:
+        return ''
+    if tag not in INLINE_TAGS:
+        raise UnsupportedMarkup(f'{tag} inside inline markup')
+
+    if tag == 'br':
+        return '\n'
+    elif tag == 'wbr':
+        return ''
+    elif tag == 'img':
+        src = node.attrs.get('src')
+        return f'[[{link_target(src)}]]' if src else ''
+
+    content = ''.join(map(render_inline, node.children))
+    if tag in INLINE_MARKERS:
+        return emphasize(content, INLINE_MARKERS[tag], INLINE_MARKERS[tag])
+    elif tag in VERBATIM_TAGS:
+        return emphasize(WHITESPACE.sub(' ', text_content(node)), '=', '=')
+    elif tag == 'sup':
+        return emphasize(content, '^{', '}', False)
+    elif tag == 'sub':
+        return emphasize(content, '_{', '}', False)
+    elif tag == 'q':
+        return f'"{content}"'
+    elif tag == 'a':
+        href = node.attrs.get('href')
+        if not href:
+            return content
+
+        description = WHITESPACE.sub(' ', content.replace('\n', ' ')).strip()
+        if '[[' in description:
+            raise UnsupportedMarkup('link around an image or link')
+        if not description or description == href:
+            return f'[[{link_target(href)}]]'
+        return (f'[[{link_target(href)}]'
+                f'[{description.replace(" ", NO_BREAK)}]]')
+
+    return content
+
+
+def wrap_line(line, width):
+    if len(line) <= width:
+        return [line]
+
+    lines = []
+    current = ''
+    for word in line.split(' '):
+        if current and len(current) + 1 + len(word) > width \
+           and not UNSAFE_LINE_START.match(word):
+            lines.append(current)
+            current = word
+        else:
+            current = f'{current} {word}' if current else word
+    lines.append(current)
+
+    return lines
+
+
+# the Org paragraph of inline NODES, wrapped at WIDTH; None if it is empty
+def render_paragraph(nodes, width):
+    text = separate_markup(''.join(map(render_inline, nodes)))
+    text = re.sub(r' *\n *', '\n', re.sub(' +', ' ', text)).strip(' \n')
+    if not text:
+        return None
+
+    lines = []
+    for line in text.split('\n'):
+        if lines:
+            lines[-1] += '\\\\'
+        if UNSAFE_LINE_START.match(line.split(' ', 1)[0]):
+            line = ZERO_WIDTH_SPACE + line  # "- not a list"
+        lines.extend(wrap_line(line, width))
+
+    return '\n'.join(lines).replace(NO_BREAK, ' ')
+
+
+def indent(text, prefix):
+    return '\n'.join(prefix + line if line else line
+                     for line in text.split('\n'))
+
+
+def render_list(element, width):
+    items = []
+    for child in element.children:
+        if isinstance(child, str):
+            if child.strip():
+                raise UnsupportedMarkup('text directly inside a list')
+        elif child.tag == 'li':
+            items.append(child)
+        elif child.tag not in DROPPED_TAGS:
+            raise UnsupportedMarkup(f'{child.tag} directly inside a list')
+
+    # like pandoc, lists of items with paragraphs get blank lines between
+    # their items
+    loose = any(not isinstance(child, str) and child.tag == 'p'
+                for item in items for child in item.children)
+
+    try:
+        number = int(element.attrs.get('start') or 1)
+    except ValueError:
+        number = 1
+
+    rendered = []
+    for item in items:
+        marker = f'{number}. ' if element.tag == 'ol' else '- '
+        number += 1
+
+        blocks = render_blocks(item.children, width - len(marker))
+        content = ('\n\n' if loose else '\n').join(blocks)
+        rendered.append((marker + indent(content, ' ' * len(marker))[
+            len(marker):]).rstrip(' '))
+
+    return ('\n\n' if loose else '\n').join(rendered) or None
+
+
+def render_block(element, width):
+    tag = element.tag
+    if tag == 'p':
+        return render_blocks(element.children, width)
+    elif tag in TRANSPARENT_BLOCK_TAGS:
+        return render_blocks(element.children, width)
+    elif tag in HEADING_TAGS:
+        title = render_paragraph(element.children, sys.maxsize)
+        title = (title or '').replace('\\\\\n', ' ')
+        return ['*' * int(tag[1]) + ' ' + title]
+    elif tag in ['ul', 'ol']:
+        return [block for block in [render_list(element, width)] if block]
+    elif tag == 'li':
+        # a list item outside of a list
+        return render_blocks(element.children, width)
+    elif tag == 'blockquote':
+        return ['#+begin_quote\n'
+                + '\n\n'.join(render_blocks(element.children, width))
+                + '\n#+end_quote']
+    elif tag == 'pre':
+        text = text_content(element)
+        if text.startswith('\n'):
+            text = text[1:]  # ignored by browsers, too
+        return ['#+begin_example\n' + text.rstrip('\n')
+                + '\n#+end_example']
+    elif tag == 'hr':
+        return ['-----']
+
+    raise UnsupportedMarkup(tag)
+
+
+# the Org blocks of NODES: runs of inline nodes are paragraphs
+def render_blocks(nodes, width=WIDTH):
+    blocks = []
+    run = []
+
+    def end_run():
+        if not run:
+            return
+
+        paragraph = render_paragraph(run, width)
+        if paragraph is not None:
+            blocks.append(paragraph)
+        run.clear()
+
+    for node in nodes:
+        if is_inline(node):
+            run.append(node)
+        else:
+            end_run()
+            blocks.extend(render_block(node, width))
+    end_run()
+
+    return blocks
+
+
+# HTML to Org in-process; raises UnsupportedMarkup for markup it can't
+# convert
+def html_to_org(html):
+    blocks = render_blocks(parse_html(html).children)
+    return '\n\n'.join(blocks) + '\n' if blocks else ''
+
+
+def pandoc_html_to_org(html):
+    pandoc = subprocess.run(['pandoc', '--from', 'html', '--to', 'org'],
+                            stdout=subprocess.PIPE,
+                            input=html.encode('utf-8'))
+    return pandoc.stdout.decode('utf-8')
+
+
+# converts HTML FRAGMENTS with a single pandoc run: they are separated by
+# marker paragraphs, by which the output is split again. Fragments whose
+# markup swallowed a marker (like an unclosed list) make it fall back to a
+# run per fragment.
+def pandoc_html_to_org_batch(fragments):
+    if len(fragments) == 1:
+        return [pandoc_html_to_org(fragments[0])]
+
+    marker = f'html2org{uuid.uuid4().hex}'
+    org = pandoc_html_to_org(''.join(f'{fragment}\n<p>{marker}</p>\n'
+                                     for fragment in fragments))
+
+    parts = re.split(rf'^{marker}\n', org, flags=re.MULTILINE)
+    if len(parts) != len(fragments) + 1 or parts[-1].strip():
+        return list(map(pandoc_html_to_org, fragments))
+
+    return [part.strip('\n') + '\n' if part.strip() else ''
+            for part in parts[:-1]]
+
+
+# Org text without pandoc: the HTML as an export block
+def html_export_block(html):
+    return f'#+begin_export html\n{html.rstrip()}\n#+end_export\n'
+
+
+# Remembers the Org text of converted HTML between runs, keyed by a hash of
+# the HTML, the converter version and a variant (how the HTML was prepared
+# for pandoc). Entries that haven't been used for the longest time are
+# evicted when the cache grows beyond MAX_SIZE bytes of Org text.
+#
+# New entries and uses are written in one short transaction per
+# COMMIT_INTERVAL new entries (and by close()), so that several processes
+# can share a cache without waiting for each other for long.
+class ConversionCache:
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS conversions (
+        key TEXT PRIMARY KEY,
+        org TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_used INTEGER NOT NULL
+    )
+    '''
+    INDEX = '''
+    CREATE INDEX IF NOT EXISTS conversions_last_used
+    ON conversions (last_used)
+    '''
+    MAX_SIZE = 64 << 20
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path, max_size=MAX_SIZE):
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute(self.SCHEMA)
+        self.db.execute(self.INDEX)
+        self.max_size = max_size
+
+        (clock,) = self.db.execute(
+            'SELECT MAX(last_used) FROM conversions').fetchone()
+        # orders uses, across runs
+        self._clock = (clock or 0) + 1
+
+        # {key: (org, last used)} and {key: last used} not written yet
+        self._new = {}
+        self._used = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def key(html, variant=''):
+        return hashlib.sha256(
+            f'{CONVERTER_VERSION}\0{variant}\0{html}'.encode('utf-8')) \
+            .hexdigest()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, key):
+        if key in self._new:
+            self.hits += 1
+            return self._new[key][0]
+
+        row = self.db.execute('SELECT org FROM conversions WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._used[key] = self._tick()
+        return row[0]
+
+    def put(self, key, org):
+        self._new[key] = (org, self._tick())
+        if len(self._new) >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    # evicts the least recently used entries until the cache is 10% below
+    # its size limit, so that it doesn't happen on every commit
+    def _evict(self):
+        (size,) = self.db.execute(
+            'SELECT TOTAL(size) FROM conversions').fetchone()
+        if size <= self.max_size:
+            return
+
+        target = self.max_size * 0.9
+        evicted = []
+        for (key, entry_size) in self.db.execute(
+                'SELECT key, size FROM conversions ORDER BY last_used'):
+            if size <= target:
+                break
+            evicted.append((key,))
+            size -= entry_size
+
+        self.db.executemany('DELETE FROM conversions WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+
+    def commit(self):
+        if not self._new and not self._used:
+            return
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.executemany(
+                'UPDATE conversions SET last_used = ? WHERE key = ?',
+                [(used, key) for (key, used) in self._used.items()])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?)',
+                [(key, org, len(org.encode('utf-8')), used)
+                 for (key, (org, used)) in self._new.items()])
+            self._evict()
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+        self._new = {}
+        self._used = {}
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def log_cache_stats(stats):
+    logging.getLogger('conversion_cache').info(
+        f'{stats["hits"]} conversions reused, {stats["misses"]} converted, '
+        f'{stats["evictions"]} evicted')
+
+
+# A file-like object writing Org text to OUT. write_html() converts HTML
+# in-process where it can; the rest is converted by pandoc in batches of
+# BATCH_SIZE fragments, which delays the output after such a fragment until
+# its batch is converted (at the latest, by close()). PREPARE, if given, is
+# applied to fragments before they go to pandoc. With a ConversionCache,
+# HTML converted in an earlier run isn't converted again.
+class OrgWriter:
+    BATCH_SIZE = 64
+
+    def __init__(self, out, batch_size=BATCH_SIZE, cache=None):
+        self.out = out
+        self.batch_size = batch_size
+        self.cache = cache
+
+        self.converted = 0
+        self.fallbacks = 0
+
+        # output after the first fragment for pandoc: strings, and the
+        # indices of fragments in _fragments
+        self._pending = []
+        self._fragments = []
+        self._fragment_keys = []
+        self._have_pandoc = True
+
+    def write(self, text):
+        if self._pending:
+            self._pending.append(text)
+        else:
+            self.out.write(text)
+
+    def write_html(self, html, prepare=None):
+        key = None
+        if self.cache is not None:
+            key = ConversionCache.key(
+                html, '' if prepare is None else prepare.__name__)
+            org = self.cache.get(key)
+            if org is not None:
+                self.write(org)
+                return
+
+        try:
+            org = html_to_org(html)
+        except UnsupportedMarkup as e:
+            logging.getLogger('html2org').debug(
+                f'Converting with pandoc: unsupported {e}')
+        else:
+            self.converted += 1
+            if key is not None:
+                self.cache.put(key, org)
+            self.write(org)
+            return
+
+        self.fallbacks += 1
+        self._pending.append(len(self._fragments))
+        self._fragments.append(html if prepare is None else prepare(html))
+        self._fragment_keys.append(key)
+        if len(self._fragments) >= self.batch_size:
+            self.flush()
+
+    def _convert_fragments(self):
+        if self._have_pandoc:
+            try:
+                return pandoc_html_to_org_batch(self._fragments)
+            except FileNotFoundError:
+                logging.getLogger('html2org').warning(
+                    'pandoc not found; HTML it would convert is kept as '
+                    'export blocks')
+                self._have_pandoc = False
+
+        return list(map(html_export_block, self._fragments))
+
+    def flush(self):
+        if self._fragments:
+            org = self._convert_fragments()
+            for item in self._pending:
+                self.out.write(item if isinstance(item, str) else org[item])
+
+            # export blocks stand in for pandoc's output; they aren't kept
+            if self._have_pandoc:
+                for (key, fragment_org) in zip(self._fragment_keys, org):
+                    if key is not None:
+                        self.cache.put(key, fragment_org)
+
+            self._pending = []
+            self._fragments = []
+            self._fragment_keys = []
+
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=('Converts HTML to Org, in-process where possible and '
+                     'with pandoc otherwise'))
+    parser.add_argument('html', type=argparse.FileType('r'), nargs='?',
+                        default=sys.stdin,
+                        help='HTML file to convert')
+
+    args = parser.parse_args()
+
+    writer = OrgWriter(sys.stdout)
+    writer.write_html(args.html.read())
+    writer.close()
@@ -1,32 +1,129 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import sys
 
+try:
+    from .coursedump_io import (CoursedumpReader, CoursedumpWriter,
+                                load_coursedump)
+except ImportError:  # run as a script
+    from coursedump_io import (CoursedumpReader, CoursedumpWriter,
+                               load_coursedump)
 
-def locate_activity(overlay, course, subcourse, subject, name):
-    if subcourse is not None:
-        return overlay[course][subcourse][subject][name]
-    else:
-        return overlay[course][subject][name]
+
+def is_completion(obj):
+    return isinstance(obj, dict) and any(
+        key in obj and not isinstance(obj[key], (dict, list))
+        for key in ['complete', 'completed'])
+
+
+def completion_entry(completion):
+    return {
+        'complete': completion.get('complete'),
+        'completed': completion.get('completed')
+    }
+
+
+# Completion states of activities from one or more overlays, in a single
+# dict keyed by (course, subcourse, subject, name). An overlay is a
+# completion overlay (course -> [subcourse ->] subject -> name ->
+# completion, as made by coursedump2overlay.py) or a coursedump of any
+# shape. When several overlays have an entry for the same activity,
+# PRECEDENCE decides which one counts:
+#
+# - last: the overlay added last
+# - first: the overlay added first
+# - newest: the entry with the latest completion time ('completed'); one
+#   with a time beats one without, and of two times of different types, the
+#   overlay added last wins
+# - done: an entry saying the activity is complete beats one that doesn't;
+#   otherwise, the overlay added last
+class OverlayIndex:
+    PRECEDENCES = ['last', 'first', 'newest', 'done']
+
+    def __init__(self, precedence='last'):
+        if precedence not in self.PRECEDENCES:
+            raise ValueError(f'Unknown precedence {precedence}')
+
+        self.precedence = precedence
+        self.entries = {}
+
+    def _wins(self, new, old):
+        if self.precedence == 'first':
+            return False
+        elif self.precedence == 'newest':
+            if old['completed'] is None:
+                return True
+            if new['completed'] is None:
+                return False
+            if type(new['completed']) is not type(old['completed']):
+                return True  # incomparable (e.g. a time and a flag): last
+            return new['completed'] >= old['completed']
+        elif self.precedence == 'done':
+            return bool(new['complete']) or not old['complete']
+
+        return True
+
+    def add(self, key, completion):
+        entry = completion_entry(completion)
+        old = self.entries.get(key)
+        if old is None or self._wins(entry, old):
+            self.entries[key] = entry
+
+    def add_activities(self, activities):
+        for activity in activities:
+            self.add((activity['course'], activity.get('subcourse'),
+                      activity['subject'], activity['name']), activity)
+
+    # walks a completion overlay or a hierarchical coursedump with an
+    # explicit stack; completions sit below (course, [subcourse,] subject)
+    def add_tree(self, overlay):
+        stack = [((), overlay)]
+        while stack:
+            (path, obj) = stack.pop()
+
+            if isinstance(obj, list) and len(path) in [2, 3]:
+                for activity in obj:
+                    if isinstance(activity, dict) and 'name' in activity:
+                        self._add_at(path + (activity['name'],), activity)
+            elif isinstance(obj, dict) and len(path) < 4:
+                for (key, value) in reversed(list(obj.items())):
+                    if len(path) in [2, 3] and is_completion(value):
+                        self._add_at(path + (key,), value)
+                    else:
+                        stack.append((path + (key,), value))
+
+    def _add_at(self, path, completion):
+        if len(path) == 3:
+            (course, subject, name) = path
+            self.add((course, None, subject, name), completion)
+        else:
+            self.add(path, completion)
+
+    def add_overlay(self, overlay):
+        if isinstance(overlay, list):
+            self.add_activities(overlay)
+        else:
+            self.add_tree(overlay)
+
+    def lookup(self, locator, name):
+        (course, subcourse, subject) = locator
+        return self.entries.get((course, subcourse, subject, name))
+
+    def patch(self, activity, locator):
+        entry = self.lookup(locator, activity['name'])
+        if entry is not None:
+            activity['completed'] = entry['completed']
+            activity['complete'] = entry['complete']
 
 
 def patch_with_overlay(activities, overlay):
+    index = OverlayIndex()
+    index.add_overlay(overlay)
+
     # we reached the activities; patch them now
     for activity in activities:
-        name = activity['name']
-        subject = activity['subject']
-        course = activity['course']
-        subcourse = activity.get('subcourse')
-
-        try:
-            completed = locate_activity(overlay, course, subcourse,
-                                        subject, name)
-        except KeyError:
-            pass  # Nothing to patch with
-        else:
-            activity['completed'] = completed.get('completed')
-            activity['complete'] = completed.get('complete')
+        index.patch(activity, (activity['course'], activity.get('subcourse'),
+                               activity['subject']))
 
 
 if __name__ == '__main__':
@@ -37,9 +134,36 @@ if __name__ == '__main__':
     parser.add_argument('base', type=argparse.FileType('r'), nargs='?',
                         default=sys.stdin,
                         help='Course-dump (flat or hierarchical) to patch')
+    parser.add_argument('-O', '--overlay', type=argparse.FileType('r'),
+                        action='append', default=[],
+                        dest='more_overlays',
+                        help=('Another overlay to patch with (may be given '
+                              'several times); applied after the first'))
+    parser.add_argument('-p', '--precedence',
+                        choices=OverlayIndex.PRECEDENCES,
+                        default='last',
+                        help=('Which overlay counts for an activity that '
+                              'several overlays have an entry for'))
 
     args = parser.parse_args()
 
-    base = json.load(args.base)
-    patch_with_overlay(base, json.load(args.overlay))
-    json.dump(base, sys.stdout, indent=4)
+    index = OverlayIndex(args.precedence)
+    for overlay in [args.overlay] + args.more_overlays:
+        if overlay is not None:
+            index.add_overlay(load_coursedump(overlay))
+            overlay.close()
+
+    # the base is patched activity by activity and written out in its own
+    # format
+    reader = CoursedumpReader(args.base)
+    writer = None
+    for (locator, activity) in reader:
+        if writer is None:
+            writer = CoursedumpWriter(sys.stdout, reader.format)
+
+        index.patch(activity, locator)
+        writer.write(locator, activity)
+
+    if writer is None:
+        writer = CoursedumpWriter(sys.stdout, reader.format)
+    writer.close()
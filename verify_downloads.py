@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import os
+import os.path
+import sys
+
+from selenium_scraping.manifest import DownloadManifest, hash_file
+
+
+# the problem with the recorded file at PATH (relative to ROOT), or None
+def check_file(root, path, size, digest, quick):
+    try:
+        if os.path.getsize(os.path.join(root, path)) != size:
+            return 'size'
+        if not quick and hash_file(os.path.join(root, path)) != digest:
+            return 'changed'
+    except FileNotFoundError:
+        return 'missing'
+
+    return None
+
+
+# files below ROOT (relative to it) that aren't in the manifest; .part files
+# and the manifest itself aren't downloads
+def unrecorded_files(root, recorded, manifest_path):
+    manifest_path = os.path.realpath(manifest_path)
+    for (directory, _, files) in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            key = os.path.relpath(path, root)
+            if key not in recorded and not name.endswith('.part') \
+               and os.path.realpath(path) != manifest_path:
+                yield key
+
+
+# Checks every file in the manifest of ROOT, hashing JOBS at a time (biggest
+# first, so that one big file doesn't hold up the end). Yields (problem,
+# path) in the order of the manifest; problem is 'missing', 'size',
+# 'changed' or 'unrecorded'.
+def verify(manifest, manifest_path, root, jobs, quick=False):
+    entries = manifest.entries()
+    by_size = sorted(entries, key=lambda entry: -entry[1])
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = {path: executor.submit(check_file, root, path, size,
+                                         digest, quick)
+                   for (path, size, digest) in by_size}
+
+        for (path, _, _) in entries:
+            problem = futures[path].result()
+            if problem is not None:
+                yield (problem, path)
+
+    recorded = set(path for (path, _, _) in entries)
+    for path in unrecorded_files(root, recorded, manifest_path):
+        yield ('unrecorded', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=('Checks a download tree of LernplattformScraper.py '
+                     'against its manifest (--manifest) and prints the '
+                     'files that are missing, have changed (size, or hash '
+                     'otherwise) or are not recorded'))
+
+    parser.add_argument('manifest',
+                        help='Manifest of the download tree')
+    parser.add_argument('-d', '--download-dir', metavar='DOWNLOAD_DIRECTORY',
+                        dest='dl_dir',
+                        required=True,
+                        help='The download tree (-D of the scraper)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=os.cpu_count(),
+                        help='Files hashed in parallel (default: one per CPU)')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='Only compare sizes, without hashing files')
+    parser.add_argument('--record', action='store_true',
+                        help=('Add the files that are not recorded to the '
+                              'manifest (e.g. those of a tree downloaded '
+                              'without one), so they count as downloaded'))
+    parser.add_argument('--forget', action='store_true',
+                        help=('Remove missing or changed files and their '
+                              'entries, so that the next run downloads them '
+                              'again'))
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.manifest):
+        sys.exit(f'{sys.argv[0]}: {args.manifest}: no such file')
+
+    counts = {'missing': 0, 'size': 0, 'changed': 0, 'unrecorded': 0}
+    with DownloadManifest(args.manifest, args.dl_dir) as manifest:
+        for (problem, path) in verify(manifest, args.manifest, args.dl_dir,
+                                      args.jobs, args.quick):
+            counts[problem] += 1
+            print(f'{problem}\t{path}')
+
+            full_path = manifest.path(path)
+            if problem == 'unrecorded' and args.record:
+                manifest.record(full_path, None, None)
+            elif problem != 'unrecorded' and args.forget:
+                if problem != 'missing':
+                    os.remove(full_path)
+                manifest.forget(full_path)
+
+    print(f'{counts["missing"]} missing, {counts["size"]} with another size, '
+          f'{counts["changed"]} changed, {counts["unrecorded"]} unrecorded',
+          file=sys.stderr)
+
+    problems = sum(counts.values())
+    if args.record:
+        problems -= counts['unrecorded']
+    sys.exit(1 if problems else 0)